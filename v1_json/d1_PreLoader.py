@@ -4,58 +4,62 @@ import numpy
 # dir = os.path.join(datadir, dirname)
 
 class dataPreload():
-    def __init__(self, dir, dataName):
+    def __init__(self, dir, dataName, maxFiles=100):
         super().__init__()
         self.data = []
         self.dataSplit = {}  # if split data into 3 parts, it's not none
         self.classnum = 0
+        self.maxFiles = maxFiles  # maybe make pathnums smalller to Debug, None means no limit
 
         self.dataName = dataName
         self.dirpath = os.path.join(dir, dataName)
         assert os.path.isdir(dir), f'There is no {dir}'
 
-    def checkDir(self, path):
+    def scanDir(self, path):
+        # one os.scandir per dir, is_dir() uses the cached d_type instead of a stat per entry
         isAllFile = True
-        subFilepath = []
-        for i in os.listdir(path):
-            subdir = os.path.join(path, i)
-
-            # 1. whether dir or file, so just add it 
-            subFilepath.append(subdir)
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                isDir = entry.is_dir()
+                entries.append((entry.path, isDir))
+                if isDir:
+                    isAllFile = False
 
-            # 2. if there has a dir in the subdir, just false the isAllFile
-            if os.path.isdir(os.path.join(path, i)):
-                # print(f'{subdir} is a dir')
-                isAllFile = False
+        entries.sort()
+        return isAllFile, entries
 
-        # print('check end')
-        return isAllFile, sorted(subFilepath)
+    def checkDir(self, path):
+        isAllFile, entries = self.scanDir(path)
+        return isAllFile, [subdir for subdir, _ in entries]
 
     def findFile(self, path):
-        # 1. 查看子文件夹是文件夹还是文件
-        isAllFile, subFilepath = self.checkDir(path)
-        subFilepath = subFilepath[:100]  # maybe make pathnums smalller to Debug
-
-        # 2. 否则遍历当前子文件夹并查看所有子文件是否都是文件，不是的话就报错返回
-        if isAllFile:
-            # 1. check all items in subFilepath is file
-            assert all([os.path.isfile(i) for i in subFilepath]), 'Maybe there are files and dirs in the subdir'
-
-            # 2. must check the classname for the specifical datset
-            # if your dataset like the omnight, must change the classname
-            classname = subFilepath[0].split('/')[-2]
-
-            # 3. save the filepaths with their name and class
-            oneFiledata = {'path':subFilepath, 'class':f'{self.classnum}', 'classname':classname}
-            self.classnum += 1
-            self.data.append(oneFiledata)
-            # for i in oneFiledata.values():  # if you want, you can open it to check
-            #     print(i)
-
-        # 3. 如果子文件夹还是文件夹那么就递归进入
-        else:
-            while(len(subFilepath)):
-                self.findFile(subFilepath.pop(0))
+        # iterative depth-first walk, children are visited in sorted order like the old recursion
+        stack = [path]
+        while stack:
+            # 1. 查看子文件夹是文件夹还是文件
+            isAllFile, entries = self.scanDir(stack.pop())
+            if self.maxFiles is not None:
+                entries = entries[:self.maxFiles]
+
+            # 2. 叶节点文件夹，保存该类的所有文件
+            if isAllFile:
+                if not entries:
+                    continue
+
+                # must check the classname for the specifical datset
+                # if your dataset like the omnight, must change the classname
+                subFilepath = [subpath for subpath, _ in entries]
+                classname = os.path.basename(os.path.dirname(subFilepath[0]))
+
+                # save the filepaths with their name and class
+                oneFiledata = {'path':subFilepath, 'class':f'{self.classnum}', 'classname':classname}
+                self.classnum += 1
+                self.data.append(oneFiledata)
+
+            # 3. 如果子文件夹还是文件夹那么就继续深入，逆序入栈保证按顺序访问
+            else:
+                stack.extend(subpath for subpath, isDir in reversed(entries) if isDir)
 
     def SplitEveryClass(self):
         # split the data into trainset, valset, testset
@@ -82,14 +86,31 @@ class dataPreload():
 
         self.dataSplit = {'train':trainset, 'val':valset, 'test':testset}
 
+    @staticmethod
+    def dumpList(file, items):
+        # write a json list item by item, the output is the same as json.dump(list(items), file)
+        file.write('[')
+        for i, item in enumerate(items):
+            if i:
+                file.write(', ')
+            json.dump(item, file)
+        file.write(']')
+
     def saveData2Cache(self, savePath):
         # self.findFile(self.dirpath)
+        # stream every class/sample to the file instead of building the whole json string in memory
         with open(savePath, 'w') as file:
             if self.dataSplit:
-                json.dump(self.dataSplit, file)
+                file.write('{')
+                for i, (splitName, samples) in enumerate(self.dataSplit.items()):
+                    if i:
+                        file.write(', ')
+                    file.write(f'{json.dumps(splitName)}: ')
+                    self.dumpList(file, samples)
+                file.write('}')
             else:
                 assert len(self.data), 'There is no data to save'
-                json.dump(self.data, file)
+                self.dumpList(file, self.data)
 
     # know about the data
     @staticmethod
@@ -105,12 +126,13 @@ class dataPreload():
             for k, v in data.items():
                 print(f'{k}: ', len(v) if isinstance(v, list) else v)
 
-dir = '/data/data_wll/AMU-Tuning-main/dataJson'
-dataName = 'vggface2_224'
-savePath = os.path.join(dir, f'{dataName}.json')
+if __name__ == '__main__':
+    dir = '/data/data_wll/AMU-Tuning-main/dataJson'
+    dataName = 'vggface2_224'
+    savePath = os.path.join(dir, f'{dataName}.json')
 
-dPreloader = dataPreload(dir, dataName)
-# dPreloader.findFile(dPreloader.dirpath)
-# dPreloader.SplitEveryClass()
-# dPreloader.saveData2Cache(savePath)
-dataPreload.readCache(savePath)
\ No newline at end of file
+    dPreloader = dataPreload(dir, dataName)
+    # dPreloader.findFile(dPreloader.dirpath)
+    # dPreloader.SplitEveryClass()
+    # dPreloader.saveData2Cache(savePath)
+    dataPreload.readCache(savePath)
@@ -54,8 +54,7 @@ def load_and_save_images(json_path, output_dir):
                 # img = np.array(img)  # 将图像转为 numpy 数组
                 # CV 加载
                 img = cv.imread(imgPath)  # 使用 OpenCV 读取图像
-                img = cv.cvtColor(img, cv.COLOR_BGR2RGB)  # 将 BGR 转为 RGB 格式
-                img = np.array(img)
+                cv.cvtColor(img, cv.COLOR_BGR2RGB, dst=img)  # 原地将 BGR 转为 RGB 格式，不再复制中间数组
 
                 # 图像的名称可以从路径中提取，确保与原结构一致
                 imgName = os.path.basename(imgPath).split('.')[0] + '.npy'
@@ -0,0 +1,210 @@
+"""
+批量任务模块 - 从任务文件读取多个数据集和选择/划分配置，在进程池中并发运行
+"""
+import argparse
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from utils.logger import get_logger, setup_logger
+from utils.file_utils import read_yaml_file, write_yaml_file
+from core.processor import DatasetProcessor
+
+logger = get_logger()
+
+# 工作进程中的 {设备号: 信号量}，由进程池初始化函数设置
+_device_semaphores = {}
+
+def _init_worker(semaphores):
+    global _device_semaphores
+    _device_semaphores = semaphores
+
+def _device_of(path):
+    """路径所在的存储设备号"""
+    return os.stat(path).st_dev
+
+class _DeviceSlot:
+    """限制同一存储设备上同时进行的I/O密集阶段数"""
+
+    def __init__(self, path, enabled=True):
+        self.semaphore = _device_semaphores.get(_device_of(path)) if enabled else None
+
+    def __enter__(self):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+def _job_logger(args, name):
+    """为任务配置独立的日志文件 {log_file}/{name}.log，日志中带有任务名称"""
+    setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file,
+                 filename=f"{name}.log", reset=True, tag=name)
+    return os.path.join(args.log_file, f"{name}.log")
+
+def _run_scan(processor_cls, args, name):
+    """
+    扫描阶段（在工作进程中执行）: 生成完整数据集文件，供同一根目录上的任务共享
+
+    返回:
+    - 完整数据集文件的路径前缀（不含扩展名）
+    """
+    _job_logger(args, name)
+    p = processor_cls(args)
+    p.setup_storage()
+    with _DeviceSlot(args.root_dir):
+        DatasetProcessor(p.args).generate_full_index(args.class_depth, args.class_pattern, args.probe_headers)
+    return p.args.full_data_path
+
+def _run_job(processor_cls, args, name):
+    """
+    选择/划分阶段（在工作进程中执行），复用扫描阶段生成的完整数据集文件
+
+    返回:
+    - 任务报告字典，失败时记录错误而不抛出异常
+    """
+    started = datetime.now()
+    log_file = _job_logger(args, name)
+    report = {'name': name, 'root_dir': args.root_dir, 'output_dir': args.output_dir, 'log_file': log_file,
+              'started': started.strftime('%Y-%m-%d %H:%M:%S')}
+    try:
+        args.reuse_scan = True
+        p = processor_cls(args)
+        # 只有复制文件时这一阶段才大量读取数据集
+        with _DeviceSlot(args.root_dir, enabled=args.copy_files):
+            p.do_process()
+        report['status'] = 'done'
+        report['select_base_path'] = p.args.select_base_path
+        report['split_base_path'] = p.args.split_base_path
+        report['full_data_path'] = p.args.full_data_path
+    except Exception as e:
+        get_logger().error(f"任务 {name} 失败: {e}")
+        report['status'] = 'failed'
+        report['error'] = f"{type(e).__name__}: {e}"
+        report['traceback'] = traceback.format_exc()
+    finished = datetime.now()
+    report['finished'] = finished.strftime('%Y-%m-%d %H:%M:%S')
+    report['seconds'] = round((finished - started).total_seconds(), 3)
+    return report
+
+def load_jobs(job_file, parser):
+    """
+    读取任务文件
+
+    任务文件为YAML:
+        max_workers: 4          # 并发任务数
+        io_per_device: 2        # 每个存储设备上同时进行的I/O密集阶段数
+        defaults: {...}         # 所有任务共用的参数，键名与命令行参数相同
+        jobs:
+          - name: vgg_100       # 任务名称，用于日志和报告文件名
+            root_dir: /data/vggface2_224
+            num_classes: 100
+
+    参数:
+    - job_file: 任务文件路径
+    - parser: main中的命令行参数解析器，提供参数默认值
+
+    返回:
+    - (任务设置字典, [(任务名称, argparse.Namespace), ...])
+    """
+    spec = read_yaml_file(job_file)
+    base = vars(parser.parse_args([]))
+    defaults = spec.get('defaults') or {}
+
+    jobs = []
+    for i, job in enumerate(spec.get('jobs') or []):
+        values = {**defaults, **job}
+        name = str(values.pop('name', f"job{i}"))
+        unknown = sorted(set(values) - set(base))
+        if unknown:
+            raise ValueError(f"任务 {name} 中有未知参数: {unknown}")
+        args = argparse.Namespace(**{**base, **values})
+        args.command = 'run'
+        jobs.append((name, args))
+
+    names = [name for name, _ in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"任务名称重复: {names}")
+    return spec, jobs
+
+def run_batch(job_file, parser, processor_cls, max_workers=None, io_per_device=None):
+    """
+    并发运行任务文件中的全部任务
+
+    - 根目录和扫描参数相同的任务共享一次扫描，扫描完成后这些任务才开始；完整数据集文件写在组内
+      第一个任务的输出目录中，其他任务（包括输出目录不同的任务）从那里读取
+    - 同一存储设备上同时进行的扫描（以及复制文件的任务）不超过 io_per_device 个
+    - 每个任务在工作进程中使用独立的日志文件，完成后写出 {output_dir}/{name}_report.yaml，
+      全部任务的汇总写到任务文件旁的 {job_file}_report.yaml
+
+    参数:
+    - job_file: 任务文件路径
+    - parser: 命令行参数解析器
+    - processor_cls: 处理流程类（main中的MyProcessor）
+    - max_workers: 并发进程数，为None时使用任务文件中的设置或CPU核数
+    - io_per_device: 每个设备的I/O并发数，为None时使用任务文件中的设置，默认2
+
+    返回:
+    - {任务名称: 报告字典}
+    """
+    spec, jobs = load_jobs(job_file, parser)
+    max_workers = max_workers or spec.get('max_workers') or os.cpu_count()
+    io_per_device = io_per_device or spec.get('io_per_device') or 2
+
+    # 按根目录和扫描参数分组，输出目录不参与分组
+    scan_groups = {}
+    for name, args in jobs:
+        key = (os.path.abspath(args.root_dir), args.class_depth, args.class_pattern, args.probe_headers, args.storage)
+        scan_groups.setdefault(key, []).append((name, args))
+
+    devices = {_device_of(args.root_dir) for _, args in jobs}
+    semaphores = {device: multiprocessing.Semaphore(io_per_device) for device in devices}
+    logger.info(f"批量任务开始: {len(jobs)} 个任务, {len(scan_groups)} 次扫描, {len(devices)} 个存储设备, "
+                f"{max_workers} 个进程")
+
+    reports = {}
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(semaphores,)) as pool:
+        scans = {}
+        for i, (key, group) in enumerate(scan_groups.items()):
+            _, args = group[0]
+            scans[pool.submit(_run_scan, processor_cls, argparse.Namespace(**vars(args)), f"scan{i}")] = key
+        running = {}
+        pending = set(scans)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in scans:
+                    group = scan_groups[scans[future]]
+                    error = future.exception()
+                    for name, args in group:
+                        if error is not None:
+                            reports[name] = {'name': name, 'root_dir': args.root_dir, 'status': 'failed',
+                                             'error': f"扫描失败: {type(error).__name__}: {error}"}
+                            logger.error(f"任务 {name} 的扫描失败: {error}")
+                            continue
+                        args.scan_data_path = future.result()
+                        job = pool.submit(_run_job, processor_cls, args, name)
+                        running[job] = name
+                        pending.add(job)
+                else:
+                    report = future.result()
+                    reports[report['name']] = report
+                    logger.info(f"任务 {report['name']} {report['status']}, 用时 {report['seconds']} 秒")
+
+    for name, args in jobs:
+        write_yaml_file(os.path.join(args.output_dir, f"{name}_report.yaml"), reports[name])
+    summary = {
+        'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'job_file': job_file,
+        'done': sum(1 for report in reports.values() if report['status'] == 'done'),
+        'failed': sum(1 for report in reports.values() if report['status'] == 'failed'),
+        'jobs': {name: {key: value for key, value in reports[name].items() if key != 'traceback'}
+                 for name, _ in jobs},
+    }
+    write_yaml_file(os.path.splitext(job_file)[0] + '_report.yaml', summary)
+    logger.info(f"批量任务结束: 成功 {summary['done']} 个, 失败 {summary['failed']} 个")
+    return reports
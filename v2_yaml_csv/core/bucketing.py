@@ -0,0 +1,166 @@
+"""
+宽高比分桶模块 - 按清单中记录的图像尺寸分桶，预先生成每个epoch的批次索引
+"""
+from datetime import datetime
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_csv_columns, write_yaml_file
+from utils.locking import atomic_write
+
+logger = get_logger()
+
+class BatchPlanner:
+    """
+    宽高比分桶的批次规划器
+
+    每个样本按log(宽/高)分到最近的桶，同一批次内的样本来自同一个桶。
+    每个epoch的规划是一个(批次数, batch_size)的int32数组，元素为清单行号，
+    不足一个批次的位置为-1；训练循环只需按行迭代，不需要在每一步排序或分组。
+    """
+
+    def __init__(self, batch_size, num_buckets=8, label_balanced=False, drop_last=False, seed=42):
+        """
+        参数:
+        - batch_size: 批次大小
+        - num_buckets: 桶的数量，桶中心取log宽高比的分位数，使各桶样本数大致相等
+        - label_balanced: 是否在桶内按标签轮流取样，使每个批次的标签尽量分散
+        - drop_last: 是否丢弃每个桶中不足一个批次的样本
+        - seed: 随机种子
+        """
+        self.batch_size = batch_size
+        self.num_buckets = num_buckets
+        self.label_balanced = label_balanced
+        self.drop_last = drop_last
+        self.seed = seed
+        self.bucket_rows = []
+        self.bucket_ratios = []
+        self.labels = None
+
+    def fit(self, widths, heights, labels):
+        """
+        根据尺寸分桶
+
+        参数:
+        - widths, heights: 每行的宽和高，为0表示未知，这些行不参与规划
+        - labels: 每行的标签
+        """
+        widths = np.asarray(widths, dtype=np.float64)
+        heights = np.asarray(heights, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+        known = np.flatnonzero((widths > 0) & (heights > 0))
+        if len(known) < len(widths):
+            logger.warning(f"{len(widths) - len(known)} 个样本没有尺寸信息，不参与分桶")
+        log_ratio = np.log(widths[known] / heights[known])
+
+        # 桶中心取分位数，重复的中心合并
+        centers = np.unique(np.quantile(log_ratio, (np.arange(self.num_buckets) + 0.5) / self.num_buckets)) \
+            if len(known) else np.zeros(0)
+        bucket = np.searchsorted((centers[1:] + centers[:-1]) / 2, log_ratio)
+
+        self.bucket_rows = [known[bucket == b] for b in range(len(centers))]
+        self.bucket_ratios = np.exp(centers).tolist()
+        logger.info(f"分桶完成: {len(centers)} 个桶, 宽高比 {[round(r, 3) for r in self.bucket_ratios]}, "
+                    f"样本数 {[len(rows) for rows in self.bucket_rows]}")
+        return self
+
+    def _order_bucket(self, rows, rng):
+        """打乱一个桶内的行；按标签均衡时各标签轮流出现"""
+        rows = rng.permutation(rows)
+        if not self.label_balanced or len(rows) == 0:
+            return rows
+        # 每个样本在其标签内的序号作为主键，标签的随机次序作为次键，排序后各标签轮流出现
+        labels = self.labels[rows]
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        starts = np.searchsorted(sorted_labels, sorted_labels, side='left')
+        rank_in_label = np.empty(len(rows), dtype=np.int64)
+        rank_in_label[order] = np.arange(len(rows)) - starts
+        unique_labels, label_ids = np.unique(labels, return_inverse=True)
+        tie = rng.permutation(len(unique_labels))[label_ids]
+        return rows[np.lexsort((tie, rank_in_label))]
+
+    def plan_epoch(self, epoch):
+        """
+        生成一个epoch的批次规划，结果只由(seed, epoch)决定
+
+        返回:
+        - (plan, bucket_ids): (批次数, batch_size)的int32行号数组和每个批次所属的桶
+        """
+        rng = np.random.default_rng([self.seed, epoch])
+        batches, bucket_ids = [], []
+        for b, rows in enumerate(self.bucket_rows):
+            rows = self._order_bucket(rows, rng)
+            num_full = len(rows) // self.batch_size
+            if num_full:
+                batches.append(rows[:num_full * self.batch_size].reshape(num_full, self.batch_size))
+                bucket_ids.append(np.full(num_full, b))
+            rest = rows[num_full * self.batch_size:]
+            if len(rest) and not self.drop_last:
+                padded = np.full((1, self.batch_size), -1, dtype=np.int64)
+                padded[0, :len(rest)] = rest
+                batches.append(padded)
+                bucket_ids.append(np.full(1, b))
+
+        if not batches:
+            return np.zeros((0, self.batch_size), dtype=np.int32), np.zeros(0, dtype=np.int32)
+        plan = np.concatenate(batches)
+        bucket_ids = np.concatenate(bucket_ids)
+        # 打乱批次顺序，使各桶交替出现
+        order = rng.permutation(len(plan))
+        return plan[order].astype(np.int32), bucket_ids[order].astype(np.int32)
+
+    def write_plans(self, plan_base_path, epochs, manifest=None):
+        """
+        写出每个epoch的规划
+
+        - {plan_base_path}_epoch{e}.npy: 批次行号数组
+        - {plan_base_path}_epoch{e}_buckets.npy: 每个批次所属的桶
+        - {plan_base_path}_plan.yaml: 桶的宽高比和样本数、各文件路径
+
+        返回:
+        - YAML路径
+        """
+        plan_info = {
+            'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'manifest': manifest,
+            'batch_size': self.batch_size,
+            'label_balanced': self.label_balanced,
+            'drop_last': self.drop_last,
+            'seed': self.seed,
+            'bucket_ratios': [round(ratio, 6) for ratio in self.bucket_ratios],
+            'bucket_counts': [len(rows) for rows in self.bucket_rows],
+            'epochs': [],
+        }
+        for epoch in range(epochs):
+            plan, bucket_ids = self.plan_epoch(epoch)
+            plan_path = f"{plan_base_path}_epoch{epoch}.npy"
+            with atomic_write(plan_path, 'wb') as f:
+                np.save(f, plan)
+            with atomic_write(f"{plan_base_path}_epoch{epoch}_buckets.npy", 'wb') as f:
+                np.save(f, bucket_ids)
+            plan_info['epochs'].append(plan_path)
+
+        yaml_path = f"{plan_base_path}_plan.yaml"
+        write_yaml_file(yaml_path, plan_info)
+        logger.info(f"批次规划已生成: {yaml_path}, {epochs} 个epoch")
+        return yaml_path
+
+def plan_manifest(csv_path, batch_size, epochs, **kwargs):
+    """
+    为带有width/height列的清单生成批次规划，规划文件与清单同名前缀
+
+    参数:
+    - csv_path: 清单路径（扫描时需开启文件头解析）
+    - batch_size: 批次大小
+    - epochs: epoch数
+    - kwargs: 传给 BatchPlanner 的其他参数
+
+    返回:
+    - 规划YAML路径
+    """
+    columns = read_csv_columns(csv_path, ['label', 'width', 'height'])
+    planner = BatchPlanner(batch_size, **kwargs).fit(columns['width'], columns['height'], columns['label'])
+    return planner.write_plans(csv_path[:-len('.csv')], epochs, manifest=csv_path)
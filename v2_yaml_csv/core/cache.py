@@ -0,0 +1,201 @@
+"""
+解码样本缓存 - 内存LRU层 + 磁盘层的两级缓存
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.archive import read_file, file_mtime_ns
+
+logger = get_logger()
+
+class SampleCache:
+    """
+    解码样本的两级缓存
+
+    缓存键为(根目录, 相对路径, 修改时间, 变换签名)，文件被修改或解码方式变化时自动失效。
+    - 内存层: 按字节数限制大小的LRU
+    - 磁盘层: 预解码的.npy数组，按字节数限制大小，按最近访问时间淘汰
+    """
+
+    def __init__(self, memory_bytes=2 << 30, disk_dir=None, disk_bytes=20 << 30):
+        """
+        初始化缓存
+
+        参数:
+        - memory_bytes: 内存层容量（字节），为0时不使用内存层
+        - disk_dir: 磁盘层目录，为None时不使用磁盘层
+        - disk_bytes: 磁盘层容量（字节）
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+
+        self._memory = OrderedDict()  # key -> ndarray
+        self._memory_used = 0
+        self._disk = OrderedDict()    # key -> 文件字节数，按访问顺序排列
+        self._disk_used = 0
+
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(root_dir, rel_path, mtime, transform_sig=''):
+        """由(根目录, 相对路径, 修改时间, 变换签名)生成缓存键"""
+        raw = f'{os.path.abspath(root_dir)}\0{rel_path}\0{mtime!r}\0{transform_sig}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _scan_disk(self):
+        """启动时扫描磁盘层，按文件访问时间恢复LRU顺序"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.disk_dir):
+            for filename in filenames:
+                if not filename.endswith('.npy'):
+                    continue
+                st = os.stat(os.path.join(dirpath, filename))
+                entries.append((st.st_atime, filename[:-4], st.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+
+        if entries:
+            logger.info(f"磁盘缓存已加载: {len(entries)} 个样本, {self._disk_used / (1 << 20):.1f} MB")
+        self._evict_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.npy')
+
+    def _put_memory(self, key, array):
+        """写入内存层并按容量淘汰最久未使用的样本。缓存的数组设为只读，避免调用方原地修改影响后续命中"""
+        if array.nbytes > self.memory_bytes:
+            return
+        array.flags.writeable = False
+        if key in self._memory:
+            self._memory_used -= self._memory.pop(key).nbytes
+        self._memory[key] = array
+        self._memory_used += array.nbytes
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= evicted.nbytes
+            self.stats['memory_evictions'] += 1
+
+    def _evict_disk(self):
+        """按容量淘汰磁盘层中最久未访问的样本"""
+        while self._disk_used > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            self.stats['disk_evictions'] += 1
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """
+        查询缓存
+
+        返回:
+        - 命中时返回只读数组（原地增强前需先复制），否则返回None
+        """
+        with self._lock:
+            array = self._memory.get(key)
+            if array is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return array
+            on_disk = self.disk_dir is not None and key in self._disk
+
+        if on_disk:
+            path = self._disk_path(key)
+            try:
+                array = np.load(path)
+                os.utime(path)
+            except (OSError, ValueError):
+                # 文件被外部删除或损坏，从索引中移除
+                with self._lock:
+                    self._disk_used -= self._disk.pop(key, 0)
+                array = None
+
+            if array is not None:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._put_memory(key, array)
+                    self.stats['disk_hits'] += 1
+                return array
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, array):
+        """写入缓存（同时写入内存层和磁盘层），写入内存层的数组会被设为只读"""
+        with self._lock:
+            self._put_memory(key, array)
+            write_disk = self.disk_dir is not None and key not in self._disk
+
+        if write_disk:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                if key not in self._disk:
+                    self._disk[key] = size
+                    self._disk_used += size
+                self._evict_disk()
+
+    def get_or_load(self, root_dir, rel_path, loader, transform_sig=''):
+        """
+        查询缓存，未命中时调用loader加载并写入缓存
+
+        参数:
+        - root_dir: 数据集根目录或归档
+        - rel_path: 相对路径
+        - loader: 加载函数，参数为文件的原始字节，返回解码后的数组
+        - transform_sig: 变换签名，区分同一文件的不同解码/变换方式
+
+        返回:
+        - 解码后的只读数组
+        """
+        key = self.make_key(root_dir, rel_path, file_mtime_ns(root_dir, rel_path), transform_sig)
+        array = self.get(key)
+        if array is None:
+            array = loader(read_file(root_dir, rel_path))
+            self.put(key, array)
+        return array
+
+    def summary(self):
+        """
+        返回缓存命中统计
+
+        返回:
+        - 包含命中次数、命中率和各层占用的字典
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            total = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / total if total else 0.0
+            stats['memory_items'] = len(self._memory)
+            stats['memory_used'] = self._memory_used
+            stats['disk_items'] = len(self._disk)
+            stats['disk_used'] = self._disk_used
+        return stats
@@ -0,0 +1,128 @@
+"""
+类别解析引擎 - 预编译类别正则，并尽量按目录而非按文件解析类别
+"""
+import os
+import re
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python 3.10 及更早版本
+    import sre_parse
+    import sre_constants
+
+# 解析结果为“需要逐文件解析”的目录
+PER_FILE = object()
+
+def _is_dir_scoped(pattern):
+    """
+    判断正则是否只依赖目录部分
+
+    满足以下条件时，正则在完整相对路径上的匹配结果与只在目录前缀(含末尾分隔符)上的
+    匹配结果相同，因此同一目录下的所有文件类别相同:
+    - 最后一个顶层元素是路径分隔符字面量，匹配必然结束在某个分隔符处
+    - 不含前瞻/后顾断言和行尾锚点，匹配不会查看分隔符之后的文件名
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return False
+
+    separators = {ord('/'), ord(os.sep)}
+    items = list(parsed)
+    if not items or items[-1][0] != sre_constants.LITERAL or items[-1][1] not in separators:
+        return False
+
+    forbidden_at = {sre_constants.AT_END, sre_constants.AT_END_LINE, sre_constants.AT_END_STRING}
+
+    def walk(node):
+        if isinstance(node, sre_parse.SubPattern):
+            for op, av in node:
+                if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                    return False
+                if op == sre_constants.AT and av in forbidden_at:
+                    return False
+                if not walk(av):
+                    return False
+        elif isinstance(node, (tuple, list)):
+            return all(walk(child) for child in node)
+        return True
+
+    return walk(parsed)
+
+class ClassResolver:
+    """
+    从相对路径解析类别
+
+    正则只编译一次。基于目录深度的规则和只依赖目录部分的正则，每个目录只解析一次，
+    目录下所有文件共用结果；依赖文件名的正则才回退到逐文件匹配。
+    解析规则与逐文件解析完全一致: 先尝试正则，不匹配时按目录深度取路径分段。
+    """
+
+    def __init__(self, class_depth=1, class_pattern=None, pattern_scope='auto'):
+        """
+        初始化类别解析器
+
+        参数:
+        - class_depth: 类别所在的目录层级（从0开始）
+        - class_pattern: 用于从路径中提取类别的正则表达式，第1个分组为类别
+        - pattern_scope: 正则作用范围，'auto'自动判断，'dir'强制按目录解析，'file'强制逐文件解析
+        """
+        if pattern_scope not in ('auto', 'dir', 'file'):
+            raise ValueError(f"不支持的正则作用范围: {pattern_scope}")
+
+        self.class_depth = class_depth
+        self.pattern = re.compile(class_pattern) if class_pattern else None
+        if self.pattern is None or pattern_scope == 'dir':
+            self.dir_scoped = True
+        elif pattern_scope == 'file':
+            self.dir_scoped = False
+        else:
+            self.dir_scoped = _is_dir_scoped(self.pattern)
+
+    def resolve(self, rel_path):
+        """
+        解析单个文件的类别
+
+        参数:
+        - rel_path: 相对于根目录的文件路径
+
+        返回:
+        - 类别名称，无法解析时返回None
+        """
+        if self.pattern is not None:
+            match = self.pattern.search(rel_path)
+            if match:
+                return match.group(1)
+
+        parts = rel_path.split(os.sep)
+        if len(parts) > self.class_depth:
+            return parts[self.class_depth]
+        return None
+
+    def resolve_dir(self, rel_dir):
+        """
+        解析目录下所有文件共同的类别
+
+        参数:
+        - rel_dir: 相对于根目录的目录路径，根目录为'.'
+
+        返回:
+        - 类别名称；目录下的文件无法解析类别时返回None；
+          类别依赖文件名时返回PER_FILE，需要对每个文件调用resolve
+        """
+        if not self.dir_scoped:
+            return PER_FILE
+
+        dir_parts = [] if rel_dir == os.curdir else rel_dir.split(os.sep)
+        if self.pattern is not None:
+            prefix = '' if not dir_parts else rel_dir + os.sep
+            match = self.pattern.search(prefix)
+            if match:
+                return match.group(1)
+
+        # 基于目录深度: 层级落在目录部分时整个目录同类，恰好落在文件名时需逐文件解析
+        if len(dir_parts) > self.class_depth:
+            return dir_parts[self.class_depth]
+        if len(dir_parts) == self.class_depth:
+            return PER_FILE
+        return None
@@ -0,0 +1,127 @@
+"""
+批量组装器 - 将样本直接解码/缩放到预分配的连续NHWC批缓冲区中
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_csv_file
+from utils.archive import read_file
+
+logger = get_logger()
+
+class BatchAssembler:
+    """
+    连续NHWC批量组装器
+
+    预先分配num_buffers个形状为(B, H, W, C)的uint8缓冲区组成环形队列，每个样本解码后
+    直接缩放写入所属批次的槽位，不再逐样本创建中间数组再堆叠；标签通过一次花式索引
+    从清单的标签数组中取出。
+
+    注意: 返回的批次是环形缓冲区的视图，取到第num_buffers个之后的批次时会被覆盖，
+    需要保留时请自行复制。
+    """
+
+    def __init__(self, manifest, root_dir, batch_size, height, width, channels=3,
+                 num_buffers=2, num_workers=8, interpolation=cv.INTER_LINEAR):
+        """
+        初始化批量组装器
+
+        参数:
+        - manifest: CSV路径或[(相对路径, 标签), ...]列表
+        - root_dir: 数据集根目录
+        - batch_size: 批大小B
+        - height, width: 输出图像尺寸H、W
+        - channels: 通道数C，1为灰度，3为RGB
+        - num_buffers: 环形缓冲区个数
+        - num_workers: 解码线程数
+        - interpolation: OpenCV缩放插值方式
+        """
+        rows = read_csv_file(manifest) if isinstance(manifest, str) else list(manifest)
+        self.root_dir = root_dir
+        self.paths = [rel_path for rel_path, _ in rows]
+        self.labels = np.asarray([label for _, label in rows], dtype=np.int64)
+
+        self.batch_size = batch_size
+        self.size = (width, height)
+        self.channels = channels
+        self.interpolation = interpolation
+        self.imread_flags = cv.IMREAD_GRAYSCALE if channels == 1 else cv.IMREAD_COLOR
+        self.num_workers = num_workers
+
+        self._buffers = [np.empty((batch_size, height, width, channels), dtype=np.uint8)
+                         for _ in range(num_buffers)]
+        self._next = 0
+
+    def __len__(self):
+        """样本数量"""
+        return len(self.paths)
+
+    def _fill_slot(self, out, rel_path):
+        """解码一个样本并缩放写入out（形状为(H, W, C)的槽位）"""
+        data = np.frombuffer(read_file(self.root_dir, rel_path), dtype=np.uint8)
+        img = cv.imdecode(data, self.imread_flags)
+        if img is None:
+            raise ValueError(f"无法解码图像: {rel_path}")
+
+        # 灰度图的槽位是(H, W, 1)，OpenCV需要二维的目标数组
+        dst = out[..., 0] if self.channels == 1 else out
+        if img.shape[1] == self.size[0] and img.shape[0] == self.size[1]:
+            if self.channels == 3:
+                cv.cvtColor(img, cv.COLOR_BGR2RGB, dst=dst)
+            else:
+                dst[...] = img
+        else:
+            cv.resize(img, self.size, dst=dst, interpolation=self.interpolation)
+            if self.channels == 3:
+                cv.cvtColor(dst, cv.COLOR_BGR2RGB, dst=dst)
+
+    def assemble(self, indices, pool=None):
+        """
+        按索引组装一个批次
+
+        参数:
+        - indices: 清单行号数组，长度不超过batch_size
+        - pool: 可选的线程池，为None时在当前线程解码
+
+        返回:
+        - (images, labels): images为形状(n, H, W, C)的连续uint8数组（环形缓冲区视图），
+          labels为int64数组
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        n = len(indices)
+        if n > self.batch_size:
+            raise ValueError(f"批次样本数 {n} 超过批大小 {self.batch_size}")
+
+        buffer = self._buffers[self._next]
+        self._next = (self._next + 1) % len(self._buffers)
+
+        if pool is None:
+            for slot, idx in enumerate(indices):
+                self._fill_slot(buffer[slot], self.paths[idx])
+        else:
+            futures = [pool.submit(self._fill_slot, buffer[slot], self.paths[idx])
+                       for slot, idx in enumerate(indices)]
+            for future in futures:
+                future.result()
+
+        return buffer[:n], self.labels[indices]
+
+    def iter_batches(self, order=None, drop_last=False):
+        """
+        按给定顺序迭代组装批次
+
+        参数:
+        - order: 样本行号顺序（如打乱后的索引或预先计算的批计划），为None时按清单顺序
+        - drop_last: 是否丢弃最后不足batch_size的批次
+
+        返回:
+        - 依次产出(images, labels)
+        """
+        order = np.arange(len(self.paths)) if order is None else np.asarray(order, dtype=np.int64)
+        stop = len(order) - len(order) % self.batch_size if drop_last else len(order)
+        with ThreadPoolExecutor(self.num_workers, thread_name_prefix='collate') as pool:
+            for start in range(0, stop, self.batch_size):
+                yield self.assemble(order[start:start + self.batch_size], pool)
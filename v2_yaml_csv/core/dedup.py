@@ -0,0 +1,375 @@
+"""
+去重模块 - 多进程计算内容哈希和感知哈希，查找完全重复和近似重复的图像
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import cv2 as cv
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from utils.logger import get_logger
+from utils.locking import atomic_write
+from utils.archive import read_file, file_size, file_mtime_ns
+
+logger = get_logger()
+
+# 按字节查表的popcount，numpy<2.0没有bitwise_count时使用
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount64(x):
+    """uint64数组逐元素的置位数"""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+def dhash(img):
+    """64位差值哈希: 缩放为9x8灰度图，比较水平相邻像素"""
+    small = cv.resize(img, (9, 8), interpolation=cv.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def _hash_chunk(root_dir, rel_paths):
+    """
+    计算一批图像的内容哈希和感知哈希（在工作进程中执行）
+
+    返回:
+    - [(sha1十六进制, dHash或None), ...]，无法读取的文件为(None, None)
+    """
+    results = []
+    for rel_path in rel_paths:
+        try:
+            data = read_file(root_dir, rel_path)
+        except OSError:
+            results.append((None, None))
+            continue
+        # 感知哈希只需要低分辨率灰度图，按1/4尺寸解码
+        img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_REDUCED_GRAYSCALE_4)
+        if img is None or img.size == 0:
+            img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
+        results.append((hashlib.sha1(data).hexdigest(), dhash(img) if img is not None and img.size else None))
+    return results
+
+def dup_groups_path(output_dir, dataset_name):
+    """重复组清单路径: {output_dir}/{dataset_name}_dups.csv"""
+    return os.path.join(output_dir, f"{dataset_name}_dups.csv")
+
+def read_dup_groups(output_dir, dataset_name):
+    """
+    读取重复组清单
+
+    返回:
+    - {相对路径: 组号}，没有重复组清单时为空字典
+    """
+    if dataset_name is None:
+        return {}
+    path = dup_groups_path(output_dir, dataset_name)
+    if not os.path.exists(path):
+        return {}
+    groups = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        next(f, None)
+        for line in f:
+            rel_path, _, group, _ = line.rstrip('\r\n').rsplit(',', 3)
+            groups[rel_path] = int(group)
+    return groups
+
+def _select(items, mask):
+    """按布尔掩码选择元素，items可以是列表或数组"""
+    if isinstance(items, np.ndarray):
+        return items[mask]
+    return [item for item, keep in zip(items, mask) if keep]
+
+def keep_groups_together(splits, groups_of):
+    """
+    把每个重复组的全部成员移到同一个划分，组归属于按划分顺序最先包含它的划分（训练集优先）
+
+    参数:
+    - splits: {划分名称: 元素列表或行号数组}，按优先级排列
+    - groups_of: 函数，元素序列 -> 组号数组，不属于任何组的元素为-1
+
+    返回:
+    - (新的划分字典, 被移动的元素数)
+    """
+    names = list(splits)
+    groups = {name: np.asarray(groups_of(splits[name]), dtype=np.int64).reshape(-1) for name in names}
+    max_group = max((int(g.max()) for g in groups.values() if len(g)), default=-1)
+    if max_group < 0:
+        return splits, 0
+
+    # 每个组的目标划分: 包含该组成员的最小划分序号
+    target = np.full(max_group + 1, len(names), dtype=np.int64)
+    for i, name in enumerate(names):
+        member = groups[name] >= 0
+        np.minimum.at(target, groups[name][member], i)
+
+    destinations = {}
+    moved = 0
+    for i, name in enumerate(names):
+        g = groups[name]
+        dest = np.where(g >= 0, target[np.maximum(g, 0)], i)
+        destinations[name] = dest
+        moved += int((dest != i).sum())
+    if not moved:
+        return splits, 0
+
+    result = {}
+    for j, name in enumerate(names):
+        parts = [_select(splits[src], destinations[src] == j) for src in names]
+        if isinstance(splits[name], np.ndarray):
+            result[name] = np.concatenate(parts)
+        else:
+            result[name] = [item for part in parts for item in part]
+    return result, moved
+
+class Deduplicator:
+    """
+    查找完全重复和近似重复的图像
+
+    - 完全重复: 文件内容的SHA-1相同
+    - 近似重复: 64位dHash的汉明距离不超过阈值。哈希按 threshold+1 段做多索引分桶，
+      由抽屉原理，距离不超过阈值的两个哈希至少有一段完全相同；每段按段值分桶后只在桶内两两比较，
+      比较次数与各桶大小的平方和成正比，不做全量两两比较，用向量化popcount计算距离
+
+    哈希按(相对路径, 文件大小, 修改时间)缓存在 {output_dir}/{dataset_name}_hash_cache.csv。
+    结果写入 {output_dir}/{dataset_name}_dups.csv，DatasetSplitter 会把同组样本放在同一个划分。
+    """
+
+    def __init__(self, root_dir, output_dir, dataset_name, threshold=4, num_workers=None, chunk_size=64,
+                 max_bucket=None, stat_workers=32):
+        """
+        参数:
+        - root_dir: 数据集根目录或归档
+        - output_dir: 输出目录
+        - dataset_name: 数据集名称
+        - threshold: 近似重复的最大汉明距离，为0时只合并dHash相同的图像
+        - num_workers: 哈希计算的进程数，为None时使用CPU核数
+        - chunk_size: 每个任务的文件数
+        - max_bucket: 桶的最大元素数，超过的桶跳过不比较（跳过的比较对数记录在skipped_pairs并输出警告），
+                      为None时比较全部桶
+        - stat_workers: 读取文件大小和修改时间的线程数
+        """
+        self.root_dir = root_dir
+        self.threshold = threshold
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.max_bucket = max_bucket
+        self.skipped_pairs = 0
+        self.stat_workers = stat_workers
+        self.cache_path = os.path.join(output_dir, f"{dataset_name}_hash_cache.csv")
+        self.groups_path = dup_groups_path(output_dir, dataset_name)
+
+    # 哈希 ----------------------------------------------------------------------------------------
+    def _load_cache(self):
+        """读取缓存: {相对路径: (大小, 修改时间, sha1, dHash或None)}"""
+        cache = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                next(f, None)
+                for line in f:
+                    rel_path, size, mtime_ns, sha1, phash = line.rstrip('\r\n').rsplit(',', 4)
+                    cache[rel_path] = (int(size), int(mtime_ns), sha1, int(phash, 16) if phash else None)
+        return cache
+
+    def _save_cache(self, cache):
+        with atomic_write(self.cache_path) as f:
+            f.write("rel_path,size,mtime_ns,sha1,dhash\n")
+            for rel_path, (size, mtime_ns, sha1, phash) in cache.items():
+                f.write(f"{rel_path},{size},{mtime_ns},{sha1},{'' if phash is None else format(phash, '016x')}\n")
+
+    def _stat(self, rel_path):
+        try:
+            return file_size(self.root_dir, rel_path), file_mtime_ns(self.root_dir, rel_path)
+        except OSError:
+            return None
+
+    def compute_hashes(self, rel_paths):
+        """
+        计算（或从缓存读取）每个文件的哈希
+
+        返回:
+        - (sha1列表, dHash的uint64数组, dHash是否有效的布尔数组)，无法读取的文件sha1为None
+        """
+        cache = self._load_cache()
+        with ThreadPoolExecutor(self.stat_workers) as pool:
+            stats = list(pool.map(self._stat, rel_paths))
+
+        sha1s = [None] * len(rel_paths)
+        phashes = [None] * len(rel_paths)
+        pending = []
+        new_cache = {}
+        for i, (rel_path, stat) in enumerate(zip(rel_paths, stats)):
+            if stat is None:
+                continue
+            cached = cache.get(rel_path)
+            if cached is not None and cached[:2] == stat:
+                sha1s[i], phashes[i] = cached[2], cached[3]
+                new_cache[rel_path] = cached
+            else:
+                pending.append(i)
+        logger.info(f"开始计算哈希: 共 {len(rel_paths)} 个文件, 缓存命中 {len(rel_paths) - len(pending)} 个, "
+                    f"需要计算 {len(pending)} 个")
+
+        chunks = [pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)]
+        if chunks:
+            with ProcessPoolExecutor(self.num_workers) as pool:
+                futures = [pool.submit(_hash_chunk, self.root_dir, [rel_paths[i] for i in chunk]) for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    for i, (sha1, phash) in zip(chunk, future.result()):
+                        sha1s[i], phashes[i] = sha1, phash
+                        if sha1 is not None:
+                            new_cache[rel_paths[i]] = (*stats[i], sha1, phash)
+        self._save_cache(new_cache)
+
+        valid = np.fromiter((phash is not None for phash in phashes), dtype=bool, count=len(phashes))
+        hashes = np.fromiter((phash or 0 for phash in phashes), dtype=np.uint64, count=len(phashes))
+        return sha1s, hashes, valid
+
+    # 近似重复搜索 ------------------------------------------------------------------------------------
+    def near_pairs(self, hashes):
+        """
+        多索引分桶查找汉明距离不超过阈值的哈希对
+
+        参数:
+        - hashes: 互不相同的uint64哈希数组
+
+        返回:
+        - (a, b): 哈希下标数组，每对只出现一次且a < b
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self.skipped_pairs = 0
+        if self.threshold <= 0 or len(hashes) < 2:
+            return empty
+
+        # 64位分为threshold+1段，各段宽度相差不超过1
+        num_blocks = min(self.threshold + 1, 64)
+        widths = [64 // num_blocks + (1 if i < 64 % num_blocks else 0) for i in range(num_blocks)]
+        pairs_a, pairs_b = [], []
+        skipped_buckets = 0
+        shift = 0
+        for width in widths:
+            block = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            shift += width
+            order = np.argsort(block, kind='stable')
+            sorted_block = block[order]
+            sorted_hashes = hashes[order]
+            starts = np.flatnonzero(np.concatenate(([True], sorted_block[1:] != sorted_block[:-1])))
+            sizes = np.diff(np.append(starts, len(order)))
+            # 每个位置之后同桶的元素数；跳过的桶记为0，不参与比较
+            if self.max_bucket is not None:
+                over = sizes > self.max_bucket
+                skipped_buckets += int(over.sum())
+                self.skipped_pairs += int((sizes[over] * (sizes[over] - 1) // 2).sum())
+            ends = np.repeat(starts + sizes, sizes)
+            remaining = ends - np.arange(len(order)) - 1
+            if self.max_bucket is not None:
+                remaining[np.repeat(over, sizes)] = 0
+
+            # 第d轮比较桶内相距d的元素对，只保留桶内还有相距d的后继的位置，
+            # 总比较次数等于各桶内的元素对数，内存与哈希数成正比
+            active = np.flatnonzero(remaining > 0)
+            d = 1
+            while len(active):
+                close = active[popcount64(sorted_hashes[active] ^ sorted_hashes[active + d]) <= self.threshold]
+                pairs_a.append(order[close])
+                pairs_b.append(order[close + d])
+                d += 1
+                active = active[remaining[active] >= d]
+
+        if self.skipped_pairs:
+            logger.warning(f"{skipped_buckets} 个桶超过 {self.max_bucket} 个元素，跳过 {self.skipped_pairs} 对比较，"
+                           f"其中的近似重复不会被发现")
+        if not pairs_a:
+            return empty
+        # 同一对可能在多个段中都相同，去重后返回
+        a, b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+        keys = np.unique(np.minimum(a, b).astype(np.int64) * len(hashes) + np.maximum(a, b))
+        return keys // len(hashes), keys % len(hashes)
+
+    def find_groups(self, rel_paths):
+        """
+        查找重复组
+
+        返回:
+        - (groups, exact): 每个文件的组号（不属于任何组为-1）和每个组是否为完全重复
+        """
+        n = len(rel_paths)
+        sha1s, hashes, valid = self.compute_hashes(rel_paths)
+        edges_a, edges_b = [], []
+
+        # 完全重复: sha1相同的文件连到该sha1第一次出现的文件
+        readable = np.flatnonzero(np.fromiter((sha1 is not None for sha1 in sha1s), dtype=bool, count=n))
+        if len(readable):
+            _, first, inverse = np.unique(np.array([sha1s[i] for i in readable]), return_index=True, return_inverse=True)
+            edges_a.append(readable)
+            edges_b.append(readable[first[inverse]])
+        exact_edges = sum(len(a) for a in edges_a)
+
+        # 近似重复: 只在互不相同的dHash之间搜索，相同dHash的文件连到代表文件
+        rows = np.flatnonzero(valid)
+        if len(rows):
+            unique_hashes, first, inverse = np.unique(hashes[rows], return_index=True, return_inverse=True)
+            representative = rows[first]
+            edges_a.append(rows)
+            edges_b.append(representative[inverse])
+            a, b = self.near_pairs(unique_hashes)
+            edges_a.append(representative[a])
+            edges_b.append(representative[b])
+
+        edges_a = np.concatenate(edges_a) if edges_a else np.zeros(0, dtype=np.int64)
+        edges_b = np.concatenate(edges_b) if edges_b else np.zeros(0, dtype=np.int64)
+        graph = coo_matrix((np.ones(len(edges_a), dtype=np.int8), (edges_a, edges_b)), shape=(n, n))
+        _, components = connected_components(graph, directed=False)
+
+        # 只保留成员数大于1的组，重新编号
+        sizes = np.bincount(components, minlength=1)
+        multi = sizes[components] > 1
+        groups = np.full(n, -1, dtype=np.int64)
+        _, groups[multi] = np.unique(components[multi], return_inverse=True)
+
+        # 组内sha1全部相同为完全重复
+        num_groups = int(groups.max()) + 1 if multi.any() else 0
+        exact = np.ones(num_groups, dtype=bool)
+        first_sha1 = {}
+        for i in np.flatnonzero(multi):
+            g = groups[i]
+            if first_sha1.setdefault(g, sha1s[i]) != sha1s[i]:
+                exact[g] = False
+        logger.debug(f"完全重复边 {exact_edges} 条")
+        return groups, exact
+
+    def run(self, data_list):
+        """
+        查找数据清单中的重复组并写出重复组清单
+
+        参数:
+        - data_list: [(相对路径, 标签), ...]或DatasetIndex
+
+        返回:
+        - [(相对路径, 标签, 组号, 是否完全重复), ...]
+        """
+        data_list = list(data_list)
+        groups, exact = self.find_groups([rel_path for rel_path, _ in data_list])
+        members = np.flatnonzero(groups >= 0)
+        members = members[np.argsort(groups[members], kind='stable')]
+        result = [(data_list[i][0], data_list[i][1], int(groups[i]), bool(exact[groups[i]])) for i in members]
+
+        with atomic_write(self.groups_path) as f:
+            f.write("rel_path,label,group,exact\n")
+            for rel_path, label, group, is_exact in result:
+                f.write(f"{rel_path},{label},{group},{int(is_exact)}\n")
+
+        # 跨类别的重复组意味着标签冲突，同一组分到不同划分则造成训练/验证泄漏
+        group_labels = {}
+        for _, label, group, _ in result:
+            group_labels.setdefault(group, set()).add(label)
+        cross_class = sum(1 for labels in group_labels.values() if len(labels) > 1)
+        logger.info(f"去重完成({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}): {len(exact)} 个重复组 "
+                    f"(完全重复 {int(exact.sum())} 个, 跨类别 {cross_class} 个), 涉及 {len(result)} 个文件, "
+                    f"跳过的近似重复比较 {self.skipped_pairs} 对, 重复组清单: {self.groups_path}")
+        return result
@@ -0,0 +1,286 @@
+"""
+紧凑数据集索引 - 用连续数组代替类别-图像字典和(路径, 标签)元组列表
+"""
+from array import array
+
+import numpy as np
+
+# 迭代时每次转换的样本数
+_ITER_CHUNK = 1 << 16
+
+def csv_row_spans(raw, source=''):
+    """
+    向量化地定位清单CSV中每个数据行的路径和标签，不为每行创建Python对象
+
+    标题行决定label之后的附加列数；路径中可能含逗号，每行倒数第 (附加列数 + 1) 个逗号分隔路径和标签。
+
+    参数:
+    - raw: 整个CSV文件的字节串（第一行为标题行）
+    - source: 出错时提示的文件路径
+
+    返回:
+    - (row_starts, label_sep, labels): 每行起始偏移、路径与标签之间逗号的偏移（即路径结束位置）、int64标签
+    """
+    buf = np.frombuffer(raw, dtype=np.uint8)
+
+    # 行边界: 第一个换行符之后为数据行
+    newlines = np.flatnonzero(buf == ord('\n'))
+    if len(newlines) == 0:
+        newlines = np.array([len(raw)], dtype=np.int64)
+    row_starts = newlines[:-1] + 1
+    row_ends = newlines[1:]
+    if newlines[-1] + 1 < len(raw):  # 最后一行没有换行符
+        row_starts = np.append(row_starts, newlines[-1] + 1)
+        row_ends = np.append(row_ends, len(raw))
+    keep = row_ends > row_starts
+    row_starts, row_ends = row_starts[keep], row_ends[keep]
+    # 兼容\r\n换行
+    row_ends = row_ends - (buf[np.maximum(row_ends - 1, 0)] == ord('\r'))
+
+    num_extra = max(raw[:newlines[0]].rstrip(b'\r').count(b',') - 1, 0)
+    commas = np.append(np.flatnonzero(buf == ord(',')), len(raw))
+    sep = np.searchsorted(commas, row_ends) - (num_extra + 1)
+    if len(sep) and (sep.min() < 0 or np.any(commas[sep] < row_starts)):
+        raise ValueError(f"清单中存在列数不足的行: {source}")
+    label_sep = commas[sep]
+    label_end = np.minimum(commas[sep + 1], row_ends)
+
+    # 逐位解析标签数字
+    label_len = label_end - label_sep - 1
+    labels = np.zeros(len(row_starts), dtype=np.int64)
+    for k in range(int(label_len.max()) if len(label_len) else 0):
+        has_digit = label_len > k
+        digits = buf[np.where(has_digit, label_sep + 1 + k, 0)].astype(np.int64) - ord('0')
+        labels = np.where(has_digit, labels * 10 + digits, labels)
+    return row_starts, label_sep, labels
+
+def _gather(blob, starts, lengths):
+    """把blob中的多个不定长片段拼接成一个字节串，返回(字节串, 长度为N+1的偏移数组)"""
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+    return np.frombuffer(blob, dtype=np.uint8)[positions].tobytes(), offsets
+
+class DatasetIndex:
+    """
+    基于数组的数据集索引
+
+    - path_blob: 所有相对路径UTF-8编码后拼接成的字节串
+    - offsets: int64数组，第i个路径为 path_blob[offsets[i]:offsets[i + 1]]
+    - labels: int32标签数组，按标签升序排列
+    - class_names: 类别名称列表，下标即标签
+    - class_offsets: CSR形式的类别偏移，标签c的样本为 [class_offsets[c], class_offsets[c + 1])
+    - columns: 可选的逐样本附加列，{列名: 长度为N的数组}
+
+    每个样本约占 路径字节数 + 12 字节，可以直接迭代得到(相对路径, 标签)元组，
+    能在原来使用数据列表的地方直接替换。
+    """
+    __slots__ = ('path_blob', 'offsets', 'labels', 'class_names', 'class_offsets', 'columns')
+
+    def __init__(self, path_blob, offsets, labels, class_names, columns=None):
+        """
+        参数:
+        - path_blob: 路径字节串
+        - offsets: 长度为N+1的路径偏移数组
+        - labels: 长度为N、按升序排列的标签数组
+        - class_names: 类别名称列表
+        - columns: 附加列字典
+        """
+        self.path_blob = bytes(path_blob)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.class_names = list(class_names)
+        self.columns = dict(columns or {})
+        if len(self.labels) and np.any(np.diff(self.labels) < 0):
+            raise ValueError("DatasetIndex 的标签必须按升序排列")
+        self.class_offsets = np.searchsorted(self.labels, np.arange(len(self.class_names) + 1)).astype(np.int64)
+
+    # 构建 ----------------------------------------------------------------------------------------
+    @classmethod
+    def from_class_to_images(cls, class_to_images, class_to_idx=None):
+        """
+        从类别-图像映射构建索引
+
+        参数:
+        - class_to_images: {类别名称: [相对路径, ...]}
+        - class_to_idx: {类别名称: 标签}，为None时按类别名称排序分配标签
+        """
+        builder = DatasetIndexBuilder()
+        for class_name, images in class_to_images.items():
+            builder.add(class_name, images)
+        return builder.build(class_to_idx)
+
+    @classmethod
+    def from_data_list(cls, data_list, class_names):
+        """
+        从[(相对路径, 标签), ...]列表构建索引
+
+        参数:
+        - data_list: 数据列表
+        - class_names: 类别名称列表，下标即标签
+        """
+        ordered = sorted(data_list, key=lambda x: x[1])
+        encoded = [rel_path.encode('utf-8') for rel_path, _ in ordered]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in encoded], out=offsets[1:])
+        labels = np.fromiter((label for _, label in ordered), dtype=np.int32, count=len(ordered))
+        return cls(b''.join(encoded), offsets, labels, class_names)
+
+    @classmethod
+    def from_csv(cls, csv_path, class_names):
+        """
+        直接从按标签排序的清单CSV构建索引，行解析和路径拼接都在数组上完成
+
+        参数:
+        - csv_path: 清单CSV路径
+        - class_names: 类别名称列表，下标即标签
+
+        返回:
+        - DatasetIndex（不含附加列，附加列用 read_csv_columns 读取）
+        """
+        with open(csv_path, 'rb') as f:
+            raw = f.read()
+        row_starts, label_sep, labels = csv_row_spans(raw, csv_path)
+        blob, offsets = _gather(raw, row_starts, label_sep - row_starts)
+        return cls(blob, offsets, labels, class_names)
+
+    # 访问 ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        """迭代(相对路径, 标签)元组"""
+        blob = self.path_blob
+        # 分块转换为Python整数，避免一次性为全部样本创建对象
+        for start in range(0, len(self), _ITER_CHUNK):
+            offsets = self.offsets[start:start + _ITER_CHUNK + 1].tolist()
+            labels = self.labels[start:start + _ITER_CHUNK].tolist()
+            for i, label in enumerate(labels):
+                yield blob[offsets[i]:offsets[i + 1]].decode('utf-8'), label
+
+    @property
+    def num_classes(self):
+        return len(self.class_names)
+
+    @property
+    def class_to_idx(self):
+        """{类别名称: 标签}"""
+        return {class_name: idx for idx, class_name in enumerate(self.class_names)}
+
+    def path(self, i):
+        """第i个样本的相对路径"""
+        return self.path_blob[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def paths(self, indices=None):
+        """按索引迭代相对路径，indices为None时迭代全部"""
+        if indices is None:
+            indices = range(len(self))
+        for i in indices:
+            yield self.path(i)
+
+    def class_counts(self):
+        """每个类别的样本数，int64数组"""
+        return np.diff(self.class_offsets)
+
+    def class_range(self, label):
+        """标签为label的样本行号范围 (start, end)"""
+        return int(self.class_offsets[label]), int(self.class_offsets[label + 1])
+
+    def class_paths(self, label):
+        """标签为label的所有相对路径列表"""
+        start, end = self.class_range(label)
+        return list(self.paths(range(start, end)))
+
+    def to_data_list(self):
+        """转换为[(相对路径, 标签), ...]列表"""
+        return list(self)
+
+    # 变换 ----------------------------------------------------------------------------------------
+    def take(self, indices, remap=None, class_names=None):
+        """
+        按行号取子集，可同时重新映射标签
+
+        参数:
+        - indices: 行号数组
+        - remap: int数组，新标签 = remap[旧标签]，为None时保持原标签
+        - class_names: 新的类别名称列表，remap不为None时必须提供
+
+        返回:
+        - 新的DatasetIndex（按新标签稳定排序）
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        labels = self.labels[indices]
+        if remap is not None:
+            labels = np.asarray(remap)[labels]
+            if class_names is None:
+                raise ValueError("重新映射标签时需要提供新的类别名称列表")
+        else:
+            class_names = self.class_names
+
+        order = np.argsort(labels, kind='stable')
+        indices, labels = indices[order], labels[order]
+
+        # 向量化地拼接不定长的路径片段
+        starts = self.offsets[indices]
+        blob, new_offsets = _gather(self.path_blob, starts, self.offsets[indices + 1] - starts)
+
+        columns = {name: np.asarray(values)[indices] for name, values in self.columns.items()}
+        return DatasetIndex(blob, new_offsets, labels, class_names, columns)
+
+    def nbytes(self):
+        """索引占用的字节数（近似）"""
+        return (len(self.path_blob) + self.offsets.nbytes + self.labels.nbytes + self.class_offsets.nbytes
+                + sum(np.asarray(values).nbytes for values in self.columns.values()))
+
+class DatasetIndexBuilder:
+    """
+    扫描时增量构建DatasetIndex
+
+    每个类别只保存一个路径字节缓冲和一个长度数组，不为每个文件创建Python字符串对象
+    """
+
+    def __init__(self):
+        self._blobs = {}    # 类别名称 -> bytearray
+        self._lengths = {}  # 类别名称 -> array('q')
+
+    def add(self, class_name, rel_paths):
+        """添加属于class_name的若干相对路径"""
+        blob = self._blobs.get(class_name)
+        if blob is None:
+            blob = self._blobs[class_name] = bytearray()
+            self._lengths[class_name] = array('q')
+        lengths = self._lengths[class_name]
+        for rel_path in rel_paths:
+            encoded = rel_path.encode('utf-8')
+            blob += encoded
+            lengths.append(len(encoded))
+
+    def __len__(self):
+        return sum(len(lengths) for lengths in self._lengths.values())
+
+    def counts(self):
+        """{类别名称: 样本数}"""
+        return {class_name: len(lengths) for class_name, lengths in self._lengths.items()}
+
+    def build(self, class_to_idx=None):
+        """
+        生成DatasetIndex
+
+        参数:
+        - class_to_idx: {类别名称: 标签}，为None时按类别名称排序分配标签（与read_dataset一致）
+        """
+        if class_to_idx is None:
+            class_to_idx = {class_name: idx for idx, class_name in enumerate(sorted(self._blobs))}
+        class_names = [None] * len(class_to_idx)
+        for class_name, idx in class_to_idx.items():
+            class_names[idx] = class_name
+
+        ordered = [class_name for class_name in class_names if class_name in self._blobs]
+        blob = b''.join(self._blobs[class_name] for class_name in ordered)
+        lengths = np.concatenate([np.frombuffer(self._lengths[class_name], dtype=np.int64) for class_name in ordered]) \
+            if ordered else np.zeros(0, dtype=np.int64)
+        labels = np.concatenate([np.full(len(self._lengths[class_name]), class_to_idx[class_name], dtype=np.int32)
+                                 for class_name in ordered]) if ordered else np.zeros(0, dtype=np.int32)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return DatasetIndex(blob, offsets, labels, class_names)
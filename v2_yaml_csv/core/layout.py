@@ -0,0 +1,120 @@
+"""
+数据集目录结构探测 - 通过随机下探少量路径推断类别层级和扩展名
+"""
+import os
+import random
+from collections import Counter
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# 探测时认为是图像的扩展名
+KNOWN_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp', '.gif', '.ppm', '.pgm')
+
+def _list_dir(path, max_entries):
+    """
+    列出目录中最多max_entries个条目，利用scandir缓存的d_type区分文件和目录
+
+    返回:
+    - 子目录路径列表和文件名列表
+    """
+    dirs, files = [], []
+    with os.scandir(path) as it:
+        for i, entry in enumerate(it):
+            if i >= max_entries:
+                break
+            if entry.is_dir():
+                dirs.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.name)
+    return dirs, files
+
+def detect_layout(root_dir, num_probes=32, seed=42, max_depth=16, max_entries=4096):
+    """
+    随机下探若干条路径，推断类别所在层级和图像扩展名
+
+    每次从根目录出发，在每层随机选择一个子目录向下，直到遇到包含图像文件的目录（叶目录），
+    叶目录即视为一个类别。每个目录最多读取max_entries个条目，总开销与数据集规模无关。
+
+    参数:
+    - root_dir: 数据集根目录
+    - num_probes: 下探次数
+    - seed: 随机种子
+    - max_depth: 最大下探深度
+    - max_entries: 每个目录最多读取的条目数
+
+    返回:
+    - (class_depth, extensions): 类别层级（从0开始）和扩展名元组
+    """
+    rng = random.Random(seed)
+    depth_counts = Counter()
+    ext_counts = Counter()
+
+    for _ in range(num_probes):
+        path, depth = root_dir, 0
+        while depth <= max_depth:
+            dirs, files = _list_dir(path, max_entries)
+            exts = Counter(os.path.splitext(name)[1].lower() for name in files)
+            image_exts = {ext: n for ext, n in exts.items() if ext in KNOWN_IMAGE_EXTENSIONS}
+            if image_exts:
+                depth_counts[depth] += 1
+                ext_counts.update(image_exts)
+                break
+            if not dirs:
+                break
+            path = rng.choice(dirs)
+            depth += 1
+
+    if not depth_counts:
+        raise ValueError(f"在 {root_dir} 下没有探测到包含图像的目录")
+
+    leaf_depth = depth_counts.most_common(1)[0][0]
+    if leaf_depth == 0:
+        raise ValueError(f"图像直接位于根目录 {root_dir} 下，无法推断类别层级")
+    if len(depth_counts) > 1:
+        logger.warning(f"叶目录层级不一致 {dict(depth_counts)}，使用出现最多的层级 {leaf_depth}")
+
+    class_depth = leaf_depth - 1
+    extensions = tuple(sorted(ext_counts))
+    logger.info(f"目录结构探测完成: 下探 {num_probes} 次, 命中 {sum(depth_counts.values())} 次, "
+                f"类别层级 {class_depth}, 扩展名 {extensions}")
+    return class_depth, extensions
+
+def detect_layout_from_paths(rel_paths):
+    """
+    根据完整的相对路径列表推断类别层级和图像扩展名（用于归档等已知全部路径的数据源）
+
+    参数:
+    - rel_paths: 相对路径的可迭代对象，以'/'分隔
+
+    返回:
+    - (class_depth, extensions): 类别层级（从0开始）和扩展名元组
+    """
+    depth_counts = Counter()
+    ext_counts = Counter()
+    leaf_dirs = set()
+    for rel_path in rel_paths:
+        ext = os.path.splitext(rel_path)[1].lower()
+        if ext not in KNOWN_IMAGE_EXTENSIONS:
+            continue
+        ext_counts[ext] += 1
+        rel_dir = os.path.dirname(rel_path)
+        # 每个叶目录只计一次，与随机下探的统计口径一致
+        if rel_dir not in leaf_dirs:
+            leaf_dirs.add(rel_dir)
+            depth_counts[rel_dir.count('/') + 1 if rel_dir else 0] += 1
+
+    if not depth_counts:
+        raise ValueError("路径列表中没有图像文件")
+
+    leaf_depth = depth_counts.most_common(1)[0][0]
+    if leaf_depth == 0:
+        raise ValueError("图像直接位于根目录下，无法推断类别层级")
+    if len(depth_counts) > 1:
+        logger.warning(f"叶目录层级不一致 {dict(depth_counts)}，使用出现最多的层级 {leaf_depth}")
+
+    class_depth = leaf_depth - 1
+    extensions = tuple(sorted(ext_counts))
+    logger.info(f"目录结构探测完成: {len(leaf_dirs)} 个叶目录, 类别层级 {class_depth}, 扩展名 {extensions}")
+    return class_depth, extensions
@@ -0,0 +1,135 @@
+"""
+清单差异模块 - 比较两个清单CSV，生成可叠加到基准清单上的增量文件
+"""
+import os
+from collections import Counter
+from datetime import datetime
+
+from utils.logger import get_logger
+from utils.file_utils import read_yaml_file, write_yaml_file, get_store
+from utils.locking import atomic_write
+
+logger = get_logger()
+
+CSV_HEADER = "rel_path,label\n"
+
+def _iter_rows(csv_path):
+    """逐行产出数据行（去掉换行符，跳过标题行和空行）"""
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        next(f, None)
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+def _read_header(csv_path):
+    """清单的标题行，带附加列的清单在label之后还有其他列名"""
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        header = f.readline().rstrip('\r\n')
+    return header + '\n' if header else CSV_HEADER
+
+def _write_rows(csv_path, row_counts, header=CSV_HEADER):
+    """写出{行: 次数}中的行，重复的行按次数写出"""
+    with atomic_write(csv_path) as f:
+        f.write(header)
+        for row, count in row_counts.items():
+            for _ in range(count):
+                f.write(row)
+                f.write('\n')
+
+def diff_manifests(base_csv, target_csv, delta_base_path):
+    """
+    比较两个清单（完整数据集或某个划分），生成增量文件
+
+    以行为单位做哈希连接: 基准清单的行按出现次数计数（重复的行按多重集合处理），目标清单流式读取
+    并逐行抵消，不解析字段、不排序，时间与两个文件的行数之和成正比。标签变化的样本同时出现在删除和新增中。
+    增量YAML中的文件路径相对于YAML所在目录，增量文件整体移动到其他位置后仍可叠加。
+
+    参数:
+    - base_csv: 基准清单路径
+    - target_csv: 目标清单路径
+    - delta_base_path: 增量文件路径前缀，生成 _added.csv、_removed.csv 和 _delta.yaml
+
+    返回:
+    - 增量信息字典
+    """
+    if get_store() is not None:
+        raise ValueError("清单差异按行比较磁盘上的CSV文件，不支持SQLite存储，请先用export导出")
+    remaining = Counter(_iter_rows(base_csv))
+    num_base = sum(remaining.values())
+
+    delta_yaml = f"{delta_base_path}_delta.yaml"
+    delta_dir = os.path.dirname(os.path.abspath(delta_yaml))
+    added_csv = f"{delta_base_path}_added.csv"
+    removed_csv = f"{delta_base_path}_removed.csv"
+    # 增量文件沿用目标清单的标题行，叠加时按标题行确定附加列数
+    header = _read_header(target_csv)
+    num_target = num_added = 0
+    with atomic_write(added_csv) as f:
+        f.write(header)
+        for row in _iter_rows(target_csv):
+            num_target += 1
+            if remaining.get(row):
+                remaining[row] -= 1
+            else:
+                f.write(row)
+                f.write('\n')
+                num_added += 1
+
+    # 剩下的就是被删除的行，保持基准清单中的顺序
+    _write_rows(removed_csv, remaining, header)
+    num_removed = sum(remaining.values())
+
+    delta_info = {
+        'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'base': os.path.relpath(os.path.abspath(base_csv), delta_dir),
+        'target': os.path.relpath(os.path.abspath(target_csv), delta_dir),
+        'base_rows': num_base,
+        'target_rows': num_target,
+        'added': os.path.relpath(os.path.abspath(added_csv), delta_dir),
+        'removed': os.path.relpath(os.path.abspath(removed_csv), delta_dir),
+        'num_added': num_added,
+        'num_removed': num_removed,
+    }
+    write_yaml_file(delta_yaml, delta_info)
+    logger.info(f"清单差异: {base_csv} -> {target_csv}, 新增 {num_added} 行, 删除 {num_removed} 行")
+    return delta_info
+
+def diff_split_files(base_yaml, target_yaml, output_dir):
+    """
+    比较两次划分，逐个划分生成增量文件
+
+    参数:
+    - base_yaml: 基准划分YAML
+    - target_yaml: 目标划分YAML
+    - output_dir: 增量文件输出目录
+
+    返回:
+    - {划分名称: 增量信息字典}
+    """
+    base_info = read_yaml_file(base_yaml)
+    target_info = read_yaml_file(target_yaml)
+    stem = os.path.splitext(os.path.basename(target_yaml))[0]
+
+    deltas = {}
+    for split_name in ('train', 'val', 'test'):
+        base_csv, target_csv = base_info.get(split_name), target_info.get(split_name)
+        if not base_csv or not target_csv:
+            if base_csv or target_csv:
+                logger.warning(f"{split_name} 只存在于其中一次划分中，跳过")
+            continue
+        deltas[split_name] = diff_manifests(base_csv, target_csv, os.path.join(output_dir, f"{stem}_{split_name}"))
+    return deltas
+
+def diff_files(base_path, target_path, output_dir):
+    """
+    比较两个清单，根据扩展名区分清单CSV和划分YAML
+
+    返回:
+    - 增量信息字典（CSV）或{划分名称: 增量信息字典}（YAML）
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if base_path.endswith(('.yaml', '.yml')):
+        return diff_split_files(base_path, target_path, output_dir)
+    stem = os.path.splitext(os.path.basename(target_path))[0]
+    return diff_manifests(base_path, target_path, os.path.join(output_dir, stem))
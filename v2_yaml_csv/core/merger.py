@@ -0,0 +1,195 @@
+"""
+数据集合并模块 - 把多个完整数据集清单合并到统一的标签空间，按标签k路归并流式写出
+"""
+import heapq
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from utils.logger import get_logger
+from utils.file_utils import read_yaml_file, write_yaml_file, get_store
+from utils.archive import is_archive
+from utils.locking import atomic_write
+
+logger = get_logger()
+
+def _read_header(csv_path):
+    """读取CSV表头的列名"""
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        return f.readline().rstrip('\r\n').split(',')
+
+def _label_ranges(csv_path, num_extra=0):
+    """
+    顺序读取一遍CSV，记录每个标签所在的字节区间
+
+    参数:
+    - csv_path: 清单路径
+    - num_extra: label之后的附加列数；路径中可能含逗号，标签为倒数第 (num_extra + 1) 个字段
+
+    返回:
+    - {标签: [(起始偏移, 结束偏移), ...]}
+    """
+    ranges = defaultdict(list)
+    with open(csv_path, 'rb') as f:
+        f.readline()
+        offset = f.tell()
+        current, start = None, offset
+        for line in f:
+            if line.strip():
+                label = int(line.rsplit(b',', num_extra + 1)[1])
+                if label != current:
+                    if current is not None:
+                        ranges[current].append((start, offset))
+                    current, start = label, offset
+            offset += len(line)
+        if current is not None:
+            ranges[current].append((start, offset))
+    return ranges
+
+class _Source:
+    """一个待合并的完整数据集清单"""
+
+    def __init__(self, index, csv_path):
+        self.index = index
+        self.csv_path = csv_path
+        self.info = read_yaml_file(os.path.splitext(csv_path)[0] + '.yaml')
+        self.name = self.info.get('data') or os.path.splitext(os.path.basename(csv_path))[0]
+        self.root_dir = self.info['path']
+        if is_archive(self.root_dir):
+            raise ValueError(f"暂不支持合并以归档为根目录的数据集: {self.root_dir}")
+        # 标签 -> 类别名称
+        self.names = {int(label): name for label, name in self.info['names'].items()}
+        self.prefix = ''
+        self.remap = {}
+
+    def header(self):
+        """清单的列名，SQLite存储时由记录的附加列名得到"""
+        store = get_store()
+        if store is not None:
+            return ['rel_path', 'label', *store.manifest_columns(self.csv_path)]
+        return _read_header(self.csv_path)
+
+    def rows(self, extra):
+        """
+        按新标签顺序产出(新标签, 来源序号, 相对路径, 附加列值的元组, 原标签)
+
+        每个原标签的行在CSV中是连续的区间，按新标签的顺序逐个区间读取，内存只与单行大小有关；
+        SQLite存储时逐个标签查询。
+        """
+        order = sorted(self.remap, key=lambda label: (self.remap[label], label))
+        store = get_store()
+        if store is not None:
+            for label in order:
+                for rel_path, _, *values in store.read_manifest(self.csv_path, labels=[label], columns=extra):
+                    yield self.remap[label], self.index, self.prefix + rel_path, tuple(values), label
+            return
+
+        num_extra = len(_read_header(self.csv_path)) - 2
+        ranges = _label_ranges(self.csv_path, num_extra)
+        with open(self.csv_path, 'rb') as f:
+            for label in order:
+                new_label = self.remap[label]
+                for start, end in ranges.get(label, ()):
+                    f.seek(start)
+                    position = start
+                    while position < end:
+                        line = f.readline()
+                        position += len(line)
+                        parts = line.decode('utf-8').rstrip('\r\n').rsplit(',', num_extra + 1)
+                        if len(parts) < 2:
+                            continue
+                        yield new_label, self.index, self.prefix + parts[0], tuple(parts[2:]) if extra else (), label
+
+def merge_datasets(csv_paths, output_base_path, aliases=None, namespace=False):
+    """
+    合并多个由 generate_full_dataset 生成的完整数据集清单
+
+    - 类别名称先按 namespace 加上来源数据集名称前缀，再经过别名表映射为统一名称，
+      统一名称排序后分配标签
+    - 相对路径改为相对于各数据集根目录的公共父目录，合并清单可以直接用于读取
+    - 各来源清单已按标签排序，每个来源按新标签顺序逐区间读取后做k路归并，不重新扫描数据集，
+      也不把清单整体读入内存
+    - 输出CSV在标签（及各来源共有的附加列）之后增加 source 和 source_label 两列；
+      SQLite存储时这些列保存为附加列，行分块写入数据库
+
+    参数:
+    - csv_paths: 完整数据集CSV路径列表，对应的YAML位于同名路径
+    - output_base_path: 输出路径前缀，生成 {output_base_path}.csv 和 .yaml
+    - aliases: {类别名称: 统一名称}，为None时不做别名映射
+    - namespace: 是否以"数据集名称/类别名称"区分不同来源的同名类别
+
+    返回:
+    - 合并后的数据集信息字典
+    """
+    aliases = aliases or {}
+    sources = [_Source(i, csv_path) for i, csv_path in enumerate(csv_paths)]
+    if not sources:
+        raise ValueError("没有要合并的数据集")
+
+    # 统一类别名称和标签
+    common_root = os.path.commonpath([os.path.abspath(source.root_dir) for source in sources])
+    canonical = {}
+    for source in sources:
+        rel_root = os.path.relpath(os.path.abspath(source.root_dir), common_root)
+        source.prefix = '' if rel_root == os.curdir else rel_root + os.sep
+        for label, name in source.names.items():
+            name = f"{source.name}/{name}" if namespace else name
+            canonical[(source.index, label)] = aliases.get(name, name)
+    class_to_idx = {name: idx for idx, name in enumerate(sorted(set(canonical.values())))}
+    for source in sources:
+        source.remap = {label: class_to_idx[canonical[(source.index, label)]] for label in source.names}
+
+    # 各来源共有的附加列（如width/height）保留，否则丢弃
+    headers = [source.header() for source in sources]
+    extra = headers[0][2:] if all(header == headers[0] for header in headers) else []
+    if not extra and any(len(header) > 2 for header in headers):
+        logger.warning("各数据集清单的附加列不一致，合并清单中不保留附加列")
+
+    csv_path = output_base_path + '.csv'
+    merged = heapq.merge(*(source.rows(extra) for source in sources), key=lambda row: row[0])
+    counts = defaultdict(int)
+    source_counts = defaultdict(int)
+    idx_to_class = {idx: name for name, idx in class_to_idx.items()}
+
+    def merged_rows():
+        for new_label, index, rel_path, values, label in merged:
+            counts[idx_to_class[new_label]] += 1
+            source_counts[index] += 1
+            yield (rel_path, new_label, *values, index, label)
+
+    columns = [*extra, "source", "source_label"]
+    store = get_store()
+    if store is not None:
+        store.write_sorted_rows(csv_path, merged_rows(), columns)
+    else:
+        with atomic_write(csv_path) as f:
+            f.write(",".join(["rel_path", "label", *columns]) + "\n")
+            for row in merged_rows():
+                f.write(",".join(map(str, row)) + "\n")
+        logger.info(f"CSV文件已生成: {csv_path}")
+
+    merged_info = {
+        'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'data': os.path.basename(output_base_path),
+        'path': common_root,
+        'total_images': sum(counts.values()),
+        'num_classes': len(class_to_idx),
+        'names': idx_to_class,
+        'counts': {name: counts[name] for name in class_to_idx},
+        'namespace': namespace,
+        'sources': [{
+            'data': source.name,
+            'path': source.root_dir,
+            'manifest': source.csv_path,
+            'prefix': source.prefix,
+            'images': source_counts[source.index],
+            'num_classes': len(source.names),
+        } for source in sources],
+    }
+    if extra:
+        merged_info['columns'] = list(extra)
+    write_yaml_file(output_base_path + '.yaml', merged_info, lazy_keys=('names', 'counts'))
+
+    logger.info(f"数据集合并完成: {len(sources)} 个来源, {len(class_to_idx)} 个类别, "
+                f"{merged_info['total_images']} 张图像, 根目录 {common_root}")
+    return merged_info
@@ -2,12 +2,20 @@ import os
 from collections import defaultdict
 from datetime import datetime
 from utils.logger import get_logger
-import pandas as pd
-import yaml
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.file_utils import write_csv_file, write_yaml_file
+from utils.file_utils import write_csv_file, write_yaml_file, read_csv_file, read_yaml_file, manifest_exists, \
+    read_csv_columns, get_store
+from core.class_resolver import ClassResolver, PER_FILE
+from core.layout import detect_layout, detect_layout_from_paths
+from core.index import DatasetIndex, DatasetIndexBuilder
+from utils.image_probe import HeaderProber, FORMATS
+from utils.archive import is_archive, open_archive
+from utils.locking import elect_writer, file_lock
+
+# 支持的图像文件扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
 
 class DatasetProcessor:
     """数据集处理基类，提供基本的数据集读取功能"""
@@ -30,88 +38,163 @@ class DatasetProcessor:
         self.dataset_name = args.dataset_name
         self.full_data_csv = args.full_data_path + ".csv"
         self.full_data_yaml = args.full_data_path + ".yaml"
+
+        # 自动探测类别层级时的下探次数
+        self.probe_samples = getattr(args, 'probe_samples', 32)
         
         # 可能的子集名称
         self.subset_name = None
     
+    def _walk(self):
+        """
+        逐目录产出(相对目录, [文件名, ...])，根目录的相对目录为os.curdir
+        
+        root_dir为tar/zip归档时从成员索引中按目录分组，不解压也不访问文件系统
+        """
+        if not is_archive(self.root_dir):
+            # 使用os.walk遍历数据集
+            for dirpath, _, filenames in os.walk(self.root_dir):
+                yield os.path.relpath(dirpath, self.root_dir), filenames
+            return
+
+        dir_to_files = defaultdict(list)
+        for name in open_archive(self.root_dir).names():
+            rel_dir, filename = os.path.split(name)
+            dir_to_files[rel_dir or os.curdir].append(filename)
+        yield from dir_to_files.items()
+
+    def _scan(self, resolver, extensions):
+        """
+        遍历数据集，逐目录产出(类别名称, [相对路径, ...])
+        
+        参数:
+        - resolver: 类别解析器
+        - extensions: 图像文件扩展名元组
+        """
+        for rel_dir, filenames in self._walk():
+            # 获取相对路径
+            prefix = '' if rel_dir == os.curdir else rel_dir + os.sep
+            
+            # 筛选图像文件
+            images = [filename for filename in filenames if filename.lower().endswith(extensions)]
+            if not images:
+                continue
+
+            # 每个目录只解析一次类别，类别依赖文件名时才逐文件解析
+            dir_class = resolver.resolve_dir(rel_dir)
+            if dir_class is PER_FILE:
+                per_file = defaultdict(list)
+                for filename in images:
+                    rel_img_path = prefix + filename                # 获取相对于根目录的路径
+                    class_name = resolver.resolve(rel_img_path)    # 提取类别
+                    if class_name:
+                        per_file[class_name].append(rel_img_path)
+                yield from per_file.items()
+            elif dir_class:
+                yield dir_class, [prefix + filename for filename in images]
+
+    def _prepare_scan(self, class_depth, class_pattern):
+        """
+        确定类别层级和扩展名，class_depth为'auto'时自动探测
+        
+        返回:
+        - 类别层级、扩展名元组和类别解析器
+        """
+        extensions = IMAGE_EXTENSIONS
+        if class_depth == 'auto':
+            if is_archive(self.root_dir):
+                # 成员索引已包含全部路径，直接统计
+                class_depth, extensions = detect_layout_from_paths(open_archive(self.root_dir).names())
+            else:
+                class_depth, extensions = detect_layout(self.root_dir, self.probe_samples)
+        return class_depth, extensions, ClassResolver(class_depth, class_pattern)
+
+    def _dataset_info(self, class_depth, class_pattern, extensions, class_to_idx, counts):
+        """准备完整数据集信息字典"""
+        return {
+            'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'class_depth': class_depth,
+            'class_pattern': class_pattern,
+            'extensions': list(extensions),
+            'data': self.dataset_name,
+            'path': self.root_dir,
+            'total_images': sum(counts.values()),
+            'num_classes': len(class_to_idx),
+            'names': {value: key for key, value in class_to_idx.items()},
+            'counts': counts,
+        }
+
     def read_dataset(self, class_depth=1, class_pattern=None):
         """
         读取数据集，扫描全部图像并提取类别信息
         
         参数:
-        - class_depth: 类别所在的目录层级（从0开始）
+        - class_depth: 类别所在的目录层级（从0开始），为'auto'时通过随机下探自动推断层级和扩展名
         - class_pattern: 用于从路径中提取类别的正则表达式
         
         返回:
         - 数据集信息字典和类别-图像映射
         """
+        class_depth, extensions, resolver = self._prepare_scan(class_depth, class_pattern)
 
         # 按类别组织图像
         class_to_images = defaultdict(list)
-        total_images = 0
         
         self.logger.info(f"开始扫描数据集: {self.root_dir}")
-        
-        # 使用os.walk遍历数据集
-        for dirpath, _, filenames in os.walk(self.root_dir):
-            # 获取相对路径
-            rel_path = os.path.relpath(dirpath, self.root_dir)
-            
-            # 处理图像文件
-            for filename in filenames:
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff')):
-                    img_path = os.path.join(dirpath, filename)                                            # 获取图像完整路径
-                    rel_img_path = os.path.relpath(img_path, self.root_dir)                               # 获取相对于根目录的路径
-                    class_name = self._extract_class_from_path(rel_img_path, class_depth, class_pattern)  # 提取类别
-                    
-                    if class_name:
-                        class_to_images[class_name].append(rel_img_path)
-                        total_images += 1
+        for class_name, rel_img_paths in self._scan(resolver, extensions):
+            class_to_images[class_name].extend(rel_img_paths)
         
         # 为类别分配标签（从0开始）
         class_to_idx = {class_name: idx for idx, class_name in enumerate(sorted(class_to_images.keys()))}
 
         # 准备数据集信息
-        dataset_info = {
-            'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'class_depth': class_depth,
-            'class_pattern': class_pattern,
-            'data': self.dataset_name,
-            'path': self.root_dir,
-            'total_images': total_images,
-            'num_classes': len(class_to_images),
-            'names': {value: key for key, value in class_to_idx.items()},
-            'counts': {key: len(images) for key, images in class_to_images.items()},
-        }
+        counts = {key: len(images) for key, images in class_to_images.items()}
+        dataset_info = self._dataset_info(class_depth, class_pattern, extensions, class_to_idx, counts)
 
-        self.logger.info(f"数据集扫描完成: 共有 {len(class_to_images)} 个类别, {total_images} 张图像")
+        self.logger.info(f"数据集扫描完成: 共有 {len(class_to_images)} 个类别, {dataset_info['total_images']} 张图像")
         return dataset_info, class_to_images, class_to_idx
-    
-    def _extract_class_from_path(self, rel_path, class_depth=1, class_pattern=None):
+
+    def read_index(self, class_depth=1, class_pattern=None, probe_headers=False, probe_workers=32):
         """
-        从路径中提取类别
+        读取数据集并直接构建紧凑索引，不创建类别-图像字典
         
         参数:
-        - rel_path: 相对路径
-        - class_depth: 类别所在的目录层级（从0开始）
+        - class_depth: 类别所在的目录层级（从0开始），为'auto'时自动探测
         - class_pattern: 用于从路径中提取类别的正则表达式
+        - probe_headers: 是否在扫描的同时读取图像文件头，得到width/height/channels/format列
+        - probe_workers: 读取文件头的线程数
         
         返回:
-        - 类别名称
+        - 数据集信息字典和DatasetIndex
         """
-        if class_pattern:
-            # 使用正则表达式提取类别
-            import re
-            match = re.search(class_pattern, rel_path)
-            if match:
-                return match.group(1)
-        
-        # 基于目录深度提取类别
-        parts = rel_path.split(os.sep)
-        if len(parts) > class_depth:
-            return parts[class_depth]
-        
-        return None
+        class_depth, extensions, resolver = self._prepare_scan(class_depth, class_pattern)
+        builder = DatasetIndexBuilder()
+        if probe_headers and is_archive(self.root_dir):
+            self.logger.warning("数据集为归档文件，不读取图像文件头")
+            probe_headers = False
+        prober = HeaderProber(self.root_dir, probe_workers) if probe_headers else None
+
+        self.logger.info(f"开始扫描数据集: {self.root_dir}")
+        for class_name, rel_img_paths in self._scan(resolver, extensions):
+            builder.add(class_name, rel_img_paths)
+            # 目录遍历与文件头读取重叠进行
+            if prober is not None:
+                prober.submit(class_name, rel_img_paths)
+
+        index = builder.build()
+        counts = builder.counts()
+        dataset_info = self._dataset_info(class_depth, class_pattern, extensions, index.class_to_idx, counts)
+        if prober is not None:
+            index.columns.update(prober.build_columns(index))
+            dataset_info['columns'] = list(index.columns)
+            dataset_info['formats'] = dict(FORMATS)
+            unknown = int((index.columns['format'] == 0).sum())
+            if unknown:
+                self.logger.warning(f"{unknown} 个文件无法从文件头识别尺寸")
+
+        self.logger.info(f"数据集扫描完成: 共有 {index.num_classes} 个类别, {len(index)} 张图像, "
+                         f"索引占用 {index.nbytes() / (1 << 20):.1f} MB")
+        return dataset_info, index
     
     def generate_full_dataset(self, class_depth=1, class_pattern=None):
         """
@@ -124,6 +207,16 @@ class DatasetProcessor:
         返回:
         - CSV文件路径和YAML文件路径的元组
         """
+        with elect_writer(self.full_data_csv) as elected:
+            # 其他进程刚生成了同一份文件时直接读取
+            if not elected and manifest_exists(self.full_data_csv) and manifest_exists(self.full_data_yaml):
+                try:
+                    return self.full_data_csv, self.full_data_yaml, *self.fileload(class_depth, class_pattern)
+                except FileNotFoundError:
+                    self.logger.info("其他进程生成的完整数据集参数不同，重新扫描")
+            return self._generate_full_dataset(class_depth, class_pattern)
+
+    def _generate_full_dataset(self, class_depth, class_pattern):
         # 读取数据集
         dataset_info, class_to_images, class_to_idx = self.read_dataset(class_depth, class_pattern)
         
@@ -138,46 +231,116 @@ class DatasetProcessor:
         write_csv_file(self.full_data_csv, data_list)
         
         # 写入YAML文件
-        write_yaml_file(self.full_data_yaml, dataset_info)
+        write_yaml_file(self.full_data_yaml, dataset_info, lazy_keys=('names', 'counts'))
         
         return self.full_data_csv, self.full_data_yaml, dataset_info, class_to_images, class_to_idx
+
+    def generate_full_index(self, class_depth=1, class_pattern=None, probe_headers=False):
+        """
+        生成完整数据集文件和信息文件，数据以DatasetIndex形式返回
+        
+        参数:
+        - class_depth: 类别所在的目录层级（从0开始）
+        - class_pattern: 用于从路径中提取类别的正则表达式
+        - probe_headers: 是否读取图像文件头，把尺寸等信息作为附加列写入清单
+        
+        返回:
+        - CSV文件路径、YAML文件路径、数据集信息字典和DatasetIndex
+        
+        多个进程（如共享输出目录的多个任务）同时生成同一份完整数据集时，只有第一个进程扫描，
+        其余进程等待它写完后直接读取。
+        """
+        with elect_writer(self.full_data_csv) as elected:
+            if not elected and manifest_exists(self.full_data_csv) and manifest_exists(self.full_data_yaml):
+                try:
+                    result = self._load_full_index(class_depth, class_pattern)
+                    if not probe_headers or result[2].get('columns'):
+                        return result
+                except FileNotFoundError:
+                    pass
+                self.logger.info("其他进程生成的完整数据集参数不同，重新扫描")
+            return self._generate_full_index(class_depth, class_pattern, probe_headers)
+
+    def _generate_full_index(self, class_depth, class_pattern, probe_headers):
+        dataset_info, index = self.read_index(class_depth, class_pattern, probe_headers)
+        write_csv_file(self.full_data_csv, index)
+        write_yaml_file(self.full_data_yaml, dataset_info, lazy_keys=('names', 'counts'))
+        return self.full_data_csv, self.full_data_yaml, dataset_info, index
     
+    def load_full_index(self, class_depth=1, class_pattern=None):
+        """
+        从已生成的完整数据集文件构建DatasetIndex，不重新扫描数据集
+        
+        参数:
+        - class_depth: 类别所在的目录层级，需与文件中记录的一致
+        - class_pattern: 用于从路径中提取类别的正则表达式，需与文件中记录的一致
+        
+        返回:
+        - 与 generate_full_index 相同: CSV文件路径、YAML文件路径、数据集信息字典和DatasetIndex
+        """
+        # 共享锁: 等待正在写入的进程，保证读到的CSV和YAML属于同一次生成
+        with file_lock(self.full_data_csv, shared=True):
+            return self._load_full_index(class_depth, class_pattern)
+
+    def _load_full_index(self, class_depth, class_pattern):
+        dataset_info = read_yaml_file(self.full_data_yaml)
+        self._check_dataset_info(dataset_info, class_depth, class_pattern)
+        names = dataset_info['names']
+        class_names = [names[label] for label in range(len(names))]
+        # 文件存储时直接解析CSV字节构建索引，不创建逐行的元组和类别-图像字典
+        if get_store() is None:
+            index = DatasetIndex.from_csv(self.full_data_csv, class_names)
+        else:
+            index = DatasetIndex.from_data_list(read_csv_file(self.full_data_csv), class_names)
+        # CSV已按标签排序，附加列的行顺序与索引一致
+        if dataset_info.get('columns'):
+            index.columns.update(read_csv_columns(self.full_data_csv, dataset_info['columns']))
+        self.logger.info(f"已从完整数据集文件加载索引: {len(index)} 张图像")
+        return self.full_data_csv, self.full_data_yaml, dataset_info, index
+
+    def _check_dataset_info(self, dataset_info, class_depth, class_pattern):
+        """
+        检查完整数据集文件是否与当前参数一致，不一致时抛出FileNotFoundError
+
+        只读取小字段，不解析旁路文件中的大表；自动探测层级时接受文件中记录的探测结果
+        """
+        if dataset_info['path'] != self.root_dir or \
+           dataset_info['data'] != self.dataset_name or \
+           (class_depth != 'auto' and dataset_info['class_depth'] != class_depth) or \
+           dataset_info['class_pattern'] != class_pattern:
+                self.logger.warning("数据集根目录或名称不匹配，可能需要重新加载数据集")
+                raise FileNotFoundError
+
     def fileload(self, class_depth, class_pattern):
         """
         检查数据集是否需要重新加载
         """
         # 1. 读取 CSV 和 YAML 文件
-        data_list = pd.read_csv(self.full_data_csv).values.tolist()
-        with open(self.full_data_yaml, 'r', encoding='utf-8') as f:
-            dataset_info = yaml.safe_load(f)
+        dataset_info = read_yaml_file(self.full_data_yaml)
 
         # 2. 检查数据集是否需要重新加载
-        if dataset_info['dataset_info']['root_dir'] != self.root_dir or \
-           dataset_info['dataset_info']['name'] != self.dataset_name or \
-           dataset_info['dataset_info']['class_depth'] != class_depth or \
-           dataset_info['dataset_info']['class_pattern'] != class_pattern:
-                self.logger.warning("数据集根目录或名称不匹配，可能需要重新加载数据集")
-                raise FileNotFoundError
+        self._check_dataset_info(dataset_info, class_depth, class_pattern)
+
+        data_list = read_csv_file(self.full_data_csv)
 
         # 3. 基于 dataset_info 获取 class_to_idx
-        class_to_idx = {}
-        for class_name, info in dataset_info['class_info'].items():
-            class_to_idx[class_name] = info['label']
+        class_to_idx = {class_name: label for label, class_name in dataset_info['names'].items()}
+        idx_to_class = dataset_info['names']
 
         # 4. 基于 data_list 获取 class_to_images
         class_to_images = defaultdict(list)
         for rel_img_path, label in data_list:
-            class_name = list(class_to_idx.keys())[list(class_to_idx.values()).index(label)]
-            class_to_images[class_name].append(rel_img_path)
+            class_to_images[idx_to_class[label]].append(rel_img_path)
         
         return dataset_info, class_to_images, class_to_idx
 
     def load(self, class_depth=1, class_pattern=None):
         self.logger.info("开始生成完整数据集")
         try:
-            if os.path.exists(self.full_data_csv) and os.path.exists(self.full_data_yaml):
+            if manifest_exists(self.full_data_csv) and manifest_exists(self.full_data_yaml):
                 self.logger.info("无需重新加载, 直接加载完整数据集文件")
-                return self.full_data_csv, self.full_data_yaml, *self.fileload(class_depth, class_pattern)
+                with file_lock(self.full_data_csv, shared=True):
+                    return self.full_data_csv, self.full_data_yaml, *self.fileload(class_depth, class_pattern)
 
             else:
                 self.logger.info("再次读取完整数据集文件")
@@ -0,0 +1,234 @@
+"""
+清单查询模块 - 基于磁盘索引按类别、路径前缀和通配符查询完整数据集清单
+"""
+import os
+import mmap
+import fnmatch
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_yaml_file, write_yaml_file, get_store
+from core.index import csv_row_spans
+from utils.locking import atomic_write
+
+logger = get_logger()
+
+# 通配符中第一个特殊字符之前的部分为字面前缀
+_GLOB_SPECIAL = '*?['
+
+def _literal_prefix(pattern):
+    """通配符中第一个特殊字符之前的字面前缀"""
+    cut = min((i for i, ch in enumerate(pattern) if ch in _GLOB_SPECIAL), default=len(pattern))
+    return pattern[:cut]
+
+class ManifestQuery:
+    """
+    清单查询
+
+    首次使用时在 {清单去掉扩展名}.qidx/ 下生成索引，清单变化（大小或修改时间不同）后自动重建:
+    - rows.npy: 每行起始字节偏移(N)，用于按行号直接读取
+    - classes.npy: 类别的行号区间(C+1)，清单按标签排序，类别c为 [classes[c], classes[c + 1])
+    - paths.npy: 按路径字节序排列的行号(N)，前缀查询只需两次二分查找
+
+    查询时以mmap方式打开清单和索引，只读取命中的行，不加载整个清单。
+    索引建立在磁盘上的CSV之上，使用SQLite存储时请用 query_manifest。
+    """
+
+    def __init__(self, csv_path, yaml_path=None, rebuild=False):
+        """
+        参数:
+        - csv_path: 完整数据集清单CSV路径
+        - yaml_path: 对应的YAML路径，提供时可以按类别名称查询
+        - rebuild: 是否强制重建索引
+        """
+        if get_store() is not None:
+            raise ValueError("ManifestQuery只能查询磁盘上的CSV清单，SQLite存储请使用query_manifest")
+        self.csv_path = csv_path
+        self.index_dir = os.path.splitext(csv_path)[0] + '.qidx'
+        if rebuild or not self._index_fresh():
+            self.build_index()
+
+        self._file = open(csv_path, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.row_offsets = np.load(os.path.join(self.index_dir, 'rows.npy'), mmap_mode='r')
+        self.class_offsets = np.load(os.path.join(self.index_dir, 'classes.npy'))
+        self.path_order = np.load(os.path.join(self.index_dir, 'paths.npy'), mmap_mode='r')
+        header = self.data[:max(self.data.find(b'\n'), 0)]
+        self.num_extra = max(header.rstrip(b'\r').count(b',') - 1, 0)
+
+        self.class_to_idx = None
+        if yaml_path:
+            self.class_to_idx = {class_name: label for label, class_name in read_yaml_file(yaml_path)['names'].items()}
+
+    # 索引 ----------------------------------------------------------------------------------------
+    def _csv_stat(self):
+        stat = os.stat(self.csv_path)
+        return {'csv_size': stat.st_size, 'csv_mtime_ns': stat.st_mtime_ns}
+
+    def _index_fresh(self):
+        meta_path = os.path.join(self.index_dir, 'meta.yaml')
+        if not os.path.exists(meta_path):
+            return False
+        meta = read_yaml_file(meta_path)
+        return all(meta.get(key) == value for key, value in self._csv_stat().items())
+
+    def build_index(self):
+        """扫描一次清单生成索引，行定位和标签解析都是向量化的"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.csv_path, 'rb') as f:
+            raw = f.read()
+        row_starts, label_sep, labels = csv_row_spans(raw, self.csv_path)
+        if len(labels) and np.any(np.diff(labels) < 0):
+            raise ValueError(f"清单未按标签排序，无法建立类别索引: {self.csv_path}")
+
+        num_classes = int(labels[-1]) + 1 if len(labels) else 0
+        class_offsets = np.searchsorted(labels, np.arange(num_classes + 1)).astype(np.int64)
+
+        # 路径按字节序排序（定长字节串数组排序，末尾补零不影响顺序）
+        path_len = label_sep - row_starts
+        width = max(int(path_len.max()) if len(path_len) else 1, 1)
+        paths = np.array([raw[s:e] for s, e in zip(row_starts.tolist(), label_sep.tolist())], dtype=f'S{width}')
+        path_order = np.argsort(paths, kind='stable').astype(np.int64)
+
+        # 各数组原子发布，meta.yaml最后写出
+        for filename, array in (('rows.npy', row_starts.astype(np.int64)), ('classes.npy', class_offsets),
+                                ('paths.npy', path_order)):
+            with atomic_write(os.path.join(self.index_dir, filename), 'wb') as f:
+                np.save(f, array)
+        write_yaml_file(os.path.join(self.index_dir, 'meta.yaml'),
+                        {**self._csv_stat(), 'num_rows': len(labels), 'num_classes': num_classes})
+        logger.info(f"清单索引已生成: {self.index_dir}, {len(labels)} 行, {num_classes} 个类别")
+
+    # 行访问 --------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.path_order)
+
+    def _row_bytes(self, row):
+        """第row行的原始字节（不含换行符）"""
+        start = int(self.row_offsets[row])
+        end = self.data.find(b'\n', start)
+        return self.data[start:end if end >= 0 else len(self.data)].rstrip(b'\r')
+
+    def _row_path(self, row):
+        line = self._row_bytes(row)
+        return line.rsplit(b',', self.num_extra + 1)[0]
+
+    def rows_to_items(self, rows):
+        """行号数组 -> [(相对路径, 标签), ...]"""
+        rows = np.asarray(rows, dtype=np.int64)
+        labels = np.searchsorted(self.class_offsets, rows, side='right') - 1
+        return [(self._row_path(row).decode('utf-8'), label) for row, label in zip(rows.tolist(), labels.tolist())]
+
+    # 查询 ----------------------------------------------------------------------------------------
+    def _lower_bound(self, key):
+        """路径排序中第一个不小于key的位置"""
+        lo, hi = 0, len(self.path_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._row_path(int(self.path_order[mid])) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _label(self, class_key):
+        if isinstance(class_key, str):
+            if self.class_to_idx is None:
+                raise ValueError("按类别名称查询需要提供YAML文件")
+            return self.class_to_idx[class_key]
+        return int(class_key)
+
+    def class_rows(self, classes):
+        """类别（名称或标签）列表对应的行号，升序"""
+        labels = sorted({self._label(class_key) for class_key in classes})
+        parts = [np.arange(self.class_offsets[label], self.class_offsets[label + 1], dtype=np.int64)
+                 for label in labels if 0 <= label < len(self.class_offsets) - 1]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def prefix_rows(self, prefix):
+        """路径以prefix开头的行号，升序"""
+        key = prefix.encode('utf-8')
+        # UTF-8 编码中不会出现0xff字节，key + 0xff 大于所有以key开头的路径
+        lo, hi = self._lower_bound(key), self._lower_bound(key + b'\xff')
+        return np.sort(np.asarray(self.path_order[lo:hi], dtype=np.int64))
+
+    def glob_rows(self, pattern):
+        """
+        路径匹配通配符的行号，升序
+
+        先用通配符的字面前缀做前缀查询缩小范围，再逐个匹配；与fnmatch相同，'*'也匹配路径分隔符
+        """
+        literal = _literal_prefix(pattern)
+        rows = self.prefix_rows(literal)
+        if literal == pattern:
+            return np.asarray([row for row in rows.tolist() if self._row_path(row) == pattern.encode('utf-8')],
+                              dtype=np.int64)
+        return np.asarray([row for row in rows.tolist()
+                           if fnmatch.fnmatchcase(self._row_path(row).decode('utf-8'), pattern)], dtype=np.int64)
+
+    def query(self, classes=None, prefix=None, glob=None):
+        """
+        组合查询，各条件取交集
+
+        参数:
+        - classes: 类别名称或标签列表
+        - prefix: 路径前缀
+        - glob: 路径通配符
+
+        返回:
+        - [(相对路径, 标签), ...]，按标签排序
+        """
+        rows = None
+        for selected in (self.prefix_rows(prefix) if prefix is not None else None,
+                         self.glob_rows(glob) if glob is not None else None,
+                         self.class_rows(classes) if classes is not None else None):
+            if selected is not None:
+                rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+        if rows is None:
+            rows = np.arange(len(self), dtype=np.int64)
+        return self.rows_to_items(rows)
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def query_manifest(csv_path, yaml_path=None, classes=None, prefix=None, glob=None):
+    """
+    按当前存储后端查询完整数据集清单，参数和返回值与 ManifestQuery.query 相同
+
+    文件存储时使用ManifestQuery的磁盘索引；SQLite存储时在数据库中按标签和路径前缀筛选
+    （通配符的字面前缀也作为前缀条件），再用fnmatch逐个匹配通配符
+
+    参数:
+    - csv_path: 完整数据集清单CSV路径
+    - yaml_path: 对应的YAML路径，按类别名称查询时需要
+    """
+    store = get_store()
+    if store is None:
+        with ManifestQuery(csv_path, yaml_path) as query:
+            return query.query(classes, prefix, glob)
+
+    labels = None
+    if classes is not None:
+        if any(isinstance(class_key, str) for class_key in classes) and not yaml_path:
+            raise ValueError("按类别名称查询需要提供YAML文件")
+        class_to_idx = {class_name: label for label, class_name in read_yaml_file(yaml_path)['names'].items()} \
+            if yaml_path else {}
+        labels = sorted({class_to_idx[class_key] if isinstance(class_key, str) else int(class_key)
+                         for class_key in classes})
+    literal = _literal_prefix(glob) if glob is not None else ''
+    # 两个前缀条件都要满足，较长的一个包含较短的一个时只需查询较长的
+    if prefix is not None and not (literal.startswith(prefix) or prefix.startswith(literal)):
+        return []
+    rows = store.read_manifest(csv_path, labels=labels, prefix=max(prefix or '', literal, key=len))
+    if glob is not None:
+        rows = [(rel_path, label) for rel_path, label in rows if fnmatch.fnmatchcase(rel_path, glob)]
+    logger.info(f"SQLite清单查询: {len(rows)} 行")
+    return rows
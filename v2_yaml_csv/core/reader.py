@@ -0,0 +1,211 @@
+"""
+异步预取图像读取器 - 基于划分CSV流式读取并解码图像
+"""
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_csv_file, read_yaml_file
+from utils.archive import read_file, file_mtime_ns
+
+logger = get_logger()
+
+# 结束标记
+_END = object()
+
+class ManifestReader:
+    """
+    基于清单(CSV/YAML)的异步预取图像读取器
+
+    使用一个后台asyncio事件循环驱动线程池：读取线程池负责文件I/O，
+    解码线程池负责图像解码，两者重叠执行；预取深度限制同时在途的样本数。
+    """
+
+    def __init__(self, manifest, root_dir=None, split=None, io_workers=16, decode_workers=None,
+                 prefetch=64, ordered=True, to_rgb=True, imread_flags=cv.IMREAD_COLOR, skip_errors=True,
+                 cache=None):
+        """
+        初始化读取器
+
+        参数:
+        - manifest: 清单，可以是CSV路径、划分YAML路径或[(相对路径, 标签), ...]列表
+        - root_dir: 数据集根目录或tar/zip归档，为None时从YAML的path字段获取
+        - split: manifest为划分YAML时要读取的划分名称(train/val/test)
+        - io_workers: 文件读取线程数
+        - decode_workers: 图像解码线程数，默认为CPU核数
+        - prefetch: 预取深度，即最多同时在途的样本数
+        - ordered: 是否按清单顺序输出，为False时按完成顺序输出
+        - to_rgb: 是否将BGR转换为RGB
+        - imread_flags: OpenCV解码标志
+        - skip_errors: 读取或解码失败时是否跳过该样本，为False时抛出异常
+        - cache: 解码样本缓存(SampleCache)，为None时不使用缓存；使用缓存时产出的数组为只读
+        """
+        self.samples, yaml_root = self._load_manifest(manifest, split)
+        self.root_dir = root_dir if root_dir is not None else yaml_root
+        if self.root_dir is None:
+            raise ValueError("未指定数据集根目录，请提供root_dir或包含path字段的YAML文件")
+
+        self.io_workers = io_workers
+        self.decode_workers = decode_workers or os.cpu_count() or 1
+        self.prefetch = max(1, prefetch)
+        self.ordered = ordered
+        self.to_rgb = to_rgb
+        self.imread_flags = imread_flags
+        self.skip_errors = skip_errors
+        self.cache = cache
+        # 解码方式签名，作为缓存键的一部分
+        self.transform_sig = f'imread={imread_flags};rgb={to_rgb}'
+
+    @staticmethod
+    def _load_manifest(manifest, split):
+        """
+        读取清单
+
+        返回:
+        - 样本列表和YAML中记录的根目录（没有时为None）
+        """
+        if not isinstance(manifest, str):
+            return list(manifest), None
+
+        if manifest.endswith(('.yaml', '.yml')):
+            info = read_yaml_file(manifest)
+            if split is None:
+                raise ValueError("从划分YAML读取时需要指定split参数")
+            csv_path = info.get(split)
+            if not csv_path:
+                raise ValueError(f"划分YAML中没有 {split} 集: {manifest}")
+            return read_csv_file(csv_path), info.get('path')
+
+        return read_csv_file(manifest), None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _read_bytes(self, rel_path):
+        """读取文件原始字节（在读取线程池中执行）"""
+        return read_file(self.root_dir, rel_path)
+
+    def _decode(self, data, rel_path):
+        """解码图像（在解码线程池中执行）"""
+        img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), self.imread_flags)
+        if img is None:
+            raise ValueError(f"无法解码图像: {rel_path}")
+        if self.to_rgb and img.ndim == 3:
+            img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
+        return img
+
+    def _cache_lookup(self, rel_path):
+        """查询缓存（在读取线程池中执行），返回缓存键和命中的数组"""
+        mtime = file_mtime_ns(self.root_dir, rel_path)
+        key = self.cache.make_key(self.root_dir, rel_path, mtime, self.transform_sig)
+        return key, self.cache.get(key)
+
+    async def _load(self, loop, io_pool, decode_pool, rel_path, label):
+        """读取并解码单个样本"""
+        key = None
+        if self.cache is not None:
+            key, img = await loop.run_in_executor(io_pool, self._cache_lookup, rel_path)
+            if img is not None:
+                return img, label, rel_path
+
+        data = await loop.run_in_executor(io_pool, self._read_bytes, rel_path)
+        img = await loop.run_in_executor(decode_pool, self._decode, data, rel_path)
+        if key is not None:
+            await loop.run_in_executor(io_pool, self.cache.put, key, img)
+        return img, label, rel_path
+
+    async def _produce(self, queue):
+        """生产者协程：按预取深度调度样本读取，并将结果放入队列"""
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(self.io_workers, thread_name_prefix='reader-io') as io_pool, \
+             ThreadPoolExecutor(self.decode_workers, thread_name_prefix='reader-decode') as decode_pool:
+            pending = []
+            samples = iter(self.samples)
+            exhausted = False
+            try:
+                while pending or not exhausted:
+                    # 补充在途任务到预取深度
+                    while not exhausted and len(pending) < self.prefetch:
+                        sample = next(samples, None)
+                        if sample is None:
+                            exhausted = True
+                            break
+                        rel_path, label = sample[0], sample[1]
+                        task = asyncio.ensure_future(self._load(loop, io_pool, decode_pool, rel_path, label))
+                        task.rel_path = rel_path
+                        pending.append(task)
+
+                    if not pending:
+                        break
+
+                    # 有序输出等待队首任务，无序输出等待任意任务完成
+                    if self.ordered:
+                        await asyncio.wait([pending[0]])
+                        done = [pending.pop(0)]
+                    else:
+                        finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        done = [task for task in pending if task in finished]
+                        pending = [task for task in pending if task not in finished]
+
+                    for task in done:
+                        if task.exception() is not None:
+                            if not self.skip_errors:
+                                raise task.exception()
+                            logger.error(f"读取图像 {task.rel_path} 失败: {task.exception()}")
+                            continue
+                        await queue.put(task.result())
+            finally:
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+
+    def __iter__(self):
+        """
+        迭代读取样本
+
+        返回:
+        - 依次产出(图像, 标签, 相对路径)元组
+        """
+        loop = asyncio.new_event_loop()
+        queue = asyncio.Queue(maxsize=self.prefetch)
+        result = {}
+
+        async def run():
+            try:
+                await self._produce(queue)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result['error'] = e
+            await queue.put(_END)
+
+        async def start():
+            return asyncio.ensure_future(run())
+
+        async def cancel(task):
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        thread = threading.Thread(target=loop.run_forever, name='reader-loop', daemon=True)
+        thread.start()
+        producer = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        try:
+            while True:
+                item = asyncio.run_coroutine_threadsafe(queue.get(), loop).result()
+                if item is _END:
+                    break
+                yield item
+            if 'error' in result:
+                raise result['error']
+        finally:
+            # 消费者提前退出时取消生产者并等待线程池退出
+            asyncio.run_coroutine_threadsafe(cancel(producer), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
@@ -0,0 +1,126 @@
+"""
+标签重映射表 - 完整数据集标签到子集标签的int32查找表
+"""
+import re
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_csv_file, write_csv_file
+from utils.locking import atomic_write
+
+logger = get_logger()
+
+# 旧版YAML中 mapping 字段的格式: '旧标签 -> 新标签'
+_LEGACY_MAPPING = re.compile(r'^\s*(-?\d+)\s*->\s*(-?\d+)\s*$')
+
+class LabelRemap:
+    """
+    稠密的旧标签 -> 新标签查找表
+
+    table[旧标签] 为新标签，被丢弃的类别为 -1；标签转换只需一次向量化gather。
+    """
+
+    def __init__(self, table):
+        """
+        参数:
+        - table: 长度为完整数据集类别数的整数数组
+        """
+        self.table = np.asarray(table, dtype=np.int32)
+
+    @classmethod
+    def from_class_maps(cls, source_class_to_idx, target_class_to_idx):
+        """
+        由完整数据集和子集的类别-标签映射构建
+
+        参数:
+        - source_class_to_idx: 完整数据集的{类别名称: 标签}
+        - target_class_to_idx: 子集的{类别名称: 标签}
+        """
+        table = np.full(len(source_class_to_idx), -1, dtype=np.int32)
+        for class_name, new_label in target_class_to_idx.items():
+            table[source_class_to_idx[class_name]] = new_label
+        return cls(table)
+
+    @classmethod
+    def from_legacy_mapping(cls, mapping, num_source_classes=None):
+        """
+        由旧版YAML的mapping字段({类别名称: '旧标签 -> 新标签'})构建
+
+        参数:
+        - mapping: 旧版映射字典
+        - num_source_classes: 完整数据集类别数，为None时取最大旧标签+1
+        """
+        pairs = []
+        for class_name, value in mapping.items():
+            match = _LEGACY_MAPPING.match(str(value))
+            if not match:
+                raise ValueError(f"无法解析类别 '{class_name}' 的标签映射: {value}")
+            pairs.append((int(match.group(1)), int(match.group(2))))
+
+        size = num_source_classes if num_source_classes is not None else max((old for old, _ in pairs), default=-1) + 1
+        table = np.full(size, -1, dtype=np.int32)
+        for old_label, new_label in pairs:
+            table[old_label] = new_label
+        return cls(table)
+
+    @classmethod
+    def load(cls, path):
+        """从.npy文件读取"""
+        return cls(np.load(path))
+
+    def save(self, path):
+        """保存为.npy文件，原子发布，读者不会读到写了一半的表"""
+        with atomic_write(path, 'wb') as f:
+            np.save(f, self.table)
+        logger.info(f"标签重映射表已生成: {path}")
+        return path
+
+    @property
+    def num_source_classes(self):
+        return len(self.table)
+
+    @property
+    def num_target_classes(self):
+        return int(self.table.max()) + 1 if len(self.table) else 0
+
+    def apply(self, labels):
+        """
+        将完整数据集标签转换为子集标签
+
+        参数:
+        - labels: 整数数组（任意形状）
+
+        返回:
+        - 同形状的int32数组，被丢弃类别的样本为 -1
+        """
+        return self.table[np.asarray(labels)]
+
+    def inverse(self):
+        """
+        子集标签 -> 完整数据集标签的查找表
+
+        返回:
+        - 长度为子集类别数的int32数组
+        """
+        kept = np.flatnonzero(self.table >= 0)
+        inverse = np.full(self.num_target_classes, -1, dtype=np.int32)
+        inverse[self.table[kept]] = kept
+        return inverse
+
+    def apply_manifest(self, src_csv, dst_csv):
+        """
+        将完整数据集清单转换为子集标签的清单，丢弃不在子集中的样本
+
+        参数:
+        - src_csv: 源清单CSV路径
+        - dst_csv: 目标清单CSV路径
+
+        返回:
+        - 写入的样本数
+        """
+        rows = read_csv_file(src_csv)
+        new_labels = self.apply(np.fromiter((label for _, label in rows), dtype=np.int64, count=len(rows)))
+        kept = [(rel_path, int(label)) for (rel_path, _), label in zip(rows, new_labels) if label >= 0]
+        write_csv_file(dst_csv, kept)
+        return len(kept)
@@ -1,7 +1,10 @@
 import os
 import random
+import numpy as np
 from utils.logger import get_logger
 from utils.file_utils import write_csv_file, write_yaml_file
+from core.remap import LabelRemap
+from core.verifier import read_quarantine, exclude_quarantined
 from datetime import datetime
 
 logger = get_logger()
@@ -25,6 +28,10 @@ class DatasetSelector:
         
         # 可能的子集名称
         self.subset_name = None
+
+        # 最近一次选择得到的标签重映射表
+        self.remap = None
+        self.remap_file = self.select_base_path + "_remap.npy"
     
     def select_classes(self, dataset_info, class_to_images, class_to_idx, num_classes=None, images_per_class=None):
         """
@@ -32,18 +39,29 @@ class DatasetSelector:
         
         参数:
         - dataset_info: 完整数据集信息
-        - class_to_images: 完整数据集的类别到图像映射
+        - class_to_images: 完整数据集的类别到图像映射，也可以是完整数据集的DatasetIndex
         - class_to_idx: 完整数据集的类别到标签映射
         - num_classes: 要选择的类别数量，如果为None则选择所有类别
         - images_per_class: 每个类别要选择的图像数量，如果为None则选择所有图像
         
         返回:
-        - 选择的数据、子集信息字典、新的类别到标签映射字典
+        - 选择的数据（输入为DatasetIndex时也返回DatasetIndex）、子集信息字典、新的类别到标签映射字典
         """
 
+        # 0. 排除校验阶段隔离的损坏图像，类别图像数按排除后的结果计算
+        counts = dataset_info['counts']
+        class_to_images, removed = exclude_quarantined(class_to_images, read_quarantine(self.output_dir, self.dataset_name))
+        if removed:
+            if hasattr(class_to_images, 'class_offsets'):
+                index_counts = class_to_images.class_counts()
+                counts = {class_name: int(index_counts[class_to_idx[class_name]]) for class_name in counts}
+            else:
+                counts = {class_name: len(class_to_images[class_name]) for class_name in counts}
+            logger.info(f"已排除隔离清单中的 {removed} 张图像")
+
         # 1. 选择类别 - 确保类内图像数量足够
         available_classes = []
-        for class_name, class_num in dataset_info['counts'].items():
+        for class_name, class_num in counts.items():
             # 对类内文件数量不做要求，或只选择类内文件数量足够的类别
             if images_per_class is None or class_num >= images_per_class:
                 available_classes.append(class_name)
@@ -63,25 +81,44 @@ class DatasetSelector:
         new_class_to_idx = {class_name: idx for idx, class_name in enumerate(sorted(selected_classes))}
 
         # 2. 选择图像并准备写入
-        selected_data = []
-        total_selected_images = 0
-        
-        # 为每个类别选择图像
-        for class_name in sorted(selected_classes):
-            images = class_to_images[class_name]
-            new_label = new_class_to_idx[class_name]
-            
-            # 选择图像
-            if images_per_class is not None and images_per_class < len(images):
-                selected = random.sample(images, images_per_class)
-            else:
-                selected = images
-            
-            # 添加到选择的数据中
-            for img_path in selected:
-                selected_data.append((img_path, new_label))
+        selected_counts = {}
+        if hasattr(class_to_images, 'class_offsets'):
+            # DatasetIndex: 在每个类别的行号区间内抽样，最后一次性取出子集
+            selected_rows = []
+            for class_name in sorted(selected_classes):
+                start, end = class_to_images.class_range(class_to_idx[class_name])
+                if images_per_class is not None and images_per_class < end - start:
+                    rows = random.sample(range(start, end), images_per_class)
+                else:
+                    rows = range(start, end)
+                selected_rows.append(np.asarray(rows, dtype=np.int64))
+                selected_counts[class_name] = len(rows)
+
+            new_class_names = sorted(selected_classes)
+            selected_data = class_to_images.take(
+                np.concatenate(selected_rows) if selected_rows else np.zeros(0, dtype=np.int64),
+                remap=LabelRemap.from_class_maps(class_to_idx, new_class_to_idx).table,
+                class_names=new_class_names)
+        else:
+            selected_data = []
             
-            total_selected_images += len(selected)
+            # 为每个类别选择图像
+            for class_name in sorted(selected_classes):
+                images = class_to_images[class_name]
+                new_label = new_class_to_idx[class_name]
+                
+                # 选择图像
+                if images_per_class is not None and images_per_class < len(images):
+                    selected = random.sample(images, images_per_class)
+                else:
+                    selected = images
+                
+                # 添加到选择的数据中
+                for img_path in selected:
+                    selected_data.append((img_path, new_label))
+                selected_counts[class_name] = len(selected)
+
+        total_selected_images = sum(selected_counts.values())
 
         # 准备子集数据集信息
         subset_info = {
@@ -91,30 +128,13 @@ class DatasetSelector:
             'total_images': total_selected_images,
             'num_classes': len(selected_classes),
             'names': {value: key for key, value in new_class_to_idx.items()},
-            'counts': None,
-            'mapping': None,
+            'counts': {class_name: selected_counts[class_name] for class_name in selected_classes},
+            'source_classes': len(class_to_idx),
+            'remap': self.remap_file,
         }
         
-        # 添加类别信息和映射关系
-        counts_dict = {}
-        label_mapping = {}
-        for class_name in selected_classes:
-            old_label = class_to_idx[class_name]
-            new_label = new_class_to_idx[class_name]
-            
-            # 计算该类被选中的图像数量
-            selected_count = sum(1 for _, label in selected_data if label == new_label)
-            counts_dict[class_name] = selected_count
-            # subset_info['class_info'][class_name] = {
-            #     'label': new_label,
-            #     'count': selected_count,
-            #     'original_label': old_label
-            # }
-            
-            label_mapping[class_name] = f'{old_label} -> {new_label}'
-        
-        # 添加标签映射信息
-        subset_info['mapping'] = label_mapping
+        # 标签映射: 完整数据集标签 -> 子集标签的int32查找表，被丢弃的类别为-1
+        self.remap = LabelRemap.from_class_maps(class_to_idx, new_class_to_idx)
         logger.info(f"子集选择完成: 选择了 {len(selected_classes)} 个类别, 共 {total_selected_images} 张图像")
         
         return selected_data, subset_info, new_class_to_idx
@@ -135,6 +155,18 @@ class DatasetSelector:
         subset_yaml = self.select_base_path + ".yaml"
         
         write_csv_file(subset_csv, selected_data)  # 写入CSV文件
-        write_yaml_file(subset_yaml, subset_info)  # 写入YAML文件
+        self.write_remap()                         # 写入标签重映射表，先于引用它的YAML发布
+        write_yaml_file(subset_yaml, subset_info, lazy_keys=('names', 'counts'))  # 写入YAML文件
         
-        return subset_csv, subset_yaml
\ No newline at end of file
+        return subset_csv, subset_yaml
+
+    def write_remap(self):
+        """
+        保存最近一次选择的标签重映射表
+        
+        返回:
+        - .npy文件路径
+        """
+        if self.remap is None:
+            raise ValueError("尚未选择子集，没有可保存的标签重映射表")
+        return self.remap.save(self.remap_file)
\ No newline at end of file
@@ -0,0 +1,393 @@
+"""
+共享内存图像缓存 - 同一节点上的多个训练进程共享一份解码后的图像
+"""
+import os
+import time
+import ctypes
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# 控制段头部: [魔数, 行数, 预算字节数, 已用字节数, 下一个段编号, 累计释放的段数, 保留...]
+_MAGIC = 0x444D5348  # 'DMSH'
+_HEADER_SLOTS = 8
+_MAX_PIDS = 256
+_H_MAGIC, _H_ROWS, _H_BUDGET, _H_USED, _H_GEN, _H_FREES = range(6)
+
+# 无锁读取时行被并发改写的重试次数
+_READ_RETRIES = 4
+
+# 行状态
+_EMPTY, _WRITING, _READY = 0, 1, 2
+
+_ROW_DTYPE = np.dtype([
+    ('state', np.int64),
+    ('pid', np.int64),          # 写入者进程号
+    ('gen', np.int64),          # 数据段编号，数据段名为 {prefix}_{gen}
+    ('shape', np.int64, 3),     # 高、宽、通道数（灰度图通道数为0）
+    ('nbytes', np.int64),
+    ('last_access', np.int64),  # CLOCK_MONOTONIC纳秒，节点内所有进程一致
+])
+
+def _open_segment(name, create=False, size=0):
+    """打开共享内存段，并避免resource_tracker在进程退出时删除共享段"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Python 3.13 之前没有track参数，需要手动从resource_tracker注销
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def _unlink(shm):
+    """删除共享内存段"""
+    if getattr(shm, '_track', True):
+        # Python 3.13 之前unlink会从resource_tracker注销，先重新登记以保持配对
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+def _unlink_segment(name):
+    """删除共享内存段，段不存在时忽略"""
+    try:
+        shm = _open_segment(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    _unlink(shm)
+
+def _release(shm):
+    """
+    释放数据段的映射
+
+    调用方仍持有映射上的数组时无法立即解除映射，此时只关闭文件描述符，映射由这些数组持有，
+    最后一个数组释放时自动解除
+    """
+    try:
+        shm.close()
+    except BufferError:
+        shm._mmap = None
+        shm.close()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SharedImageCache:
+    """
+    基于multiprocessing.shared_memory的解码图像缓存
+
+    以划分CSV中的行号为索引，同一节点上的DataLoader worker和DDP进程通过相同的
+    name附加到同一份缓存。控制段记录每行的状态、形状和最近访问时间，每张图像单独
+    存放在一个数据段中；总字节数超过预算时按最近访问时间淘汰。
+    进程崩溃留下的半写入行会在其他进程附加时回收；最后一个进程退出时删除全部共享段。
+    锁文件始终保留: 删除后，阻塞在旧文件上的进程和新附加的进程会各自持有“同一把”锁（见utils.locking.lock_path）。
+    """
+
+    def __init__(self, name, num_rows, budget_bytes=8 << 30, persist=False):
+        """
+        创建或附加到共享缓存
+
+        参数:
+        - name: 缓存名称，同一节点上使用相同名称的进程共享同一份缓存
+        - num_rows: 清单行数
+        - budget_bytes: 所有图像数据的总字节预算
+        - persist: 最后一个进程退出时是否保留共享段
+        """
+        self.name = name
+        self.persist = persist
+        self._handles = {}  # 行号 -> (段编号, SharedMemory)
+        self._seen_frees = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self._lock_file = open(os.path.join(shm_dir, f'{name}.lock'), 'a+')
+
+        ctl_size = (_HEADER_SLOTS + _MAX_PIDS) * 8 + num_rows * _ROW_DTYPE.itemsize
+        with self._locked():
+            try:
+                self._ctl = _open_segment(f'{name}_ctl')
+                created = False
+            except FileNotFoundError:
+                self._ctl = _open_segment(f'{name}_ctl', create=True, size=ctl_size)
+                created = True
+
+            self._header = np.ndarray((_HEADER_SLOTS,), dtype=np.int64, buffer=self._ctl.buf)
+            self._pids = np.ndarray((_MAX_PIDS,), dtype=np.int64, buffer=self._ctl.buf, offset=_HEADER_SLOTS * 8)
+
+            if created:
+                self._header[:] = 0
+                self._pids[:] = 0
+                self._header[_H_MAGIC] = _MAGIC
+                self._header[_H_ROWS] = num_rows
+                self._header[_H_BUDGET] = budget_bytes
+            elif self._header[_H_MAGIC] != _MAGIC or self._header[_H_ROWS] != num_rows:
+                raise ValueError(f"共享缓存 {name} 已存在但行数不一致: {self._header[_H_ROWS]} != {num_rows}")
+
+            self._rows = np.ndarray((num_rows,), dtype=_ROW_DTYPE, buffer=self._ctl.buf,
+                                    offset=(_HEADER_SLOTS + _MAX_PIDS) * 8)
+            if created:
+                self._rows[:] = np.zeros(num_rows, dtype=_ROW_DTYPE)
+            else:
+                self._reclaim()
+            self._register_pid()
+
+        logger.info(f"共享缓存 {name} {'已创建' if created else '已附加'}: {num_rows} 行, 预算 {budget_bytes / (1 << 30):.2f} GB")
+
+    @contextmanager
+    def _locked(self):
+        """跨进程互斥锁"""
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _register_pid(self):
+        """在控制段中登记当前进程（调用方需持有锁）"""
+        free = np.flatnonzero(self._pids == 0)
+        if len(free) == 0:
+            raise RuntimeError(f"共享缓存 {self.name} 附加的进程数超过上限 {_MAX_PIDS}")
+        self._pids[free[0]] = os.getpid()
+
+    def _reclaim(self):
+        """
+        回收崩溃进程留下的资源（调用方需持有锁）
+
+        - 清除已退出进程的登记
+        - 如果已经没有存活进程且不需要保留，清空整个缓存
+        - 回收由已退出进程写了一半的行
+        """
+        for i, pid in enumerate(self._pids):
+            if pid and not _pid_alive(int(pid)):
+                self._pids[i] = 0
+
+        if not self._pids.any() and not self.persist:
+            ready = np.flatnonzero(self._rows['state'] != _EMPTY)
+            if len(ready):
+                logger.warning(f"共享缓存 {self.name} 的所有进程都已退出，清理 {len(ready)} 个残留数据段")
+            for row_id in ready:
+                self._free_row(row_id)
+            return
+
+        for row_id in np.flatnonzero(self._rows['state'] == _WRITING):
+            if not _pid_alive(int(self._rows['pid'][row_id])):
+                self._free_row(row_id)
+
+    def _segment_name(self, gen):
+        return f'{self.name}_{gen}'
+
+    def _free_row(self, row_id):
+        """释放一行的数据段（调用方需持有锁）"""
+        row = self._rows[row_id]
+        if row['state'] != _EMPTY:
+            _unlink_segment(self._segment_name(int(row['gen'])))
+            if row['state'] == _READY:
+                self._header[_H_USED] -= row['nbytes']
+            self._header[_H_FREES] += 1
+        row['state'] = _EMPTY
+        row['pid'] = 0
+
+    def _evict_for(self, nbytes):
+        """按最近访问时间淘汰，直到能放下nbytes字节（调用方需持有锁）"""
+        budget = self._header[_H_BUDGET]
+        if nbytes > budget:
+            return False
+        while self._header[_H_USED] + nbytes > budget:
+            ready = np.flatnonzero(self._rows['state'] == _READY)
+            if len(ready) == 0:
+                return False
+            victim = ready[np.argmin(self._rows['last_access'][ready])]
+            self._free_row(victim)
+            self.stats['evictions'] += 1
+        return True
+
+    def _drop_stale_handles(self):
+        """
+        关闭已被淘汰或重写的行的映射
+
+        其他进程淘汰时只能删除段名，各进程自己的映射要由自己关闭，否则内存不会真正释放，
+        预算也就形同虚设。控制段中的累计释放数变化时才检查。
+        """
+        frees = int(self._header[_H_FREES])
+        if frees == self._seen_frees:
+            return
+        self._seen_frees = frees
+        if not self._handles:
+            return
+        row_ids = np.fromiter(self._handles, dtype=np.int64, count=len(self._handles))
+        gens = np.fromiter((gen for gen, _ in self._handles.values()), dtype=np.int64, count=len(self._handles))
+        rows = self._rows[row_ids]
+        for row_id in row_ids[(rows['state'] != _READY) | (rows['gen'] != gens)].tolist():
+            _release(self._handles.pop(row_id)[1])
+
+    def _attach(self, row_id, gen):
+        """返回行的数据段映射，段已被删除时返回None"""
+        handle = self._handles.get(row_id)
+        if handle is not None:
+            if handle[0] == gen:
+                return handle[1]
+            _release(self._handles.pop(row_id)[1])
+        try:
+            shm = _open_segment(self._segment_name(gen))
+        except FileNotFoundError:
+            return None
+        self._handles[row_id] = (gen, shm)
+        return shm
+
+    def get(self, row_id):
+        """
+        读取缓存的图像
+
+        不加锁读取（顺序锁方式）: 先读状态、段编号和形状，映射数据段后再次检查状态和段编号，
+        期间被淘汰或重写时重试，保证返回的形状和数据属于同一次写入。
+
+        参数:
+        - row_id: 清单行号
+
+        返回:
+        - 命中时返回只读数组（直接映射共享内存，不复制），否则返回None
+        """
+        self._drop_stale_handles()
+        row = self._rows[row_id]
+        for _ in range(_READ_RETRIES):
+            if row['state'] != _READY:
+                break
+            gen = int(row['gen'])
+            shape = tuple(int(x) for x in row['shape'] if x)
+            shm = self._attach(row_id, gen)
+            if row['state'] != _READY or int(row['gen']) != gen:
+                continue
+            if shm is None:
+                break
+            row['last_access'] = time.monotonic_ns()
+            self.stats['hits'] += 1
+            # 经ctypes数组映射: 它持有缓冲区导出，数组（及其视图）存活期间映射无法被关闭；
+            # 直接用shm.buf时numpy不持有导出，关闭映射后再访问数组会段错误
+            buffer = (ctypes.c_uint8 * int(np.prod(shape))).from_buffer(shm.buf)
+            array = np.ndarray(shape, dtype=np.uint8, buffer=buffer)
+            array.flags.writeable = False
+            return array
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, row_id, array):
+        """
+        将解码后的uint8图像写入缓存
+
+        参数:
+        - row_id: 清单行号
+        - array: 形状为(H, W)或(H, W, C)的uint8数组
+
+        返回:
+        - 是否写入成功（超出预算或已被其他进程写入时返回False）
+        """
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        with self._locked():
+            row = self._rows[row_id]
+            if row['state'] != _EMPTY or not self._evict_for(array.nbytes):
+                return False
+            gen = int(self._header[_H_GEN])
+            self._header[_H_GEN] += 1
+            row['gen'] = gen
+            row['pid'] = os.getpid()
+            row['state'] = _WRITING
+
+        # 在锁外复制数据，其他进程看到WRITING状态时视为未命中
+        shm = _open_segment(self._segment_name(gen), create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[...] = array
+        shm.close()
+
+        with self._locked():
+            row = self._rows[row_id]
+            shape = list(array.shape) + [0] * (3 - array.ndim)
+            row['shape'] = shape
+            row['nbytes'] = array.nbytes
+            row['last_access'] = time.monotonic_ns()
+            row['state'] = _READY
+            self._header[_H_USED] += array.nbytes
+        return True
+
+    def get_or_load(self, row_id, loader):
+        """
+        读取缓存，未命中时调用loader解码并写入缓存
+
+        参数:
+        - row_id: 清单行号
+        - loader: 无参数的加载函数，返回解码后的uint8数组
+
+        返回:
+        - 解码后的数组
+        """
+        array = self.get(row_id)
+        if array is None:
+            array = loader()
+            self.put(row_id, array)
+        return array
+
+    def summary(self):
+        """返回当前进程的命中统计和整个缓存的占用情况"""
+        stats = dict(self.stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        stats['items'] = int((self._rows['state'] == _READY).sum())
+        stats['used_bytes'] = int(self._header[_H_USED])
+        stats['budget_bytes'] = int(self._header[_H_BUDGET])
+        return stats
+
+    def close(self):
+        """
+        从缓存分离；最后一个存活进程分离时删除所有共享段（persist=True时保留）
+        """
+        if self._ctl is None:
+            return
+        # 调用方仍持有返回的数组时，映射在数组释放后回收
+        for _, shm in self._handles.values():
+            _release(shm)
+        self._handles.clear()
+
+        with self._locked():
+            # 同一进程可能多次附加，只移除一条登记
+            mine = np.flatnonzero(self._pids == os.getpid())
+            if len(mine):
+                self._pids[mine[0]] = 0
+            alive = [int(pid) for pid in self._pids if pid and _pid_alive(int(pid))]
+            last = not alive and not self.persist
+            if last:
+                for row_id in np.flatnonzero(self._rows['state'] != _EMPTY):
+                    self._free_row(row_id)
+            del self._header, self._pids, self._rows
+            self._ctl.close()
+            if last:
+                _unlink(self._ctl)
+            self._ctl = None
+        self._lock_file.close()
+
+    @staticmethod
+    def destroy(name):
+        """强制删除名为name的缓存的所有共享段（用于手动清理），锁文件保留"""
+        prefix = f'{name}_'
+        if os.path.isdir('/dev/shm'):
+            for filename in os.listdir('/dev/shm'):
+                if filename.startswith(prefix):
+                    _unlink_segment(filename)
+        else:
+            _unlink_segment(f'{name}_ctl')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
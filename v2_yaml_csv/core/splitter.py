@@ -4,10 +4,15 @@ import random
 import numpy as np
 from enum import Enum
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from sklearn.model_selection import train_test_split
 from utils.logger import get_logger
 from utils.file_utils import write_csv_file, write_yaml_file
+from core.verifier import read_quarantine, exclude_quarantined
+from core.dedup import read_dup_groups, keep_groups_together
+from utils.archive import file_size
+from utils.locking import atomic_write
 
 logger = get_logger()
 
@@ -29,6 +34,7 @@ class DatasetSplitter:
         self.root_dir = args.root_dir
         self.output_dir = args.output_dir
         self.split_base_path = args.split_base_path
+        self.dataset_name = getattr(args, 'dataset_name', None)
 
     def split_dataset(self, data_list, class_to_idx=None, strategy=SplitStrategy.STRATIFIED, 
                       train_ratio=0.7, val_ratio=0.15, test_ratio=0.15, seed=42):
@@ -36,7 +42,7 @@ class DatasetSplitter:
         划分数据集为训练集、验证集和测试集
         
         参数:
-        - data_list: 数据列表，格式为[(相对路径, 标签), ...]
+        - data_list: 数据列表，格式为[(相对路径, 标签), ...]，也可以是DatasetIndex
         - class_to_idx: 类别到标签的映射字典
         - strategy: 划分策略，可选RANDOM或STRATIFIED
         - train_ratio: 训练集比例
@@ -61,6 +67,18 @@ class DatasetSplitter:
             test_ratio /= total
         
         split_ratio = {'train': train_ratio, 'val': val_ratio, 'test': test_ratio}
+
+        # 排除校验阶段隔离的损坏图像
+        data_list, removed = exclude_quarantined(data_list, read_quarantine(self.output_dir, self.dataset_name))
+        if removed:
+            logger.info(f"已排除隔离清单中的 {removed} 张图像")
+
+        # 去重阶段得到的重复组，同组样本放在同一个划分
+        dup_groups = read_dup_groups(self.output_dir, self.dataset_name)
+
+        # DatasetIndex 按行号划分，不展开为元组列表
+        if hasattr(data_list, 'class_offsets'):
+            return self._split_index(data_list, strategy, split_ratio, seed, dup_groups), split_ratio
         
         # 初始化分割结果
         splits = {
@@ -118,12 +136,79 @@ class DatasetSplitter:
         else:
             raise ValueError(f"不支持的划分策略: {strategy}")
         
+        splits = self._keep_duplicates_together(splits, dup_groups, lambda items: (rel_path for rel_path, _ in items))
+
         # 记录每个集合的图像数量
         split_counts = {split: len(images) for split, images in splits.items()}
         logger.info(f"数据集划分完成: 训练集 {split_counts['train']}张, 验证集 {split_counts['val']}张, 测试集 {split_counts['test']}张")
         
         return splits, split_ratio
     
+    def _keep_duplicates_together(self, splits, dup_groups, paths_of):
+        """
+        把同一重复组的样本移到同一个划分
+        
+        参数:
+        - splits: {划分名称: 元素列表或行号数组}
+        - dup_groups: {相对路径: 组号}
+        - paths_of: 函数，元素序列 -> 相对路径序列
+        
+        返回:
+        - 调整后的划分字典
+        """
+        if not dup_groups:
+            return splits
+        splits, moved = keep_groups_together(
+            splits, lambda items: [dup_groups.get(rel_path, -1) for rel_path in paths_of(items)])
+        if moved:
+            logger.info(f"为避免重复图像跨划分泄漏, 移动了 {moved} 张图像")
+        return splits
+
+    def _split_index(self, index, strategy, split_ratio, seed, dup_groups=None):
+        """
+        划分DatasetIndex，结果与对等的元组列表划分后写出的CSV一致
+        
+        参数:
+        - index: DatasetIndex
+        - strategy: 划分策略
+        - split_ratio: 划分比例字典
+        - seed: 随机种子
+        - dup_groups: {相对路径: 组号}，同组样本放在同一个划分
+        
+        返回:
+        - {'train': DatasetIndex, 'val': DatasetIndex, 'test': DatasetIndex}
+        """
+        if strategy == SplitStrategy.RANDOM:
+            groups = [np.arange(len(index), dtype=np.int64)] if len(index) else []
+        elif strategy == SplitStrategy.STRATIFIED:
+            # CSR偏移直接给出每个类别的行号区间
+            counts = index.class_counts()
+            groups = [np.arange(*index.class_range(label), dtype=np.int64)
+                      for label in range(index.num_classes) if counts[label]]
+        else:
+            raise ValueError(f"不支持的划分策略: {strategy}")
+
+        if not groups:
+            logger.warning("数据列表为空，无法进行划分")
+
+        rows = {'train': [], 'val': [], 'test': []}
+        for group in groups:
+            train_rows, val_rows, test_rows = self._train_val_test_split(
+                group,
+                split_ratio=split_ratio,
+                random_state=seed,
+                shuffle=True
+            )
+            rows['train'].append(np.asarray(train_rows, dtype=np.int64))
+            rows['val'].append(np.asarray(val_rows, dtype=np.int64))
+            rows['test'].append(np.asarray(test_rows, dtype=np.int64))
+
+        rows = {split: np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64) for split, parts in rows.items()}
+        rows = self._keep_duplicates_together(rows, dup_groups, index.paths)
+        splits = {split: index.take(split_rows) for split, split_rows in rows.items()}
+        logger.info(f"数据集划分完成: 训练集 {len(splits['train'])}张, 验证集 {len(splits['val'])}张, 测试集 {len(splits['test'])}张")
+        return splits
+
     def _train_val_test_split(self,
                               data,
                               split_ratio={'train': 0.7, 'val': 0.15, 'test': 0.15}, 
@@ -199,7 +284,7 @@ class DatasetSplitter:
 
         return result['train'], result['val'], result['test']
     
-    def write_split_files(self, splits, split_ratio, class_to_idx):
+    def write_split_files(self, splits, split_ratio, class_to_idx, remap_file=None):
         """
         将划分后的数据集写入文件
         
@@ -207,7 +292,7 @@ class DatasetSplitter:
         - splits: 划分后的数据集字典，格式为{'train': [...], 'val': [...], 'test': [...]}
         - split_ratio: 划分比例字典，格式为{'train': 0.7, 'val': 0.15, 'test': 0.15}
         - class_to_idx: 类别到标签的映射字典
-        - root_dir: 数据集根目录，用于YAML信息
+        - remap_file: 完整数据集标签到划分标签的重映射表(.npy)路径，划分基于子集时提供
         
         返回:
         - 包含各分割文件路径的字典
@@ -229,13 +314,15 @@ class DatasetSplitter:
             'test': None,
             'name': {value: key for key, value in class_to_idx.items()},
         }
+        if remap_file:
+            split_info['remap'] = remap_file
 
         #class_counts = defaultdict(int)
         for split_name, split_data in splits.items():
             if not split_data:
                 continue
             # 创建CSV文件, 并写入
-            csv_path = f"{self.split_base_path}_{split_name}_{''.join(str(split_ratio[split_name]).split('.'))}.csv"
+            csv_path = self.split_csv_path(split_name, split_ratio)
             split_info[split_name] = csv_path
             write_csv_file(csv_path, split_data)
 
@@ -244,7 +331,7 @@ class DatasetSplitter:
 
         # 写入YAML文件
         yaml_path = f"{self.split_base_path}_split.yaml"
-        write_yaml_file(yaml_path, split_info)
+        write_yaml_file(yaml_path, split_info, lazy_keys=('name',))
 
         # 保存文件路径
         split_files[split_name] = {
@@ -252,4 +339,143 @@ class DatasetSplitter:
             'yaml': yaml_path
         }
         
-        return split_files
\ No newline at end of file
+        return split_files
+
+    def split_csv_path(self, split_name, split_ratio):
+        """
+        划分CSV路径，如 {split_base_path}_train_08.csv
+
+        参数:
+        - split_name: 'train'、'val'或'test'
+        - split_ratio: split_dataset返回的划分比例字典
+        """
+        return f"{self.split_base_path}_{split_name}_{''.join(str(split_ratio[split_name]).split('.'))}.csv"
+
+    def _shard_rows(self, data, world_size, balance, stratified, seed, io_workers=32):
+        """
+        把一个划分的样本分配到各rank
+
+        每组样本（分层时为每个类别，否则为全部样本）先按种子打乱，按字节均衡时再按文件大小降序，
+        然后每次取world_size个样本，按各rank当前负载从小到大依次分配。
+        按数量均衡时各rank样本数之差不超过1，分层时每个类别在各rank上的数量之差也不超过1；
+        按字节均衡时相当于分块的最长处理时间优先(LPT)贪心。
+
+        参数:
+        - data: [(相对路径, 标签), ...]或DatasetIndex
+        - world_size: rank数
+        - balance: 'count'按样本数均衡，'bytes'按文件字节数均衡
+        - stratified: 是否按标签分层
+        - seed: 随机种子
+        - io_workers: 读取文件大小的线程数
+
+        返回:
+        - 每个rank的行号数组列表，以及每个rank的字节数（按数量均衡时为None）
+        """
+        is_index = hasattr(data, 'class_offsets')
+        if balance == 'bytes':
+            paths = data.paths() if is_index else (rel_path for rel_path, _ in data)
+            with ThreadPoolExecutor(io_workers) as pool:
+                weights = np.fromiter(pool.map(lambda rel_path: file_size(self.root_dir, rel_path), paths),
+                                      dtype=np.int64, count=len(data))
+        elif balance == 'count':
+            weights = np.ones(len(data), dtype=np.int64)
+        else:
+            raise ValueError(f"不支持的均衡方式: {balance}")
+
+        if is_index:
+            labels = data.labels.astype(np.int64)
+        else:
+            labels = np.fromiter((label for _, label in data), dtype=np.int64, count=len(data))
+        if stratified:
+            # 一次稳定排序后按标签边界切分，每组内保持行号升序
+            order = np.argsort(labels, kind='stable')
+            _, starts = np.unique(labels[order], return_index=True)
+            groups = np.split(order, starts[1:])
+        else:
+            groups = [np.arange(len(data))]
+
+        rng = np.random.default_rng(seed)
+        loads = np.zeros(world_size, dtype=np.int64)
+        assignment = np.empty(len(data), dtype=np.int64)
+        for group in groups:
+            group = rng.permutation(group)
+            if balance == 'bytes':
+                group = group[np.argsort(-weights[group], kind='stable')]
+            for start in range(0, len(group), world_size):
+                chunk = group[start:start + world_size]
+                ranks = np.lexsort((np.arange(world_size), loads))[:len(chunk)]
+                assignment[chunk] = ranks
+                loads[ranks] += weights[chunk]
+
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(world_size + 1))
+        rows = [order[bounds[rank]:bounds[rank + 1]] for rank in range(world_size)]
+        return rows, (loads.tolist() if balance == 'bytes' else None)
+
+    def write_shard_files(self, splits, split_ratio, world_size, balance='count', stratified=False,
+                          epochs=0, seed=42):
+        """
+        为分布式训练生成每个rank各自的划分清单，每个rank只需读取自己的分片
+
+        - 分片CSV: {划分CSV去掉扩展名}_rank{r}of{W}.csv，行按标签排序
+        - 洗牌表: {分片CSV去掉扩展名}_perm.npy，形状为(epochs, 分片样本数)的int32数组，
+          第e行为第e个epoch读取分片行的顺序，由(seed, epoch, rank)确定，训练时无需再生成
+        - 分片YAML: {split_base_path}_shards_{W}.yaml，记录各rank的文件、样本数和字节数
+
+        参数:
+        - splits: 划分后的数据集字典，值为数据列表或DatasetIndex
+        - split_ratio: 划分比例字典
+        - world_size: rank数
+        - balance: 'count'按样本数均衡，'bytes'按文件字节数均衡
+        - stratified: 是否按标签分层，使每个类别均匀分布在各rank上
+        - epochs: 预先生成洗牌表的epoch数，为0时不生成
+        - seed: 随机种子
+
+        返回:
+        - 分片YAML路径
+        """
+        shard_info = {
+            'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'path': self.root_dir if self.root_dir else "",
+            'world_size': world_size,
+            'balance': balance,
+            'stratified': stratified,
+            'epochs': epochs,
+            'seed': seed,
+        }
+
+        for split_name, split_data in splits.items():
+            if not len(split_data):
+                continue
+            # DatasetIndex用take取分片，保留附加列（width/height等）
+            is_index = hasattr(split_data, 'class_offsets')
+            data = split_data if is_index else list(split_data)
+            rows, loads = self._shard_rows(data, world_size, balance, stratified, seed)
+            shard_base = self.split_csv_path(split_name, split_ratio)[:-len('.csv')]
+
+            shards = []
+            for rank, rank_rows in enumerate(rows):
+                if is_index:
+                    shard_data = data.take(rank_rows)
+                else:
+                    shard_data = sorted((data[i] for i in rank_rows), key=lambda x: x[1])
+                csv_path = f"{shard_base}_rank{rank}of{world_size}.csv"
+                write_csv_file(csv_path, shard_data)
+                shard = {'csv': csv_path, 'count': len(shard_data)}
+                if loads is not None:
+                    shard['bytes'] = loads[rank]
+                if epochs:
+                    perm = np.stack([np.random.default_rng([seed, epoch, rank]).permutation(len(shard_data))
+                                     for epoch in range(epochs)]).astype(np.int32)
+                    shard['perm'] = csv_path[:-len('.csv')] + '_perm.npy'
+                    with atomic_write(shard['perm'], 'wb') as f:
+                        np.save(f, perm)
+                shards.append(shard)
+            shard_info[split_name] = shards
+
+            counts = [shard['count'] for shard in shards]
+            logger.info(f"{split_name}集分片完成: {world_size} 个rank, 样本数 {min(counts)}~{max(counts)}")
+
+        yaml_path = f"{self.split_base_path}_shards_{world_size}.yaml"
+        write_yaml_file(yaml_path, shard_info)
+        return yaml_path
@@ -0,0 +1,179 @@
+"""
+数据集统计模块 - 多进程流式计算逐通道均值/标准差、尺寸直方图和文件大小
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2 as cv
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_csv_file, read_yaml_file, write_yaml_file
+from utils.archive import read_file
+
+logger = get_logger()
+
+def _empty_partial(channels):
+    return {'n': 0, 'mean': np.zeros(channels), 'M2': np.zeros(channels), 'failed': 0, 'per_label': {}}
+
+def merge_moments(n_a, mean_a, M2_a, n_b, mean_b, M2_b):
+    """
+    Chan等人的并行方差合并公式，合并两组样本的(数量, 均值, 平方偏差和)
+
+    返回:
+    - 合并后的(n, mean, M2)
+    """
+    n = n_a + n_b
+    if n == 0:
+        return 0, mean_a, M2_a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    M2 = M2_a + M2_b + delta * delta * (n_a * n_b / n)
+    return n, mean, M2
+
+def _stats_chunk(root_dir, items, bin_size):
+    """
+    统计一批样本（在工作进程中执行）
+
+    每张图像用整数求和与平方和精确得到本图的均值和M2，再按Chan公式合并，
+    不需要为整张图像分配浮点副本。通道顺序为OpenCV的BGR。
+
+    返回:
+    - 部分统计结果字典
+    """
+    partial = _empty_partial(3)
+    for rel_path, label in items:
+        entry = partial['per_label'].get(label)
+        if entry is None:
+            entry = partial['per_label'][label] = [0, 0, Counter(), Counter()]
+        try:
+            data = read_file(root_dir, rel_path)
+        except OSError:
+            data = b''
+        size = len(data)
+        img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_COLOR) if data else None
+        if img is None:
+            partial['failed'] += 1
+            continue
+
+        height, width = img.shape[:2]
+        pixels = img.reshape(-1, 3)
+        n = pixels.shape[0]
+        sums = pixels.sum(axis=0, dtype=np.uint64).astype(np.float64)
+        sumsq = np.einsum('ij,ij->j', pixels, pixels, dtype=np.uint64).astype(np.float64)
+        mean = sums / n
+        M2 = sumsq - sums * mean
+        partial['n'], partial['mean'], partial['M2'] = merge_moments(
+            partial['n'], partial['mean'], partial['M2'], n, mean, M2)
+
+        entry[0] += 1
+        entry[1] += size
+        entry[2][width // bin_size * bin_size] += 1
+        entry[3][height // bin_size * bin_size] += 1
+    return partial
+
+def _merge_partial(total, partial):
+    total['n'], total['mean'], total['M2'] = merge_moments(
+        total['n'], total['mean'], total['M2'], partial['n'], partial['mean'], partial['M2'])
+    total['failed'] += partial['failed']
+    for label, (images, size, widths, heights) in partial['per_label'].items():
+        entry = total['per_label'].get(label)
+        if entry is None:
+            total['per_label'][label] = [images, size, widths, heights]
+        else:
+            entry[0] += images
+            entry[1] += size
+            entry[2].update(widths)
+            entry[3].update(heights)
+
+def compute_stats(data_list, root_dir, class_names=None, sample=None, seed=42, num_workers=None,
+                  chunk_size=256, bin_size=32, to_rgb=True):
+    """
+    多进程计算数据集统计信息
+
+    参数:
+    - data_list: [(相对路径, 标签), ...]
+    - root_dir: 数据集根目录或归档
+    - class_names: {标签: 类别名称}，为None时以标签作为键
+    - sample: 随机抽取的样本数，为None时统计全部样本
+    - seed: 抽样的随机种子
+    - num_workers: 进程数，为None时使用CPU核数
+    - chunk_size: 每个任务的样本数
+    - bin_size: 宽高直方图的分桶宽度（像素），直方图保存为[[桶起点, 数量], ...]
+    - to_rgb: 通道顺序是否为RGB（否则为OpenCV的BGR）
+
+    返回:
+    - (stats, class_stats): 全局统计和逐类别统计
+    """
+    data_list = list(data_list)
+    if sample is not None and sample < len(data_list):
+        rows = np.sort(np.random.default_rng(seed).choice(len(data_list), sample, replace=False))
+        data_list = [data_list[i] for i in rows]
+
+    chunks = [data_list[i:i + chunk_size] for i in range(0, len(data_list), chunk_size)]
+    total = _empty_partial(3)
+    logger.info(f"开始统计 {len(data_list)} 张图像, {len(chunks)} 个任务")
+    with ProcessPoolExecutor(num_workers) as pool:
+        futures = [pool.submit(_stats_chunk, root_dir, chunk, bin_size) for chunk in chunks]
+        # 按完成顺序合并，慢任务不会阻塞已完成结果的合并（Chan合并与顺序无关）
+        for done, future in enumerate(as_completed(futures), 1):
+            _merge_partial(total, future.result())
+            if done % 100 == 0:
+                logger.debug(f"统计进度: {done}/{len(chunks)}")
+
+    # uint8 图像归一化到 [0, 1]，工作进程按BGR统计，需要时翻转为RGB
+    n = total['n']
+    mean = total['mean'] / 255.0
+    std = np.sqrt(total['M2'] / n) / 255.0 if n else np.zeros(3)
+    if to_rgb:
+        mean, std = mean[::-1], std[::-1]
+
+    per_label = total['per_label']
+    stats = {
+        'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'num_images': sum(entry[0] for entry in per_label.values()),
+        'num_failed': total['failed'],
+        'sample': sample,
+        'seed': seed,
+        'channels': 'RGB' if to_rgb else 'BGR',
+        'pixels': int(n),
+        'mean': [round(float(v), 6) for v in mean],
+        'std': [round(float(v), 6) for v in std],
+        'total_bytes': int(sum(entry[1] for entry in per_label.values())),
+        'bin_size': bin_size,
+    }
+    class_stats = {}
+    for label in sorted(per_label):
+        images, size, widths, heights = per_label[label]
+        key = class_names[label] if class_names is not None else label
+        class_stats[key] = {
+            'images': images,
+            'bytes': int(size),
+            'width': [[int(b), c] for b, c in sorted(widths.items())],
+            'height': [[int(b), c] for b, c in sorted(heights.items())],
+        }
+
+    logger.info(f"统计完成: {stats['num_images']} 张图像, 失败 {stats['num_failed']} 张, "
+                f"mean={stats['mean']}, std={stats['std']}")
+    return stats, class_stats
+
+def write_dataset_stats(csv_path, yaml_path, root_dir, **kwargs):
+    """
+    读取完整数据集清单，计算统计信息并写回数据集YAML的 stats / class_stats 字段
+
+    参数:
+    - csv_path: 完整数据集清单路径
+    - yaml_path: 完整数据集YAML路径
+    - root_dir: 数据集根目录或归档
+    - kwargs: 传给 compute_stats 的参数
+
+    返回:
+    - (stats, class_stats)
+    """
+    dataset_info = read_yaml_file(yaml_path)
+    stats, class_stats = compute_stats(read_csv_file(csv_path), root_dir, dataset_info['names'], **kwargs)
+    dataset_info['stats'] = stats
+    dataset_info['class_stats'] = class_stats
+    write_yaml_file(yaml_path, dataset_info, lazy_keys=('names', 'counts', 'class_stats'))
+    return stats, class_stats
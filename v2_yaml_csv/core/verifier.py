@@ -0,0 +1,235 @@
+"""
+图像校验模块 - 多进程解码检查清单中的图像，损坏文件写入隔离清单
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import cv2 as cv
+import numpy as np
+
+from utils.logger import get_logger
+from utils.locking import atomic_write
+from utils.archive import read_file, file_size, file_mtime_ns
+
+logger = get_logger()
+
+# 没有长度字段的JPEG标记: TEM、RST0-7、SOI
+_JPEG_STANDALONE = {0x01, *range(0xD0, 0xD9)}
+
+def quarantine_path(output_dir, dataset_name):
+    """隔离清单路径: {output_dir}/{dataset_name}_quarantine.csv"""
+    return os.path.join(output_dir, f"{dataset_name}_quarantine.csv")
+
+def read_quarantine(output_dir, dataset_name):
+    """
+    读取隔离清单
+
+    返回:
+    - 被隔离的相对路径集合，没有隔离清单时为空集合
+    """
+    if dataset_name is None:
+        return set()
+    path = quarantine_path(output_dir, dataset_name)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        next(f, None)
+        # 路径中可能含逗号，从右侧切掉label和reason
+        return {line.rstrip('\r\n').rsplit(',', 2)[0] for line in f if line.strip()}
+
+def exclude_quarantined(data, quarantined):
+    """
+    从数据中去掉被隔离的样本
+
+    参数:
+    - data: DatasetIndex、{类别名称: [相对路径, ...]} 或 [(相对路径, 标签), ...]
+    - quarantined: 被隔离的相对路径集合
+
+    返回:
+    - 同类型的数据和去掉的样本数
+    """
+    if not quarantined:
+        return data, 0
+    if hasattr(data, 'class_offsets'):
+        keep = np.fromiter((rel_path not in quarantined for rel_path in data.paths()), dtype=bool, count=len(data))
+        removed = int(len(data) - keep.sum())
+        return (data.take(np.flatnonzero(keep)) if removed else data), removed
+    if isinstance(data, dict):
+        filtered = {class_name: [rel_path for rel_path in images if rel_path not in quarantined]
+                    for class_name, images in data.items()}
+        removed = sum(len(images) for images in data.values()) - sum(len(images) for images in filtered.values())
+        return filtered, removed
+    filtered = [item for item in data if item[0] not in quarantined]
+    return filtered, len(data) - len(filtered)
+
+def _jpeg_scan_start(data):
+    """
+    逐段跳过JPEG标记，返回主图像第一个SOS标记的偏移，段结构损坏时返回None
+
+    EXIF缩略图在APP1段内，随段一起跳过，其中的SOS/EOI不会被误认
+    """
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        code = data[pos + 1]
+        if code == 0xFF:  # 填充字节
+            pos += 1
+        elif code in _JPEG_STANDALONE:
+            pos += 2
+        elif code == 0xDA:
+            return pos
+        else:
+            pos += 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+    return None
+
+def _png_complete(data):
+    """按长度逐个跳过PNG数据块，能走到IEND块说明文件完整"""
+    pos = 8
+    while pos + 8 <= len(data):
+        if data[pos + 4:pos + 8] == b'IEND':
+            return True
+        pos += 12 + int.from_bytes(data[pos:pos + 4], 'big')
+    return False
+
+def check_image(root_dir, rel_path):
+    """
+    检查单个图像
+
+    参数:
+    - root_dir: 数据集根目录或归档
+    - rel_path: 相对路径
+
+    返回:
+    - 问题原因（missing / empty / read_error / truncated / decode_failed），正常时为None
+    """
+    try:
+        data = read_file(root_dir, rel_path)
+    except FileNotFoundError:
+        return 'missing'
+    except OSError:
+        return 'read_error'
+    if not data:
+        return 'empty'
+
+    # OpenCV对截断的JPEG/PNG只给出警告并返回部分图像，先检查结束标记。
+    # 结束标记之后可能还有任意长度的附加数据，不能只看文件末尾:
+    # JPEG的熵编码数据中不会出现0xFFD9，主图像SOS之后有EOI即为完整；PNG按块结构查找IEND
+    if data[:2] == b'\xff\xd8':
+        scan_start = _jpeg_scan_start(data)
+        if scan_start is not None and data.rfind(b'\xff\xd9') < scan_start:
+            return 'truncated'
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and not _png_complete(data):
+        return 'truncated'
+
+    img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_UNCHANGED)
+    if img is None or img.size == 0:
+        return 'decode_failed'
+    return None
+
+def _check_chunk(root_dir, rel_paths):
+    """检查一批图像（在工作进程中执行）"""
+    return [check_image(root_dir, rel_path) for rel_path in rel_paths]
+
+class ImageVerifier:
+    """
+    多进程校验清单中的图像
+
+    结果按(相对路径, 文件大小, 修改时间)缓存在 {output_dir}/{dataset_name}_verify_cache.csv，
+    再次运行时只检查新增或变化的文件。损坏的样本写入隔离清单，
+    DatasetSelector 和 DatasetSplitter 会自动排除隔离清单中的样本。
+    """
+
+    def __init__(self, root_dir, output_dir, dataset_name, num_workers=None, chunk_size=64, stat_workers=32):
+        """
+        参数:
+        - root_dir: 数据集根目录或归档
+        - output_dir: 输出目录
+        - dataset_name: 数据集名称
+        - num_workers: 解码检查的进程数，为None时使用CPU核数
+        - chunk_size: 每个任务的文件数
+        - stat_workers: 读取文件大小和修改时间的线程数
+        """
+        self.root_dir = root_dir
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.stat_workers = stat_workers
+        self.cache_path = os.path.join(output_dir, f"{dataset_name}_verify_cache.csv")
+        self.quarantine_path = quarantine_path(output_dir, dataset_name)
+
+    def _load_cache(self):
+        """读取缓存: {相对路径: (大小, 修改时间, 原因)}，原因为空字符串表示正常"""
+        cache = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                next(f, None)
+                for line in f:
+                    rel_path, size, mtime_ns, reason = line.rstrip('\r\n').rsplit(',', 3)
+                    cache[rel_path] = (int(size), int(mtime_ns), reason)
+        return cache
+
+    def _save_cache(self, cache):
+        with atomic_write(self.cache_path) as f:
+            f.write("rel_path,size,mtime_ns,reason\n")
+            for rel_path, (size, mtime_ns, reason) in cache.items():
+                f.write(f"{rel_path},{size},{mtime_ns},{reason}\n")
+
+    def _stat(self, rel_path):
+        try:
+            return file_size(self.root_dir, rel_path), file_mtime_ns(self.root_dir, rel_path)
+        except OSError:
+            return None
+
+    def verify(self, data_list):
+        """
+        校验清单中的全部样本，并写出隔离清单
+
+        参数:
+        - data_list: [(相对路径, 标签), ...]或DatasetIndex
+
+        返回:
+        - 隔离的样本列表[(相对路径, 标签, 原因), ...]
+        """
+        data_list = list(data_list)
+        cache = self._load_cache()
+        with ThreadPoolExecutor(self.stat_workers) as pool:
+            stats = list(pool.map(self._stat, (rel_path for rel_path, _ in data_list)))
+
+        reasons = [None] * len(data_list)
+        pending = []
+        new_cache = {}
+        for i, ((rel_path, _), stat) in enumerate(zip(data_list, stats)):
+            if stat is None:
+                reasons[i] = 'missing'
+                continue
+            cached = cache.get(rel_path)
+            if cached is not None and cached[:2] == stat:
+                reasons[i] = cached[2] or None
+                new_cache[rel_path] = cached
+            else:
+                pending.append(i)
+        logger.info(f"开始校验: 共 {len(data_list)} 个文件, 缓存命中 {len(data_list) - len(pending)} 个, "
+                    f"需要检查 {len(pending)} 个")
+
+        chunks = [pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)]
+        if chunks:
+            with ProcessPoolExecutor(self.num_workers) as pool:
+                futures = [pool.submit(_check_chunk, self.root_dir, [data_list[i][0] for i in chunk]) for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    for i, reason in zip(chunk, future.result()):
+                        reasons[i] = reason
+                        # 检查期间消失的文件不缓存
+                        if reason != 'missing':
+                            new_cache[data_list[i][0]] = (*stats[i], reason or '')
+        self._save_cache(new_cache)
+
+        quarantined = [(rel_path, label, reason) for (rel_path, label), reason in zip(data_list, reasons) if reason]
+        with atomic_write(self.quarantine_path) as f:
+            f.write("rel_path,label,reason\n")
+            for rel_path, label, reason in quarantined:
+                f.write(f"{rel_path},{label},{reason}\n")
+
+        logger.info(f"校验完成({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}): {len(quarantined)} 个文件被隔离, "
+                    f"隔离清单: {self.quarantine_path}")
+        return quarantined
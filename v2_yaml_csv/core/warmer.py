@@ -0,0 +1,234 @@
+"""
+页缓存预热模块 - 按划分清单或批次规划的顺序提前发出readahead提示，隐藏首个epoch的随机小文件读取延迟
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.file_utils import read_csv_file, read_yaml_file
+from utils.archive import is_archive, open_archive
+
+logger = get_logger()
+
+# 没有posix_fadvise的平台上改为实际读取，每次读取的块大小
+_READ_CHUNK = 1 << 20
+
+def load_warm_order(manifest, split=None, plan=None):
+    """
+    读取要预热的样本及其顺序
+
+    参数:
+    - manifest: 划分CSV路径或划分YAML路径
+    - split: manifest为划分YAML时的划分名称
+    - plan: 可选的行号顺序(.npy)，可以是批次规划(批次数, batch_size)（-1为填充）或分片洗牌表
+
+    返回:
+    - (相对路径列表, YAML中记录的根目录或None)
+    """
+    root_dir = None
+    if manifest.endswith(('.yaml', '.yml')):
+        info = read_yaml_file(manifest)
+        if split is None:
+            raise ValueError("从划分YAML读取时需要指定split参数")
+        csv_path = info.get(split)
+        if not csv_path:
+            raise ValueError(f"划分YAML中没有 {split} 集: {manifest}")
+        manifest, root_dir = csv_path, info.get('path')
+
+    rel_paths = [rel_path for rel_path, _ in read_csv_file(manifest)]
+    if plan is not None:
+        rows = np.load(plan).ravel()
+        rows = rows[rows >= 0]
+        rel_paths = [rel_paths[row] for row in rows.tolist()]
+    return rel_paths, root_dir
+
+class PageCacheWarmer:
+    """
+    页缓存预热器
+
+    按给定顺序逐窗口处理文件: 先并发stat得到inode和大小，窗口内按inode（或归档内偏移）排序，
+    再由有界线程池发出 posix_fadvise(WILLNEED)，由内核在后台读入页缓存。
+    已提示但尚未被消费的字节数不超过内存预算:
+    - warm(): 一次性预热，达到预算即停止
+    - start()/advance()/stop(): 后台持续领先于训练采样器，训练循环调用advance报告进度
+    """
+
+    def __init__(self, root_dir, budget_bytes=4 << 30, num_workers=16, window=1024, order='inode'):
+        """
+        参数:
+        - root_dir: 数据集根目录或tar/zip归档
+        - budget_bytes: 领先于消费位置的预热字节数上限
+        - num_workers: 发出提示的线程数
+        - window: 每次排序的文件数，越大越接近磁盘顺序，但偏离计划顺序越远
+        - order: 'inode'为窗口内按inode排序，'manifest'为保持给定顺序
+        """
+        if order not in ('inode', 'manifest'):
+            raise ValueError(f"不支持的预热顺序: {order}")
+        self.root_dir = root_dir
+        self.budget_bytes = budget_bytes
+        self.num_workers = num_workers
+        self.window = window
+        self.order = order
+        self.archive = open_archive(root_dir) if is_archive(root_dir) else None
+
+        # 状态 ----------------------------------------------------------------------------------------
+        self._cond = threading.Condition()
+        self._ahead = {}          # 位置 -> 已提示但未消费的字节数
+        self._ahead_bytes = 0
+        self._position = 0        # 消费者当前位置
+        self._stopped = False
+        self._thread = None
+        self.files = 0
+        self.bytes = 0
+
+    def _locate(self, rel_path):
+        """返回(排序键, 字节数)，文件不存在时返回None"""
+        try:
+            if self.archive is not None:
+                offset, size = self.archive.member_range(rel_path)
+                return offset, size
+            stat = os.stat(os.path.join(self.root_dir, rel_path))
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino), stat.st_size
+
+    def _advise(self, rel_path):
+        """提示内核预读一个文件（在线程池中执行）"""
+        if self.archive is not None:
+            offset, size = self.archive.member_range(rel_path)
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(self.archive.fileno(), offset, size, os.POSIX_FADV_WILLNEED)
+            else:
+                os.pread(self.archive.fileno(), size, offset)
+            return
+        try:
+            fd = os.open(os.path.join(self.root_dir, rel_path), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while os.read(fd, _READ_CHUNK):
+                    pass
+        finally:
+            os.close(fd)
+
+    def _reserve(self, size, follow):
+        """
+        等待预算足够容纳一个文件，预算不足时等待消费者前进（follow）或结束预热
+
+        返回:
+        - 是否继续预热
+        """
+        with self._cond:
+            # 至少允许领先一个文件，单个文件超过预算时不会永远等待
+            while not self._stopped and self._ahead_bytes and self._ahead_bytes + size > self.budget_bytes:
+                if not follow:
+                    self._stopped = True
+                    break
+                self._cond.wait()
+            return not self._stopped
+
+    def _cut(self, located):
+        """
+        按计划顺序取出当前剩余预算能容纳的最长前缀（至少一个文件），并占用预算
+
+        返回:
+        - 前缀的长度
+        """
+        with self._cond:
+            free = self.budget_bytes - self._ahead_bytes
+            count = 0
+            for position, (_, size) in located:
+                if count and size > free:
+                    break
+                free -= size
+                count += 1
+                self._ahead[position] = size
+                self._ahead_bytes += size
+        return count
+
+    def _run(self, rel_paths, follow):
+        """
+        按窗口预热
+
+        每次先按计划顺序截取预算能容纳的一段，只在这一段内按inode排序，
+        预热的总是计划顺序的前缀，排序只改变同一段内的发出顺序
+
+        参数:
+        - rel_paths: 计划顺序的相对路径
+        - follow: 为True时达到预算后等待advance，否则达到预算即结束
+        """
+        with ThreadPoolExecutor(self.num_workers, thread_name_prefix='warm') as pool:
+            for start in range(0, len(rel_paths), self.window):
+                window = rel_paths[start:start + self.window]
+                located = [(start + i, loc) for i, loc in enumerate(pool.map(self._locate, window)) if loc is not None]
+
+                futures = []
+                while located:
+                    # 消费者已经越过的文件不再预热
+                    located = [item for item in located if item[0] >= self._position]
+                    if not located or not self._reserve(located[0][1][1], follow):
+                        break
+                    count = self._cut(located)
+                    batch, located = located[:count], located[count:]
+                    if self.order == 'inode':
+                        batch.sort(key=lambda item: item[1][0])
+                    for position, (_, size) in batch:
+                        futures.append(pool.submit(self._advise, window[position - start]))
+                        self.files += 1
+                        self.bytes += size
+                for future in futures:
+                    future.result()
+                if self._stopped:
+                    break
+
+    def warm(self, rel_paths):
+        """
+        一次性预热，从计划顺序的开头起直到预算用完
+
+        返回:
+        - {'files': 预热的文件数, 'bytes': 字节数}
+        """
+        started = datetime.now()
+        self._stopped = False
+        self._run(list(rel_paths), follow=False)
+        elapsed = (datetime.now() - started).total_seconds()
+        logger.info(f"预热完成: {self.files} 个文件, {self.bytes / (1 << 20):.1f} MB, 用时 {elapsed:.1f} 秒")
+        return {'files': self.files, 'bytes': self.bytes}
+
+    def start(self, rel_paths):
+        """在后台线程中持续预热，领先消费位置不超过预算"""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(list(rel_paths), True), name='warmer', daemon=True)
+        self._thread.start()
+        return self
+
+    def advance(self, position):
+        """
+        报告消费进度
+
+        参数:
+        - position: 已消费的样本数（计划顺序中的位置）
+        """
+        with self._cond:
+            if position <= self._position:
+                return
+            for done in [p for p in self._ahead if p < position]:
+                self._ahead_bytes -= self._ahead.pop(done)
+            self._position = position
+            self._cond.notify_all()
+
+    def stop(self):
+        """停止后台预热"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,508 @@
+"""
+监视模式 - 基于Linux inotify增量维护完整数据集清单和划分清单
+"""
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import hashlib
+from collections import Counter
+
+from utils.file_utils import read_csv_file, write_csv_file, read_yaml_file, write_yaml_file, manifest_exists, \
+    get_store
+from core.processor import DatasetProcessor, IMAGE_EXTENSIONS
+from core.class_resolver import ClassResolver
+from core.splitter import DatasetSplitter
+from core.remap import LabelRemap
+from utils.archive import is_archive
+
+# inotify事件掩码（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# 监视的事件: 文件写完、移入/移出、删除，以及目录的创建
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT = struct.Struct('iIII')
+
+class Inotify:
+    """
+    inotify的ctypes封装，不依赖第三方库
+
+    read()返回(wd, mask, cookie, name)元组列表，name为相对于被监视目录的文件名
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._init1 = libc.inotify_init1
+        self._init1.argtypes = [ctypes.c_int]
+        self._init1.restype = ctypes.c_int
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._rm_watch.restype = ctypes.c_int
+
+        self.fd = self._init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify初始化失败: {os.strerror(err)}")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """监视目录，返回监视描述符wd"""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, f"inotify监视数量达到上限，请调大 fs.inotify.max_user_watches: {path}")
+            raise OSError(err, f"无法监视目录 {path}: {os.strerror(err)}")
+        return wd
+
+    def rm_watch(self, wd):
+        """取消监视，目录已被删除时忽略错误"""
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """
+        读取事件
+
+        参数:
+        - timeout: 等待事件的秒数，None为一直等待
+
+        返回:
+        - [(wd, mask, cookie, name), ...]，超时返回空列表
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, cookie, length = _EVENT.unpack_from(buf, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(buf[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def hash_split(rel_path, split_ratio, seed=42):
+    """
+    按路径哈希把样本分配到划分，结果只取决于路径和种子，与扫描顺序和其他样本无关
+
+    参数:
+    - rel_path: 相对路径
+    - split_ratio: {'train': 0.8, 'val': 0.2, 'test': 0}
+    - seed: 随机种子
+
+    返回:
+    - 划分名称
+    """
+    digest = hashlib.blake2b(f'{seed}:{rel_path}'.encode('utf-8'), digest_size=8).digest()
+    point = int.from_bytes(digest, 'big') / float(1 << 64)
+    names = [name for name in ('train', 'val', 'test') if split_ratio.get(name)]
+    total = sum(split_ratio[name] for name in names)
+    acc = 0.0
+    for name in names:
+        acc += split_ratio[name] / total
+        if point < acc:
+            return name
+    return names[-1]
+
+class DatasetWatcher(DatasetProcessor):
+    """
+    常驻进程，订阅root_dir下的inotify事件并增量更新清单
+
+    - 新增、删除、重命名在去抖后批量应用，已有样本的标签和划分保持不变
+    - 新类别追加为当前最大标签+1，已有类别的标签不变
+    - 新样本按路径哈希分配划分；重命名的样本保留原划分
+    - 事件队列溢出时回退为一次完整扫描
+    - 写盘时只处理上次写盘后变化的样本: SQLite存储下按行增量更新，CSV只重写有变化的清单，
+      写出的行按标签排序
+    """
+
+    def __init__(self, args):
+        """
+        参数:
+        - args: 命令行参数，除DatasetProcessor所需字段外还使用
+                class_depth, class_pattern, split_base_path, seed, debounce
+        """
+        super().__init__(args)
+        if is_archive(self.root_dir):
+            raise ValueError(f"监视模式需要目录作为根目录，不支持归档: {self.root_dir}")
+        self.class_depth = args.class_depth
+        self.class_pattern = args.class_pattern
+        self.seed = getattr(args, 'seed', 42)
+        self.debounce = getattr(args, 'debounce', 2.0)
+        # 持续有事件时最长等待时间，避免清单一直不落盘
+        self.max_delay = self.debounce * 10
+        self.splitter = DatasetSplitter(args)
+        self.split_yaml = f"{args.split_base_path}_split.yaml"
+
+        self.inotify = None
+        self.wd_to_dir = {}      # wd -> 相对目录（根目录为'.'）
+        self.labels = {}         # 相对路径 -> 完整数据集标签
+        self.class_to_idx = {}
+        self.split_of = None     # 相对路径 -> 划分名称，没有划分文件时为None
+        self.changed = set()     # 上次写盘后新增或删除的相对路径
+        self.split_changed = {'train': set(), 'val': set(), 'test': set()}
+        self.split_yaml_dirty = False
+        self.dirty = False
+        self._stopped = False
+        self._walked = False     # 是否已完整扫描过（扫描时同时建立监视）
+
+    # 状态 ----------------------------------------------------------------------------------------
+    def load_state(self):
+        """
+        读取已有清单，不存在或不匹配时完整扫描一次
+
+        返回:
+        - 是否进行了完整扫描（扫描时已建立监视，状态与磁盘一致）
+        """
+        self._walked = False
+        _, _, dataset_info, class_to_images, class_to_idx = self.load(self.class_depth, self.class_pattern)
+        self.class_depth = dataset_info['class_depth']
+        self.extensions = tuple(dataset_info.get('extensions') or IMAGE_EXTENSIONS)
+        self.resolver = ClassResolver(self.class_depth, self.class_pattern)
+        self.class_to_idx = dict(class_to_idx)
+        self.labels = {rel_path: class_to_idx[class_name]
+                       for class_name, images in class_to_images.items() for rel_path in images}
+        self.changed = set()
+        self.split_changed = {'train': set(), 'val': set(), 'test': set()}
+        self.split_yaml_dirty = False
+
+        if manifest_exists(self.split_yaml):
+            self._load_splits()
+        else:
+            self.logger.info(f"未找到划分文件 {self.split_yaml}，只维护完整数据集清单")
+        self.logger.info(f"监视状态加载完成: {len(self.class_to_idx)} 个类别, {len(self.labels)} 张图像")
+        return self._walked
+
+    def _load_splits(self):
+        """读取划分YAML和各划分CSV，记录每个样本所在的划分"""
+        split_info = read_yaml_file(self.split_yaml)
+        self.split_ratio = split_info['split_ratio']
+        self.split_class_to_idx = {class_name: label for label, class_name in split_info['name'].items()}
+        self.remap_file = split_info.get('remap')
+        self.remap = LabelRemap.load(self.remap_file) if self.remap_file else None
+
+        self.split_of = {}
+        self.split_csv = {}
+        for split_name in ('train', 'val', 'test'):
+            csv_path = split_info.get(split_name)
+            self.split_csv[split_name] = csv_path
+            if csv_path and manifest_exists(csv_path):
+                for rel_path, _ in read_csv_file(csv_path):
+                    self.split_of[rel_path] = split_name
+
+    def _split_label(self, label):
+        """完整数据集标签 -> 划分中的标签，不属于划分的类别返回-1"""
+        if self.remap is None:
+            return label
+        return int(self.remap.table[label]) if label < self.remap.num_source_classes else -1
+
+    def _add(self, rel_path, split_name=None):
+        """
+        添加一个样本
+
+        参数:
+        - rel_path: 相对路径
+        - split_name: 重命名时沿用的原划分，None时按路径哈希分配
+        """
+        if not rel_path.lower().endswith(self.extensions) or rel_path in self.labels:
+            return
+        class_name = self.resolver.resolve(rel_path)
+        if not class_name:
+            return
+
+        label = self.class_to_idx.get(class_name)
+        if label is None:
+            label = self.class_to_idx[class_name] = len(self.class_to_idx)
+            self.logger.info(f"发现新类别: {class_name} -> {label}")
+            if self.split_of is not None and self.remap is None:
+                self.split_class_to_idx[class_name] = label
+                self.split_yaml_dirty = True
+        self.labels[rel_path] = label
+        self.changed.add(rel_path)
+        self.dirty = True
+
+        if self.split_of is not None and self._split_label(label) >= 0:
+            split_name = split_name or hash_split(rel_path, self.split_ratio, self.seed)
+            self.split_of[rel_path] = split_name
+            self.split_changed[split_name].add(rel_path)
+
+    def _remove(self, rel_path):
+        """删除一个样本，返回其原来的划分"""
+        if self.labels.pop(rel_path, None) is None:
+            return None
+        self.changed.add(rel_path)
+        self.dirty = True
+        split_name = self.split_of.pop(rel_path, None) if self.split_of is not None else None
+        if split_name is not None:
+            self.split_changed[split_name].add(rel_path)
+        return split_name
+
+    def _under(self, rel_dir):
+        """相对目录下已记录的全部样本"""
+        prefix = rel_dir + os.sep
+        return [rel_path for rel_path in self.labels if rel_path.startswith(prefix)]
+
+    # 监视 ----------------------------------------------------------------------------------------
+    def _join(self, rel_dir, name):
+        return name if rel_dir == os.curdir else rel_dir + os.sep + name
+
+    def _watch_walk(self, rel_dir):
+        """
+        递归监视目录，逐目录产出(相对目录, [文件名, ...])
+
+        每个目录先建立监视再列出内容，列出之后新建的文件会产生事件，不会遗漏
+        """
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = self.inotify.add_watch(os.path.join(self.root_dir, current))
+            except FileNotFoundError:
+                continue
+            self.wd_to_dir[wd] = current
+            filenames = []
+            try:
+                with os.scandir(os.path.join(self.root_dir, current)) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(self._join(current, entry.name))
+                        elif entry.is_file():
+                            filenames.append(entry.name)
+            except FileNotFoundError:
+                continue
+            yield current, filenames
+
+    def _walk(self):
+        """完整扫描时同时建立监视，启动和重新扫描都只遍历一次目录树"""
+        self._walked = True
+        yield from self._watch_walk(os.curdir)
+
+    def _watch_tree(self, rel_dir, add_files=False):
+        """
+        递归监视目录，可同时把已存在的文件加入清单（新目录在建立监视前可能已写入文件）
+        """
+        for current, filenames in self._watch_walk(rel_dir):
+            if add_files:
+                for filename in filenames:
+                    self._add(self._join(current, filename))
+
+    def _unwatch_tree(self, rel_dir):
+        """取消监视移出根目录的目录树"""
+        prefix = rel_dir + os.sep
+        for wd, current in list(self.wd_to_dir.items()):
+            if current == rel_dir or current.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.wd_to_dir[wd]
+
+    def _rename_tree(self, old_dir, new_dir):
+        """目录在根目录内重命名: 更新监视映射，目录下样本保留原划分、重新解析类别"""
+        old_prefix = old_dir + os.sep
+        for wd, current in self.wd_to_dir.items():
+            if current == old_dir:
+                self.wd_to_dir[wd] = new_dir
+            elif current.startswith(old_prefix):
+                self.wd_to_dir[wd] = new_dir + os.sep + current[len(old_prefix):]
+        for rel_path in self._under(old_dir):
+            split_name = self._remove(rel_path)
+            self._add(new_dir + os.sep + rel_path[len(old_prefix):], split_name)
+
+    def resync(self, reason):
+        """完整扫描一次并与当前状态求差，用于启动时和事件丢失后"""
+        self.logger.info(f"重新扫描数据集: {reason}")
+        scanned = set()
+        for _, rel_paths in self._scan(self.resolver, self.extensions):
+            scanned.update(rel_paths)
+        for rel_path in [rel_path for rel_path in self.labels if rel_path not in scanned]:
+            self._remove(rel_path)
+        for rel_path in scanned:
+            self._add(rel_path)
+
+    def apply_events(self, events):
+        """
+        应用一批事件
+
+        同一cookie的MOVED_FROM/MOVED_TO配对为重命名；只有一半的视为移出(删除)或移入(新增)
+        """
+        moved_to = {cookie for _, mask, cookie, _ in events if mask & IN_MOVED_TO}
+        moved_from = {}
+
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning("inotify事件队列溢出")
+                self.resync("事件丢失")
+                continue
+            if mask & IN_IGNORED:
+                self.wd_to_dir.pop(wd, None)
+                continue
+            rel_dir = self.wd_to_dir.get(wd)
+            if rel_dir is None or not name:
+                if mask & IN_DELETE_SELF and rel_dir == os.curdir:
+                    self.logger.error(f"数据集根目录已被删除: {self.root_dir}")
+                continue
+            rel_path = self._join(rel_dir, name)
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & IN_MOVED_FROM:
+                if cookie in moved_to:
+                    moved_from[cookie] = rel_path
+                elif is_dir:
+                    self._unwatch_tree(rel_path)
+                    for child in self._under(rel_path):
+                        self._remove(child)
+                else:
+                    self._remove(rel_path)
+            elif mask & IN_MOVED_TO:
+                old_path = moved_from.pop(cookie, None)
+                if is_dir:
+                    if old_path is not None:
+                        self._rename_tree(old_path, rel_path)
+                    else:
+                        self._watch_tree(rel_path, add_files=True)
+                else:
+                    split_name = self._remove(old_path) if old_path is not None else None
+                    self._add(rel_path, split_name)
+            elif mask & IN_CREATE:
+                if is_dir:
+                    self._watch_tree(rel_path, add_files=True)
+            elif mask & IN_CLOSE_WRITE:
+                self._add(rel_path)
+            elif mask & IN_DELETE:
+                if is_dir:
+                    for child in self._under(rel_path):
+                        self._remove(child)
+                else:
+                    self._remove(rel_path)
+
+    # 输出 ----------------------------------------------------------------------------------------
+    def _write_manifest(self, csv_path, rows, changed):
+        """
+        写出一个有变化的清单
+
+        参数:
+        - csv_path: 清单路径
+        - rows: {相对路径: 标签}，清单的当前内容
+        - changed: 上次写盘后新增或删除的相对路径
+        """
+        store = get_store()
+        if store is not None:
+            # 先删除变化的路径再插入仍存在的，新增、删除和重命名都只涉及这些行
+            store.update_manifest(csv_path, added=[(rel_path, rows[rel_path]) for rel_path in changed
+                                                   if rel_path in rows], removed=changed)
+            return
+        # write_csv_file按标签稳定排序后写出，同一标签内保持插入顺序
+        write_csv_file(csv_path, list(rows.items()))
+
+    def _write_split_yaml(self):
+        """划分YAML中的类别表或划分文件路径变化时重写"""
+        split_info = dict(read_yaml_file(self.split_yaml, lazy=False))
+        split_info['nc'] = len(self.split_class_to_idx)
+        split_info['name'] = {label: class_name for class_name, label in self.split_class_to_idx.items()}
+        for split_name, csv_path in self.split_csv.items():
+            split_info[split_name] = csv_path
+        write_yaml_file(self.split_yaml, split_info, lazy_keys=('name',))
+
+    def flush(self):
+        """把上次写盘后的变化写回完整数据集清单和有变化的划分清单"""
+        if not self.dirty:
+            return
+        self._write_manifest(self.full_data_csv, self.labels, self.changed)
+        label_counts = Counter(self.labels.values())
+        counts = {class_name: label_counts.get(label, 0) for class_name, label in self.class_to_idx.items()}
+        dataset_info = self._dataset_info(self.class_depth, self.class_pattern, self.extensions,
+                                          self.class_to_idx, counts)
+        write_yaml_file(self.full_data_yaml, dataset_info, lazy_keys=('names', 'counts'))
+
+        if self.split_of is not None:
+            for split_name, changed in self.split_changed.items():
+                if not changed:
+                    continue
+                if not self.split_csv[split_name]:
+                    # 原来为空的划分第一次有样本
+                    self.split_csv[split_name] = self.splitter.split_csv_path(split_name, self.split_ratio)
+                    self.split_yaml_dirty = True
+                # SQLite只需要变化的行，CSV需要整个划分
+                members = changed if get_store() is not None else self.split_of
+                rows = {rel_path: self._split_label(self.labels[rel_path])
+                        for rel_path in members if self.split_of.get(rel_path) == split_name}
+                self._write_manifest(self.split_csv[split_name], rows, changed)
+                self.logger.info(f"划分清单已更新: {self.split_csv[split_name]}, {len(changed)} 个样本有变化")
+            if self.split_yaml_dirty:
+                self._write_split_yaml()
+
+        self.changed = set()
+        self.split_changed = {'train': set(), 'val': set(), 'test': set()}
+        self.split_yaml_dirty = False
+        self.dirty = False
+        self.logger.info(f"清单已更新: {len(self.class_to_idx)} 个类别, {len(self.labels)} 张图像")
+
+    # 主循环 --------------------------------------------------------------------------------------
+    def stop(self):
+        """请求停止监视（可从其他线程调用）"""
+        self._stopped = True
+
+    def run(self):
+        """
+        开始监视，直到stop()被调用或收到KeyboardInterrupt
+
+        事件静默debounce秒后批量应用并写盘；事件持续不断时最迟max_delay秒写盘一次
+        """
+        self.inotify = Inotify()
+        try:
+            # 清单可能落后于磁盘（上次运行之后的改动），读取已有清单后对齐一次；
+            # 对齐时的扫描同时建立监视
+            if not self.load_state():
+                self.resync("与磁盘对齐已有清单")
+            self.logger.info(f"开始监视 {self.root_dir}: 监视 {len(self.wd_to_dir)} 个目录, 去抖 {self.debounce} 秒")
+
+            pending = []
+            first_at = last_at = 0.0
+            while not self._stopped:
+                timeout = 1.0
+                if pending:
+                    deadline = min(last_at + self.debounce, first_at + self.max_delay)
+                    timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+                events = self.inotify.read(timeout)
+                now = time.monotonic()
+                if events:
+                    if not pending:
+                        first_at = now
+                    pending.extend(events)
+                    last_at = now
+                if pending and (now - last_at >= self.debounce or now - first_at >= self.max_delay):
+                    self.apply_events(pending)
+                    pending = []
+                    self.flush()
+        except KeyboardInterrupt:
+            self.logger.info("收到中断信号，停止监视")
+        finally:
+            self.inotify.close()
@@ -9,18 +9,33 @@ import random
 import numpy as np
 from datetime import datetime
 
-from config import DEFAULT_OUTPUT_DIR, DEFAULT_SEED, DEFAULT_LOG_FILE
 from utils.logger import setup_logger, get_logger
 # from utils.file_utils import write_split_files
 from core.processor import DatasetProcessor
 from core.selector import DatasetSelector
 from core.splitter import DatasetSplitter, SplitStrategy
+from core.watcher import DatasetWatcher
+from core.manifest_diff import diff_files
+from core.query import query_manifest
+from core.stats import write_dataset_stats
+from core.bucketing import plan_manifest
+from core.verifier import ImageVerifier
+from core.dedup import Deduplicator
+from core.warmer import PageCacheWarmer, load_warm_order
+from core.merger import merge_datasets
+from core.batch import run_batch
+from utils.file_utils import read_csv_file, read_yaml_file, write_csv_file, configure_storage
+from utils.v1_migrate import migrate_v1_cache
+from utils.archive import is_archive, archive_stem
 
 class MyProcessor():
     def __init__(self, args):
         self.args = args
-        self.args.dataset_name = os.path.basename(args.root_dir)
-        self.args.full_data_path = os.path.join(args.output_dir, self.args.dataset_name)
+        # root_dir为tar/zip归档时以去掉扩展名的文件名作为数据集名称
+        self.args.dataset_name = archive_stem(args.root_dir) if is_archive(args.root_dir) else os.path.basename(args.root_dir)
+        # 批量任务中完整数据集由共享的扫描阶段生成，可能位于组内其他任务的输出目录中
+        self.args.full_data_path = getattr(args, 'scan_data_path', None) or \
+            os.path.join(args.output_dir, self.args.dataset_name)
 
         if isinstance(args.num_classes, int) and args.select_subset:
             note1 = f'_{str(args.num_classes)}'
@@ -39,12 +54,18 @@ class MyProcessor():
         self.args.select_base_path = os.path.join(args.output_dir, f'{self.args.dataset_name}_select{note1}{note2}')
         self.args.split_base_path = os.path.join(args.output_dir, f'{self.args.dataset_name}_split{note1}{note2}')
 
+    def setup_storage(self):
+        """选择清单存储后端，sqlite时所有清单和YAML写入 {dataset_name}.sqlite"""
+        db_path = self.args.full_data_path + '.sqlite' if self.args.storage == 'sqlite' else None
+        return configure_storage(self.args.storage, db_path)
+
     def do_process(self):
         # 处理数据集
         # 设置日志级别
         log_level = 'DEBUG' if self.args.verbose else 'INFO'
         setup_logger(log_level=log_level, log_dir=self.args.log_file)
         logger = get_logger()
+        self.setup_storage()
         
         # 设置随机种子
         random.seed(self.args.seed)
@@ -62,18 +83,27 @@ class MyProcessor():
             # 创建数据集处理器
             processor = DatasetProcessor(self.args)
             
-            # 生成完整数据集
+            # 生成完整数据集（批量任务中由共享的扫描阶段生成，这里直接读取）
             logger.info("开始生成完整数据集")
-            csv_file, yaml_file, dataset_info, class_to_images, class_to_idx = processor.generate_full_dataset(
-                self.args.class_depth,
-                self.args.class_pattern
-            )
+            if self.args.reuse_scan:
+                csv_file, yaml_file, dataset_info, dataset_index = processor.load_full_index(
+                    self.args.class_depth,
+                    self.args.class_pattern
+                )
+            else:
+                csv_file, yaml_file, dataset_info, dataset_index = processor.generate_full_index(
+                    self.args.class_depth,
+                    self.args.class_pattern,
+                    self.args.probe_headers
+                )
+            class_to_idx = dataset_index.class_to_idx
             logger.info(f"完整数据集生成完成: CSV={csv_file}, YAML={yaml_file}")
             
             # 处理数据集 - 选择子集
             data_to_process = None
             class_idx_mapping = None
             base_name = None
+            remap_file = None
             
             if self.args.select_subset:
                 logger.info("开始选择子集")
@@ -86,7 +116,7 @@ class MyProcessor():
                 # 选择子集
                 subset_data, subset_info, subset_class_to_idx = selector.select_classes(
                     dataset_info,
-                    class_to_images,
+                    dataset_index,
                     class_to_idx,
                     self.args.num_classes,
                     self.args.images_per_class
@@ -96,9 +126,13 @@ class MyProcessor():
                 data_to_process = subset_data
                 class_idx_mapping = subset_class_to_idx
                 base_name = selector.subset_name
+                remap_file = selector.remap_file
                 
+                # 划分时不写子集文件，但仍保存标签重映射表供划分YAML引用
+                if self.args.split_dataset:
+                    selector.write_remap()
                 # 如果不需要划分，则写入子集文件
-                if not self.args.split_dataset:
+                else:
                     subset_csv, subset_yaml = selector.write_subset_files(subset_data, subset_info)
                     logger.info(f"子集数据集文件生成完成: CSV={subset_csv}, YAML={subset_yaml}")
                     
@@ -112,11 +146,7 @@ class MyProcessor():
                         logger.info(f"子集文件复制完成: {copy_stats}")
             else:
                 # 使用完整数据集
-                data_to_process = []
-                for class_name, images in class_to_images.items():
-                    class_idx = class_to_idx[class_name]
-                    for rel_img_path in images:
-                        data_to_process.append((rel_img_path, class_idx))
+                data_to_process = dataset_index
                 class_idx_mapping = class_to_idx
                 base_name = processor.dataset_name
             
@@ -140,7 +170,37 @@ class MyProcessor():
                 )
                 
                 # 写入划分文件
-                split_files = splitter.write_split_files(splits, split_ratio, class_idx_mapping)
+                split_files = splitter.write_split_files(splits, split_ratio, class_idx_mapping, remap_file)
+
+                # 为分布式训练生成每个rank的分片清单
+                if self.args.world_size > 1:
+                    shard_yaml = splitter.write_shard_files(
+                        splits,
+                        split_ratio,
+                        self.args.world_size,
+                        self.args.shard_balance,
+                        self.args.shard_stratified,
+                        self.args.shard_epochs,
+                        self.args.seed,
+                    )
+                    logger.info(f"分片清单生成完成: {shard_yaml}")
+
+                # 按宽高比分桶生成每个epoch的批次规划（需要文件头解析得到的尺寸列）
+                if self.args.bucket_batch_size > 0:
+                    if not self.args.probe_headers:
+                        logger.warning("批次规划需要图像尺寸，请同时开启 --probe_headers")
+                    else:
+                        for split_name, split_data in splits.items():
+                            if len(split_data):
+                                plan_yaml = plan_manifest(
+                                    splitter.split_csv_path(split_name, split_ratio),
+                                    self.args.bucket_batch_size,
+                                    self.args.bucket_epochs,
+                                    num_buckets=self.args.num_buckets,
+                                    label_balanced=self.args.bucket_label_balanced,
+                                    seed=self.args.seed,
+                                )
+                                logger.info(f"{split_name}集批次规划: {plan_yaml}")
                 
                 # 打印划分结果
                 logger.info(f"数据集划分完成: 训练集 {len(splits['train'])}张, 验证集 {len(splits['val'])}张, 测试集 {len(splits['test'])}张")
@@ -166,18 +226,37 @@ class MyProcessor():
             logger.info("=" * 50)
 
 
-def main():
-    """主函数，处理命令行参数并执行相应操作"""
-    # 解析命令行参数
+def class_depth_type(value):
+    """--class_depth 参数类型: 非负整数或'auto'"""
+    if value == 'auto':
+        return value
+    return int(value)
+
+
+def build_parser():
+    """构建命令行参数解析器，批量任务也用它得到每个任务的默认参数"""
     parser = argparse.ArgumentParser(description='数据集处理工具')
+    # 子命令: run为完整处理流程，migrate为v1缓存迁移，watch为监视目录并增量更新清单，
+    #        diff为生成清单增量，query为查询完整数据集清单，export为把SQLite存储导出为CSV/YAML，
+    #        stats为统计均值/标准差和尺寸分布，verify为解码检查并生成隔离清单，
+    #        dedup为查找重复图像，划分时同组图像放在同一个划分，warm为按划分清单预热页缓存，
+    #        merge为把多个完整数据集清单合并到统一的标签空间，batch为并发运行任务文件中的多个任务
+    parser.add_argument('command', nargs='?', default='run',
+                        choices=['run', 'migrate', 'watch', 'diff', 'query', 'export', 'stats', 'verify', 'dedup',
+                                 'warm', 'merge', 'batch'],
+                        help='执行的命令')
     # 基本参数
-    parser.add_argument('--root_dir', type=str, default='/data/data_wll/AMU-Tuning-main/data/vggface2_224', help='数据集根目录')
+    parser.add_argument('--root_dir', type=str, default='/data/data_wll/AMU-Tuning-main/data/vggface2_224', help='数据集根目录，也可以是未压缩的tar或zip归档')
     parser.add_argument('--output_dir', type=str, default="./output", help='输出目录')
-    parser.add_argument('--class_depth', type=int, default=0, help='类别所在的目录层级（从0开始）')
+    parser.add_argument('--class_depth', type=class_depth_type, default=0, help='类别所在的目录层级（从0开始），auto为自动探测')
+    parser.add_argument('--probe_samples', type=int, default=32, help='自动探测类别层级时的随机下探次数')
     parser.add_argument('--class_pattern', type=str, default=None, help='用于从路径中提取类别的正则表达式')
+    parser.add_argument('--probe_headers', action='store_true', help='扫描时读取图像文件头，在清单中记录宽、高、通道数和格式')
+    parser.add_argument('--reuse_scan', action='store_true', help='直接使用已生成的完整数据集文件，不重新扫描')
     parser.add_argument('--seed', type=int, default=42, help='随机种子')
     parser.add_argument('--log_file', type=str, default="/logs", help='日志文件路径')
     parser.add_argument('--verbose', action='store_true', help='显示详细日志')
+    parser.add_argument('--storage', type=str, default='files', choices=['files', 'sqlite'], help='清单存储后端')
     
     # 子集选择参数
     parser.add_argument('--select_subset', type=bool, default=True, help='是否选择子集')
@@ -191,13 +270,145 @@ def main():
     parser.add_argument('--train_ratio', type=float, default=0.8, help='训练集比例')
     parser.add_argument('--val_ratio', type=float, default=0.2, help='验证集比例')
     parser.add_argument('--test_ratio', type=float, default=0, help='测试集比例')
+
+    # 分布式分片参数
+    parser.add_argument('--world_size', type=int, default=1, help='分布式训练的rank数，大于1时为每个rank生成分片清单')
+    parser.add_argument('--shard_balance', type=str, default='count', choices=['count', 'bytes'], help='分片按样本数或文件字节数均衡')
+    parser.add_argument('--shard_stratified', action='store_true', help='分片时按标签分层')
+    parser.add_argument('--shard_epochs', type=int, default=0, help='预先生成每个rank洗牌表的epoch数')
+
+    # 宽高比分桶参数
+    parser.add_argument('--bucket_batch_size', type=int, default=0, help='分桶批次大小，大于0时为每个划分生成批次规划')
+    parser.add_argument('--bucket_epochs', type=int, default=1, help='预先生成批次规划的epoch数')
+    parser.add_argument('--num_buckets', type=int, default=8, help='宽高比桶的数量')
+    parser.add_argument('--bucket_label_balanced', action='store_true', help='桶内按标签轮流取样')
     
     # 文件复制参数
     parser.add_argument('--copy_files', action='store_true', help='是否复制文件到划分目录')
+
+    # v1缓存迁移参数
+    parser.add_argument('--v1_cache', type=str, default=None, help='要迁移的v1 JSON缓存路径')
+    parser.add_argument('--v1_root', type=str, default=None, help='v1缓存对应的数据集根目录，默认从缓存路径推断')
+
+    # 监视模式参数
+    parser.add_argument('--debounce', type=float, default=2.0, help='监视模式下事件静默多少秒后更新清单')
+
+    # 清单差异参数
+    parser.add_argument('--diff_base', type=str, default=None, help='基准清单CSV或划分YAML')
+    parser.add_argument('--diff_target', type=str, default=None, help='目标清单CSV或划分YAML')
+
+    # 清单查询参数
+    parser.add_argument('--query_classes', type=str, nargs='+', default=None, help='查询的类别名称')
+    parser.add_argument('--query_prefix', type=str, default=None, help='查询的路径前缀')
+    parser.add_argument('--query_glob', type=str, default=None, help='查询的路径通配符')
+
+    # 数据集统计参数
+    parser.add_argument('--stats_sample', type=int, default=None, help='统计时随机抽取的样本数，默认统计全部')
+    parser.add_argument('--stats_workers', type=int, default=None, help='统计进程数，默认为CPU核数')
+
+    # 图像校验参数
+    parser.add_argument('--verify_workers', type=int, default=None, help='校验进程数，默认为CPU核数')
+
+    # 去重参数
+    parser.add_argument('--dedup_threshold', type=int, default=4, help='近似重复的最大dHash汉明距离，0为只查找哈希相同的图像')
+    parser.add_argument('--dedup_workers', type=int, default=None, help='哈希计算进程数，默认为CPU核数')
+
+    # 页缓存预热参数
+    parser.add_argument('--warm_manifest', type=str, default=None, help='要预热的划分CSV或划分YAML')
+    parser.add_argument('--warm_split', type=str, default='train', help='warm_manifest为划分YAML时预热的划分')
+    parser.add_argument('--warm_plan', type=str, default=None, help='按该.npy中的行号顺序预热（批次规划或分片洗牌表）')
+    parser.add_argument('--warm_budget', type=float, default=4.0, help='预热的内存预算(GB)')
+    parser.add_argument('--warm_workers', type=int, default=16, help='发出预读提示的线程数')
+    parser.add_argument('--warm_order', type=str, default='inode', choices=['inode', 'manifest'],
+                        help='窗口内按inode排序或保持计划顺序')
+
+    # 数据集合并参数
+    parser.add_argument('--merge_manifests', type=str, nargs='+', default=None, help='要合并的完整数据集CSV')
+    parser.add_argument('--merge_aliases', type=str, default=None, help='类别别名YAML，内容为{类别名称: 统一名称}')
+    parser.add_argument('--merge_namespace', action='store_true', help='以"数据集名称/类别名称"区分不同来源的同名类别')
+    parser.add_argument('--merge_name', type=str, default='merged', help='合并数据集的名称（输出文件名前缀）')
+
+    # 批量任务参数
+    parser.add_argument('--batch_file', type=str, default=None, help='批量任务文件(YAML)')
+    parser.add_argument('--batch_workers', type=int, default=None, help='并发任务进程数，默认使用任务文件中的设置')
+    parser.add_argument('--io_per_device', type=int, default=None, help='每个存储设备上同时进行的I/O密集阶段数')
     
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    """主函数，处理命令行参数并执行相应操作"""
+    # 解析命令行参数
+    args = build_parser().parse_args()
+
+    # 这两个命令流式读写磁盘上的CSV，不经过清单存储后端
+    if args.command in ('migrate', 'diff') and args.storage == 'sqlite':
+        raise ValueError(f"{args.command}命令不支持SQLite存储，请先用export导出CSV/YAML")
+
+    if args.command == 'migrate':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        return migrate_v1_cache(args.v1_cache, args.output_dir, args.v1_root)
+
+    if args.command == 'diff':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        return diff_files(args.diff_base, args.diff_target, args.output_dir)
+
+    if args.command == 'batch':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        return run_batch(args.batch_file, build_parser(), MyProcessor, args.batch_workers, args.io_per_device)
+
+    if args.command == 'merge':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        aliases = read_yaml_file(args.merge_aliases) if args.merge_aliases else None
+        return merge_datasets(args.merge_manifests, os.path.join(args.output_dir, args.merge_name),
+                              aliases=aliases, namespace=args.merge_namespace)
 
     p = MyProcessor(args)
+    if args.command == 'query':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.setup_storage()
+        result = query_manifest(p.args.full_data_path + '.csv', p.args.full_data_path + '.yaml',
+                                args.query_classes, args.query_prefix, args.query_glob)
+        write_csv_file(p.args.full_data_path + '_query.csv', result)
+        return result
+
+    if args.command == 'watch':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.setup_storage()
+        return DatasetWatcher(p.args).run()
+
+    if args.command == 'stats':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.setup_storage()
+        return write_dataset_stats(p.args.full_data_path + '.csv', p.args.full_data_path + '.yaml', args.root_dir,
+                                   sample=args.stats_sample, seed=args.seed, num_workers=args.stats_workers)
+
+    if args.command == 'verify':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.setup_storage()
+        verifier = ImageVerifier(args.root_dir, args.output_dir, p.args.dataset_name, num_workers=args.verify_workers)
+        return verifier.verify(read_csv_file(p.args.full_data_path + '.csv'))
+
+    if args.command == 'dedup':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.setup_storage()
+        deduplicator = Deduplicator(args.root_dir, args.output_dir, p.args.dataset_name,
+                                    threshold=args.dedup_threshold, num_workers=args.dedup_workers)
+        return deduplicator.run(read_csv_file(p.args.full_data_path + '.csv'))
+
+    if args.command == 'warm':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.setup_storage()
+        rel_paths, yaml_root = load_warm_order(args.warm_manifest, args.warm_split, args.warm_plan)
+        warmer = PageCacheWarmer(yaml_root or args.root_dir, budget_bytes=int(args.warm_budget * (1 << 30)),
+                                 num_workers=args.warm_workers, order=args.warm_order)
+        return warmer.warm(rel_paths)
+
+    if args.command == 'export':
+        setup_logger(log_level='DEBUG' if args.verbose else 'INFO', log_dir=args.log_file)
+        p.args.storage = 'sqlite'
+        return p.setup_storage().export(args.output_dir)
+
     result = p.do_process()
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+"""
+测试配置 - 把 v2_yaml_csv 加入导入路径，日志写到临时目录
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logger import setup_logger
+
+# 各模块导入时调用 get_logger()，先配置好日志，避免在仓库中生成 logs/ 目录
+setup_logger(log_level='WARNING', log_dir=tempfile.mkdtemp(prefix='v2_yaml_csv_test_logs_'))
@@ -0,0 +1,65 @@
+"""
+归档根目录测试 - 校验、去重和统计对tar/zip归档与目录给出相同结果
+"""
+import os
+import tarfile
+import zipfile
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from core.cache import SampleCache
+from core.dedup import Deduplicator
+from core.stats import compute_stats
+from core.verifier import ImageVerifier
+
+@pytest.fixture
+def roots(tmp_path):
+    """同一批图像分别放在目录、zip和tar中"""
+    rng = np.random.default_rng(0)
+    src = tmp_path / 'src'
+    os.makedirs(src / 'a')
+    items = []
+    for i in range(4):
+        cv.imwrite(str(src / 'a' / f"x{i}.png"), rng.integers(0, 256, size=(12, 20, 3), dtype=np.uint8))
+        items.append((f"a/x{i}.png", 0))
+    (src / 'a' / 'broken.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\0' * 20)
+    items.append(('a/broken.png', 0))
+
+    zip_path, tar_path = str(tmp_path / 'ds.zip'), str(tmp_path / 'ds.tar')
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for rel_path, _ in items:
+            archive.write(src / rel_path, rel_path)
+    with tarfile.open(tar_path, 'w') as archive:
+        for rel_path, _ in items:
+            archive.add(src / rel_path, rel_path)
+    return [str(src), zip_path, tar_path], items
+
+def test_archive_roots_match_directory(tmp_path, roots):
+    root_dirs, items = roots
+    results = []
+    for i, root_dir in enumerate(root_dirs):
+        output_dir = str(tmp_path / f"out{i}")
+        os.makedirs(output_dir)
+        quarantined = ImageVerifier(root_dir, output_dir, 'ds', num_workers=1).verify(items + [('a/none.png', 0)])
+        sha1s, hashes, valid = Deduplicator(root_dir, output_dir, 'ds', num_workers=1).compute_hashes(
+            [rel_path for rel_path, _ in items])
+        stats, _ = compute_stats(items, root_dir, num_workers=1)
+        results.append((sorted(quarantined), sha1s, hashes.tolist(), valid.tolist(),
+                        stats['num_images'], stats['num_failed'], stats['mean'], stats['total_bytes']))
+
+    assert results[0][0] == [('a/broken.png', 0, 'truncated'), ('a/none.png', 0, 'missing')]
+    assert results[0][4:6] == (4, 1)
+    assert results[1] == results[0]
+    assert results[2] == results[0]
+
+def test_sample_cache_reads_archive_members(roots):
+    root_dirs, _ = roots
+    cache = SampleCache(memory_bytes=1 << 20)
+    arrays = [cache.get_or_load(root_dir, 'a/x1.png',
+                                lambda data: cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_COLOR))
+              for root_dir in root_dirs]
+    assert arrays[0].shape == (12, 20, 3)
+    for array in arrays[1:]:
+        np.testing.assert_array_equal(array, arrays[0])
@@ -0,0 +1,105 @@
+"""
+去重测试 - 多索引分桶搜索与暴力两两比较结果一致，重复组在划分后不跨划分
+"""
+import argparse
+
+import numpy as np
+import pytest
+
+from core.dedup import Deduplicator, dup_groups_path, keep_groups_together, popcount64, read_dup_groups
+from core.index import DatasetIndex
+from core.splitter import DatasetSplitter, SplitStrategy
+
+def _hashes_with_neighbours(seed, n=400, threshold=4):
+    """随机哈希，再为其中一部分生成汉明距离不超过threshold+1的邻居，保证阈值附近有足够的样本对"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 2 ** 63, size=n, dtype=np.uint64) * np.uint64(2) + rng.integers(0, 2, size=n, dtype=np.uint64)
+    neighbours = []
+    for h in base[:n // 2]:
+        bits = rng.choice(64, size=int(rng.integers(1, threshold + 2)), replace=False)
+        flip = np.uint64(0)
+        for bit in bits:
+            flip |= np.uint64(1) << np.uint64(bit)
+        neighbours.append(h ^ flip)
+    return np.unique(np.concatenate([base, np.asarray(neighbours, dtype=np.uint64)]))
+
+def _brute_force_pairs(hashes, threshold):
+    distance = popcount64((hashes[:, None] ^ hashes[None, :]).ravel()).reshape(len(hashes), len(hashes))
+    a, b = np.nonzero(np.triu(distance <= threshold, k=1))
+    return set(zip(a.tolist(), b.tolist()))
+
+@pytest.mark.parametrize('threshold', [1, 3, 4, 8])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_near_pairs_matches_brute_force(tmp_path, threshold, seed):
+    hashes = _hashes_with_neighbours(seed, threshold=threshold)
+    deduplicator = Deduplicator(str(tmp_path), str(tmp_path), 'ds', threshold=threshold)
+    a, b = deduplicator.near_pairs(hashes)
+    found = {(min(i, j), max(i, j)) for i, j in zip(a.tolist(), b.tolist())}
+    expected = _brute_force_pairs(hashes, threshold)
+    assert expected
+    assert found == expected
+
+def test_popcount64():
+    values = np.random.default_rng(0).integers(0, 2 ** 63, size=1000, dtype=np.uint64) * np.uint64(2)
+    assert popcount64(values).tolist() == [bin(int(v)).count('1') for v in values]
+
+def test_keep_groups_together_prefers_earlier_split():
+    splits = {'train': ['a', 'b'], 'val': ['c', 'd'], 'test': ['e']}
+    groups = {'b': 0, 'c': 0, 'e': 1, 'd': 1}
+    result, moved = keep_groups_together(splits, lambda items: [groups.get(item, -1) for item in items])
+    assert moved == 2
+    assert sorted(result['train']) == ['a', 'b', 'c']
+    assert sorted(result['val']) == ['d', 'e']
+    assert result['test'] == []
+
+def _write_dup_groups(output_dir, groups):
+    with open(dup_groups_path(output_dir, 'ds'), 'w', encoding='utf-8') as f:
+        f.write("rel_path,label,group,exact\n")
+        for rel_path, group in groups.items():
+            f.write(f"{rel_path},0,{group},1\n")
+
+@pytest.mark.parametrize('as_index', [False, True])
+@pytest.mark.parametrize('strategy', [SplitStrategy.RANDOM, SplitStrategy.STRATIFIED])
+def test_duplicate_groups_stay_in_one_split(tmp_path, as_index, strategy):
+    rng = np.random.default_rng(5)
+    class_to_images = {f"c{c}": [f"c{c}/img{i}.jpg" for i in range(40)] for c in range(5)}
+    class_to_idx = {name: label for label, name in enumerate(sorted(class_to_images))}
+    index = DatasetIndex.from_class_to_images(class_to_images, class_to_idx)
+
+    # 随机组成重复组，包括跨类别的组
+    paths = list(index.paths())
+    members = rng.permutation(len(paths))[:120]
+    groups = {paths[row]: int(i % 30) for i, row in enumerate(members)}
+    _write_dup_groups(str(tmp_path), groups)
+    assert read_dup_groups(str(tmp_path), 'ds') == groups
+
+    args = argparse.Namespace(root_dir='/data', output_dir=str(tmp_path), dataset_name='ds',
+                              split_base_path=str(tmp_path / 'ds_split'))
+    data = index if as_index else list(index)
+    splits, _ = DatasetSplitter(args).split_dataset(data, class_to_idx, strategy, 0.6, 0.2, 0.2, seed=3)
+
+    split_of = {}
+    for split_name, items in splits.items():
+        for rel_path, _ in items:
+            split_of[rel_path] = split_name
+    assert sorted(split_of) == sorted(paths)
+    for group in set(groups.values()):
+        assert len({split_of[rel_path] for rel_path, g in groups.items() if g == group}) == 1
+
+def test_near_pairs_in_large_buckets(tmp_path):
+    """大量哈希落在同一桶时（如纯色图），桶内仍两两比较，不漏掉任何一对"""
+    rng = np.random.default_rng(3)
+    low = rng.integers(0, 1 << 12, size=300, dtype=np.uint64)
+    hashes = np.unique(np.concatenate([low, _hashes_with_neighbours(4, n=200)]))
+    deduplicator = Deduplicator(str(tmp_path), str(tmp_path), 'ds', threshold=4)
+    a, b = deduplicator.near_pairs(hashes)
+    assert np.all(a < b)
+    assert set(zip(a.tolist(), b.tolist())) == _brute_force_pairs(hashes, 4)
+    assert deduplicator.skipped_pairs == 0
+
+def test_max_bucket_reports_skipped_pairs(tmp_path):
+    hashes = np.arange(1, 101, dtype=np.uint64)
+    deduplicator = Deduplicator(str(tmp_path), str(tmp_path), 'ds', threshold=4, max_bucket=50)
+    deduplicator.near_pairs(hashes)
+    # 高位的4段全为0，每段都是一个100个元素的桶
+    assert deduplicator.skipped_pairs == 4 * 100 * 99 // 2
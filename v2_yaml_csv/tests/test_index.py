@@ -0,0 +1,63 @@
+"""
+DatasetIndex 测试 - 索引与元组列表走相同流程时，写出的划分清单逐字节一致
+"""
+import argparse
+
+import numpy as np
+import pytest
+
+from core.index import DatasetIndex
+from core.splitter import DatasetSplitter, SplitStrategy
+from utils.file_utils import read_csv_file, write_csv_file
+
+def _random_index(seed, num_classes=12):
+    rng = np.random.default_rng(seed)
+    class_to_images = {
+        f"class{c:02d}": [f"class{c:02d}/img{i},{c}.jpg" if i % 5 == 0 else f"class{c:02d}/img{i}.jpg"
+                          for i in range(int(rng.integers(0, 30)))]
+        for c in range(num_classes)
+    }
+    class_to_idx = {name: label for label, name in enumerate(sorted(class_to_images))}
+    return DatasetIndex.from_class_to_images(class_to_images, class_to_idx), class_to_idx
+
+def _write_splits(tmp_path, name, data, class_to_idx, strategy):
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    args = argparse.Namespace(root_dir='/data', output_dir=str(output_dir), dataset_name='ds',
+                              split_base_path=str(output_dir / 'ds_split'))
+    splitter = DatasetSplitter(args)
+    splits, split_ratio = splitter.split_dataset(data, class_to_idx, strategy, 0.6, 0.25, 0.15, seed=7)
+    splitter.write_split_files(splits, split_ratio, class_to_idx)
+    return {split_name: (output_dir / f"ds_split_{split_name}_{''.join(str(split_ratio[split_name]).split('.'))}.csv")
+            for split_name in ('train', 'val', 'test')}
+
+@pytest.mark.parametrize('strategy', [SplitStrategy.RANDOM, SplitStrategy.STRATIFIED])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_index_splits_are_byte_identical_to_list_splits(tmp_path, strategy, seed):
+    index, class_to_idx = _random_index(seed)
+    from_index = _write_splits(tmp_path, 'index', index, class_to_idx, strategy)
+    from_list = _write_splits(tmp_path, 'list', list(index), class_to_idx, strategy)
+    for split_name in from_index:
+        assert from_index[split_name].read_bytes() == from_list[split_name].read_bytes()
+
+def test_csv_round_trip(tmp_path):
+    index, _ = _random_index(3)
+    index.columns['width'] = np.arange(len(index), dtype=np.int32)
+    csv_path = str(tmp_path / 'full.csv')
+    write_csv_file(csv_path, index)
+
+    loaded = DatasetIndex.from_csv(csv_path, index.class_names)
+    assert loaded.path_blob == index.path_blob
+    assert np.array_equal(loaded.offsets, index.offsets)
+    assert np.array_equal(loaded.labels, index.labels)
+    assert read_csv_file(csv_path) == list(index)
+
+def test_take_keeps_label_order_and_columns():
+    index, _ = _random_index(4)
+    index.columns['width'] = np.arange(len(index), dtype=np.int32)
+    rows = np.random.default_rng(0).permutation(len(index))[:len(index) // 2]
+    subset = index.take(rows)
+    assert np.all(np.diff(subset.labels) >= 0)
+    paths = list(index.paths())
+    assert sorted(subset.paths()) == sorted(paths[row] for row in rows)
+    assert [int(w) for w in subset.columns['width']] == [paths.index(path) for path in subset.paths()]
@@ -0,0 +1,100 @@
+"""
+清单差异测试 - 基准清单叠加增量后与目标清单一致
+"""
+import os
+import shutil
+
+import numpy as np
+
+from core.manifest_diff import diff_manifests
+from utils.file_utils import read_csv_file, read_csv_with_delta
+
+def _write_manifest(csv_path, rows, header="rel_path,label"):
+    """按标签稳定排序后写出清单，与扫描生成的清单一样按标签排序"""
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write(header + "\n")
+        for row in sorted(rows, key=lambda row: row[1]):
+            f.write(",".join(str(value) for value in row) + "\n")
+
+def _random_manifest(rng, n=300, num_classes=6):
+    rows = [(f"c{label}/img{i}.jpg", int(label)) for i, label in enumerate(rng.integers(0, num_classes, size=n))]
+    # 重复的行和路径中含逗号的行
+    rows += rows[:10]
+    rows += [(f"c{label}/a,b{i}.jpg", int(label)) for i, label in enumerate(rng.integers(0, num_classes, size=5))]
+    return rows
+
+def _mutate(rng, rows, num_classes=6):
+    """删除一部分行、修改一部分标签、新增一部分行"""
+    keep = rng.random(len(rows)) > 0.2
+    target = []
+    for row, kept in zip(rows, keep):
+        if not kept:
+            continue
+        if rng.random() < 0.1:
+            row = (row[0], int((row[1] + 1) % num_classes))
+        target.append(row)
+    target += [(f"new/img{i}_{rng.integers(1 << 30)}.jpg", int(rng.integers(0, num_classes + 1))) for i in range(40)]
+    target += target[:3]
+    return target
+
+def _assert_applied(result, target_csv):
+    expected = read_csv_file(target_csv)
+    assert sorted(result) == sorted(expected)
+    labels = [label for _, label in result]
+    assert labels == sorted(labels)
+
+def test_delta_applied_to_base_equals_target(tmp_path):
+    rng = np.random.default_rng(0)
+    base = _random_manifest(rng)
+    target = _mutate(rng, base)
+    base_csv, target_csv = str(tmp_path / 'base.csv'), str(tmp_path / 'target.csv')
+    _write_manifest(base_csv, base)
+    _write_manifest(target_csv, target)
+
+    info = diff_manifests(base_csv, target_csv, str(tmp_path / 'v1'))
+    assert info['base_rows'] == len(base)
+    assert info['target_rows'] == len(target)
+    assert info['base_rows'] - info['num_removed'] + info['num_added'] == info['target_rows']
+    _assert_applied(read_csv_with_delta(base_csv, [str(tmp_path / 'v1_delta.yaml')]), target_csv)
+
+def test_chained_deltas(tmp_path):
+    rng = np.random.default_rng(1)
+    versions = [_random_manifest(rng)]
+    for _ in range(3):
+        versions.append(_mutate(rng, versions[-1]))
+    csv_paths = []
+    for i, rows in enumerate(versions):
+        csv_paths.append(str(tmp_path / f"v{i}.csv"))
+        _write_manifest(csv_paths[-1], rows)
+
+    delta_paths = []
+    for i in range(1, len(versions)):
+        diff_manifests(csv_paths[i - 1], csv_paths[i], str(tmp_path / f"d{i}"))
+        delta_paths.append(str(tmp_path / f"d{i}_delta.yaml"))
+    _assert_applied(read_csv_with_delta(csv_paths[0], delta_paths), csv_paths[-1])
+
+def test_delta_survives_move(tmp_path):
+    rng = np.random.default_rng(2)
+    base = _random_manifest(rng)
+    target = _mutate(rng, base)
+    base_csv, target_csv = str(tmp_path / 'base.csv'), str(tmp_path / 'target.csv')
+    _write_manifest(base_csv, base)
+    _write_manifest(target_csv, target)
+    os.makedirs(tmp_path / 'deltas')
+    diff_manifests(base_csv, target_csv, str(tmp_path / 'deltas' / 'v1'))
+
+    shutil.move(str(tmp_path / 'deltas'), str(tmp_path / 'moved'))
+    _assert_applied(read_csv_with_delta(base_csv, [str(tmp_path / 'moved' / 'v1_delta.yaml')]), target_csv)
+
+def test_delta_with_extra_columns(tmp_path):
+    rng = np.random.default_rng(3)
+    base = [(rel_path, label, int(rng.integers(1, 500)), int(rng.integers(1, 500)))
+            for rel_path, label in _random_manifest(rng)]
+    target = [row for row in base if rng.random() > 0.3]
+    target += [(f"x,y/img{i}.jpg", int(rng.integers(0, 6)), 64, 48) for i in range(20)]
+    base_csv, target_csv = str(tmp_path / 'base.csv'), str(tmp_path / 'target.csv')
+    _write_manifest(base_csv, base, header="rel_path,label,width,height")
+    _write_manifest(target_csv, target, header="rel_path,label,width,height")
+
+    diff_manifests(base_csv, target_csv, str(tmp_path / 'v1'))
+    _assert_applied(read_csv_with_delta(base_csv, [str(tmp_path / 'v1_delta.yaml')]), target_csv)
@@ -0,0 +1,111 @@
+"""
+数据集合并测试 - k路归并后的清单按新标签排序，每行的类别与来源清单一致
+"""
+import numpy as np
+import pytest
+
+from core.merger import merge_datasets
+from utils.file_utils import configure_storage, write_yaml_file
+
+def _write_source(tmp_path, name, class_names, rng, header="rel_path,label", extra=0):
+    """生成一个按标签排序的完整数据集清单和对应的YAML"""
+    rows = []
+    for label in range(len(class_names)):
+        for i in range(int(rng.integers(1, 30))):
+            values = [int(v) for v in rng.integers(1, 500, size=extra)]
+            rows.append([f"{class_names[label]}/{name}_{i}.jpg", label, *values])
+    csv_path = str(tmp_path / f"{name}.csv")
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write(header + "\n")
+        for row in rows:
+            f.write(",".join(str(value) for value in row) + "\n")
+    write_yaml_file(str(tmp_path / f"{name}.yaml"), {
+        'data': name,
+        'path': str(tmp_path / 'roots' / name),
+        'names': dict(enumerate(class_names)),
+    })
+    return csv_path, rows
+
+def _read_merged(csv_path):
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        header = f.readline().rstrip('\n').split(',')
+        return header, [line.rstrip('\n').rsplit(',', len(header) - 1) for line in f if line.strip()]
+
+@pytest.mark.parametrize('namespace', [False, True])
+def test_merge_keeps_label_order_and_classes(tmp_path, namespace):
+    rng = np.random.default_rng(0)
+    sources = [
+        _write_source(tmp_path, 'a', ['cat', 'dog', 'zebra'], rng),
+        _write_source(tmp_path, 'b', ['ant', 'dog', 'kitten', 'yak'], rng),
+        _write_source(tmp_path, 'c', ['bee', 'cow,ox'], rng),
+    ]
+    aliases = {'kitten': 'cat', 'b/kitten': 'a/cat'}
+    info = merge_datasets([csv_path for csv_path, _ in sources], str(tmp_path / 'merged'),
+                          aliases=aliases, namespace=namespace)
+
+    header, rows = _read_merged(str(tmp_path / 'merged.csv'))
+    assert header == ['rel_path', 'label', 'source', 'source_label']
+    labels = [int(row[1]) for row in rows]
+    assert labels == sorted(labels)
+    assert len(rows) == sum(len(source_rows) for _, source_rows in sources) == info['total_images']
+
+    source_names = [['cat', 'dog', 'zebra'], ['ant', 'dog', 'kitten', 'yak'], ['bee', 'cow,ox']]
+    for rel_path, label, source, source_label in rows:
+        source, source_label = int(source), int(source_label)
+        name = source_names[source][source_label]
+        if namespace:
+            name = f"{'abc'[source]}/{name}"
+        assert info['names'][int(label)] == aliases.get(name, name)
+        assert rel_path.startswith(f"{'abc'[source]}/{source_names[source][source_label]}/")
+
+    # 每个来源标签内的行在归并后保持原来的相对顺序
+    for source, (_, source_rows) in enumerate(sources):
+        for source_label in range(len(source_names[source])):
+            merged_paths = [row[0] for row in rows if int(row[2]) == source and int(row[3]) == source_label]
+            assert merged_paths == [f"{'abc'[source]}/{row[0]}" for row in source_rows if row[1] == source_label]
+
+def test_merge_keeps_shared_extra_columns(tmp_path):
+    rng = np.random.default_rng(1)
+    sources = [
+        _write_source(tmp_path, 'a', ['cat', 'dog'], rng, header="rel_path,label,width,height", extra=2),
+        _write_source(tmp_path, 'b', ['bird', 'cat'], rng, header="rel_path,label,width,height", extra=2),
+    ]
+    info = merge_datasets([csv_path for csv_path, _ in sources], str(tmp_path / 'merged'))
+    assert info['columns'] == ['width', 'height']
+
+    header, rows = _read_merged(str(tmp_path / 'merged.csv'))
+    assert header == ['rel_path', 'label', 'width', 'height', 'source', 'source_label']
+    labels = [int(row[1]) for row in rows]
+    assert labels == sorted(labels)
+    expected = {f"{'ab'[source]}/{row[0]}": [str(value) for value in row[2:]]
+                for source, (_, source_rows) in enumerate(sources) for row in source_rows}
+    assert {row[0]: row[2:4] for row in rows} == expected
+
+def test_merge_into_sqlite_store_keeps_provenance(tmp_path):
+    rng = np.random.default_rng(2)
+    store = configure_storage('sqlite', str(tmp_path / 'merge.sqlite'))
+    try:
+        sources = []
+        for name, class_names in (('a', ['cat', 'dog']), ('b', ['bird', 'cat'])):
+            rows = [(f"{class_names[label]}/{name}_{i}.jpg", label, *(int(v) for v in rng.integers(1, 500, size=2)))
+                    for label in range(len(class_names)) for i in range(int(rng.integers(1, 20)))]
+            csv_path = str(tmp_path / f"{name}.csv")
+            store.write_sorted_rows(csv_path, rows, ['width', 'height'])
+            write_yaml_file(str(tmp_path / f"{name}.yaml"), {
+                'data': name, 'path': str(tmp_path / 'roots' / name), 'names': dict(enumerate(class_names))})
+            sources.append((csv_path, rows, class_names))
+
+        info = merge_datasets([csv_path for csv_path, _, _ in sources], str(tmp_path / 'merged'))
+        columns = ['width', 'height', 'source', 'source_label']
+        assert store.manifest_columns(str(tmp_path / 'merged.csv')) == columns
+        merged = store.read_manifest(str(tmp_path / 'merged.csv'), columns=columns)
+        assert len(merged) == info['total_images'] == sum(len(rows) for _, rows, _ in sources)
+        labels = [row[1] for row in merged]
+        assert labels == sorted(labels)
+        expected = {f"{'ab'[source]}/{rel_path}": (width, height, source, label)
+                    for source, (_, rows, _) in enumerate(sources) for rel_path, label, width, height in rows}
+        assert {row[0]: tuple(row[2:]) for row in merged} == expected
+        for rel_path, label, _, _, source, source_label in merged:
+            assert info['names'][label] == sources[source][2][source_label]
+    finally:
+        configure_storage('files')
@@ -0,0 +1,46 @@
+"""
+共享内存缓存测试 - 最后一个进程分离后删除共享段，锁文件保留
+"""
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from core.shm_cache import SharedImageCache
+
+@pytest.fixture
+def cache_name():
+    name = f"test_shm_cache_{os.getpid()}"
+    yield name
+    SharedImageCache.destroy(name)
+    # 测试结束后没有其他进程使用该缓存，可以删除锁文件
+    if os.path.exists(_lock_path(name)):
+        os.remove(_lock_path(name))
+
+def _lock_path(name):
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(shm_dir, f"{name}.lock")
+
+def test_close_keeps_lock_file(cache_name):
+    image = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+    with SharedImageCache(cache_name, num_rows=4, budget_bytes=1 << 20) as cache:
+        assert cache.put(1, image)
+        lock_inode = os.stat(_lock_path(cache_name)).st_ino
+    assert os.stat(_lock_path(cache_name)).st_ino == lock_inode
+
+    # 重新创建时使用同一个锁文件，之前的数据已随共享段删除
+    with SharedImageCache(cache_name, num_rows=4, budget_bytes=1 << 20) as cache:
+        assert cache.get(1) is None
+        assert cache.put(1, image)
+        np.testing.assert_array_equal(cache.get(1), image)
+    assert os.stat(_lock_path(cache_name)).st_ino == lock_inode
+
+def test_destroy_keeps_lock_file(cache_name):
+    cache = SharedImageCache(cache_name, num_rows=2, budget_bytes=1 << 20, persist=True)
+    cache.put(0, np.zeros((2, 2), dtype=np.uint8))
+    cache.close()
+    SharedImageCache.destroy(cache_name)
+    assert os.path.exists(_lock_path(cache_name))
+    with SharedImageCache(cache_name, num_rows=2, budget_bytes=1 << 20) as cache:
+        assert cache.get(0) is None
@@ -0,0 +1,72 @@
+"""
+SQLite清单存储测试 - 与CSV文件后端一致，重复路径各占一行，导出的CSV与文件后端相同
+"""
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from utils.file_utils import configure_storage, read_csv_file, write_csv_file
+from utils.sqlite_store import ManifestStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = ManifestStore(str(tmp_path / 'db' / 'ds.sqlite'))
+    yield store
+    store.close()
+
+def _rows(rng, n=200, num_classes=5):
+    rows = [(f"c{label}/img{i}.jpg", int(label)) for i, label in enumerate(rng.integers(0, num_classes, size=n))]
+    return rows + rows[:7] + [(rows[0][0], (rows[0][1] + 1) % num_classes)]
+
+def test_duplicate_rows_match_files_backend(tmp_path, store):
+    rows = _rows(np.random.default_rng(0))
+    csv_path = str(tmp_path / 'db' / 'ds.csv')
+    store.write_manifest(csv_path, rows)
+    assert store.read_manifest(csv_path) == sorted(rows, key=lambda row: row[1])
+
+    files_csv = str(tmp_path / 'files' / 'ds.csv')
+    os.makedirs(os.path.dirname(files_csv))
+    write_csv_file(files_csv, rows)
+    exported = store.export(str(tmp_path / 'export'))
+    with open(files_csv, 'rb') as expected, open(str(tmp_path / 'export' / 'ds.csv'), 'rb') as actual:
+        assert actual.read() == expected.read()
+    assert str(tmp_path / 'export' / 'ds.csv') in exported
+
+def test_update_manifest_counts_and_order(tmp_path, store):
+    csv_path = str(tmp_path / 'db' / 'ds_select_10.csv')
+    store.write_manifest(csv_path, [('a.jpg', 0), ('a.jpg', 0), ('b.jpg', 1), ('c.jpg', 0)])
+    added, removed = store.update_manifest(csv_path, added=[('d.jpg', 0), ('a.jpg', 1)],
+                                           removed=['a.jpg', 'missing.jpg'])
+    assert (added, removed) == (2, 1)
+    assert store.read_manifest(csv_path) == [('a.jpg', 0), ('c.jpg', 0), ('d.jpg', 0), ('b.jpg', 1), ('a.jpg', 1)]
+
+def test_manifest_kinds_use_their_tables(tmp_path, store):
+    base = str(tmp_path / 'db')
+    store.write_manifest(os.path.join(base, 'ds.csv'), [('a.jpg', 0)])
+    store.write_manifest(os.path.join(base, 'ds_select_2.csv'), [('a.jpg', 0), ('b.jpg', 1)])
+    store.write_manifest(os.path.join(base, 'ds_split_train_08.csv'), [('a.jpg', 0), ('b.jpg', 1), ('c.jpg', 1)])
+    counts = {table: store.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('entries', 'subsets', 'split_assignments')}
+    assert counts == {'entries': 1, 'subsets': 2, 'split_assignments': 3}
+    kinds = dict(store.conn.execute("SELECT type, name FROM sqlite_master WHERE name = 'subsets'").fetchall())
+    assert 'table' in kinds
+
+def test_rejects_old_schema(tmp_path):
+    db_path = str(tmp_path / 'old.sqlite')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE manifests (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    with pytest.raises(ValueError):
+        ManifestStore(db_path)
+
+def test_read_csv_file_through_store(tmp_path):
+    rows = _rows(np.random.default_rng(1))
+    configure_storage('sqlite', str(tmp_path / 'ds.sqlite'))
+    try:
+        write_csv_file(str(tmp_path / 'ds.csv'), rows)
+        assert read_csv_file(str(tmp_path / 'ds.csv')) == sorted(rows, key=lambda row: row[1])
+    finally:
+        configure_storage('files')
@@ -0,0 +1,68 @@
+"""
+统计测试 - Chan合并任意分块、任意顺序的结果与一次性计算一致
+"""
+import os
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from core.stats import compute_stats, merge_moments
+
+def _moments(values):
+    return len(values), values.mean(axis=0), ((values - values.mean(axis=0)) ** 2).sum(axis=0)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_merge_moments_matches_single_pass(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(100, 30, size=(5000, 3))
+    bounds = np.sort(rng.choice(np.arange(1, len(values)), size=20, replace=False))
+    chunks = np.split(values, bounds)
+    chunks.append(values[:0])
+
+    n, mean, M2 = 0, np.zeros(3), np.zeros(3)
+    for i in rng.permutation(len(chunks)):
+        chunk = chunks[i]
+        n_b, mean_b, M2_b = _moments(chunk) if len(chunk) else (0, np.zeros(3), np.zeros(3))
+        n, mean, M2 = merge_moments(n, mean, M2, n_b, mean_b, M2_b)
+
+    assert n == len(values)
+    np.testing.assert_allclose(mean, values.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(M2 / n, values.var(axis=0), rtol=1e-9)
+
+@pytest.fixture
+def image_dataset(tmp_path):
+    """生成尺寸不同的小PNG图像，另有一个无法解码的文件"""
+    rng = np.random.default_rng(0)
+    data_list, images = [], []
+    for i in range(30):
+        label = i % 3
+        height, width = int(rng.integers(8, 40)), int(rng.integers(8, 40))
+        img = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        rel_path = os.path.join(f"c{label}", f"img{i}.png")
+        os.makedirs(tmp_path / f"c{label}", exist_ok=True)
+        cv.imwrite(str(tmp_path / rel_path), img)
+        data_list.append((rel_path, label))
+        images.append(img)
+    (tmp_path / 'c0' / 'broken.png').write_bytes(b'not an image')
+    data_list.append((os.path.join('c0', 'broken.png'), 0))
+    return str(tmp_path), data_list, images
+
+def test_compute_stats_chunked_matches_single_chunk(image_dataset):
+    root_dir, data_list, images = image_dataset
+    single, single_classes = compute_stats(data_list, root_dir, num_workers=1, chunk_size=len(data_list))
+    chunked, chunked_classes = compute_stats(data_list, root_dir, num_workers=2, chunk_size=4)
+
+    for key in ('num_images', 'num_failed', 'pixels', 'total_bytes'):
+        assert chunked[key] == single[key]
+    # 合并顺序取决于任务完成顺序，只允许舍入误差
+    np.testing.assert_allclose(chunked['mean'], single['mean'], atol=2e-6)
+    np.testing.assert_allclose(chunked['std'], single['std'], atol=2e-6)
+    assert chunked_classes == single_classes
+    assert single['num_images'] == len(images)
+    assert single['num_failed'] == 1
+
+    # 与直接把全部像素拼在一起计算的结果一致（OpenCV为BGR，结果翻转为RGB）
+    pixels = np.concatenate([img.reshape(-1, 3) for img in images]).astype(np.float64)
+    np.testing.assert_allclose(single['mean'], (pixels.mean(axis=0) / 255.0)[::-1], atol=1e-6)
+    np.testing.assert_allclose(single['std'], (pixels.std(axis=0) / 255.0)[::-1], atol=1e-6)
@@ -0,0 +1,84 @@
+"""
+监视模式测试 - 增量写盘后清单按标签排序，CSV只重写有变化的划分
+"""
+import argparse
+import os
+
+import pytest
+
+from core.index import DatasetIndex
+from core.splitter import DatasetSplitter, SplitStrategy
+from core.watcher import DatasetWatcher, Inotify
+from utils.file_utils import configure_storage, read_csv_file, read_yaml_file
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+
+@pytest.fixture(params=['files', 'sqlite'])
+def watcher(request, tmp_path):
+    """三个类别的数据集，已生成完整数据集清单和 train/val 划分"""
+    root_dir, output_dir = tmp_path / 'ds', tmp_path / 'out'
+    for class_name in ('a', 'b', 'c'):
+        for i in range(6):
+            _touch(str(root_dir / class_name / f"{i}.jpg"))
+    args = argparse.Namespace(root_dir=str(root_dir), output_dir=str(output_dir), dataset_name='ds',
+                              full_data_path=str(output_dir / 'ds'), split_base_path=str(output_dir / 'ds_split'),
+                              class_depth=0, class_pattern=None, seed=0, debounce=0.1)
+    configure_storage(request.param, str(output_dir / 'ds.sqlite'))
+    w = DatasetWatcher(args)
+    w.inotify = Inotify()
+    try:
+        w.load_state()
+        splitter = DatasetSplitter(args)
+        splits, split_ratio = splitter.split_dataset(list(w.labels.items()), w.class_to_idx, SplitStrategy.RANDOM,
+                                                     0.5, 0.5, 0, seed=0)
+        splitter.write_split_files(splits, split_ratio, w.class_to_idx)
+        w.load_state()
+        yield request.param, w
+    finally:
+        w.inotify.close()
+        configure_storage('files')
+
+def _assert_manifest(csv_path, expected):
+    rows = read_csv_file(csv_path)
+    labels = [label for _, label in rows]
+    assert labels == sorted(labels)
+    assert sorted(rows) == sorted(expected)
+
+def test_flush_keeps_manifests_sorted(watcher):
+    backend, w = watcher
+    for rel_path in (os.path.join('a', 'new.jpg'), os.path.join('d', 'new.jpg')):
+        _touch(os.path.join(w.root_dir, rel_path))
+        w._add(rel_path)
+    # 重命名保留原划分
+    split_name = w._remove(os.path.join('b', '0.jpg'))
+    w._add(os.path.join('b', 'renamed.jpg'), split_name)
+    w._remove(os.path.join('c', '1.jpg'))
+    w.flush()
+
+    _assert_manifest(w.full_data_csv, w.labels.items())
+    if backend == 'files':
+        class_names = read_yaml_file(w.full_data_yaml, lazy=False)['names']
+        assert len(DatasetIndex.from_csv(w.full_data_csv, class_names)) == len(w.labels)
+
+    split_info = read_yaml_file(w.split_yaml, lazy=False)
+    assert split_info['nc'] == 4 and split_info['name'][3] == 'd'
+    assert w.split_of[os.path.join('b', 'renamed.jpg')] == split_name
+    for split_name in ('train', 'val'):
+        _assert_manifest(split_info[split_name], [(rel_path, w.labels[rel_path])
+                                                  for rel_path, name in w.split_of.items() if name == split_name])
+
+def test_flush_rewrites_only_changed_splits(watcher):
+    backend, w = watcher
+    if backend != 'files':
+        pytest.skip("只检查CSV文件的修改时间")
+    rel_path = next(rel_path for rel_path, name in w.split_of.items() if name == 'train')
+    untouched = w.split_csv['val']
+    mtime_ns = os.stat(untouched).st_mtime_ns - 10 ** 9
+    os.utime(untouched, ns=(mtime_ns, mtime_ns))
+    w._remove(rel_path)
+    w.flush()
+    assert os.stat(untouched).st_mtime_ns == mtime_ns
+    assert rel_path not in dict(read_csv_file(w.split_csv['train']))
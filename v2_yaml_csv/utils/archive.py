@@ -0,0 +1,241 @@
+"""
+归档读取模块 - 为tar/zip包建立成员索引（名称、偏移、大小），按偏移直接读取成员，无需解压
+"""
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# 支持的归档扩展名，压缩的tar包无法按偏移读取成员，不在此列
+ARCHIVE_EXTENSIONS = ('.tar', '.zip')
+
+# 成员的存储方式
+STORED, DEFLATED = 0, 1
+
+# 索引文件格式版本，格式变化时旧索引自动重建
+_INDEX_VERSION = 1
+
+def is_archive(path):
+    """路径是否为支持的归档文件"""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+def archive_stem(path):
+    """归档文件名去掉扩展名，作为数据集名称"""
+    name = os.path.basename(path)
+    for ext in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+def _scan_tar(path):
+    """顺序读取tar头，产出(名称, 数据偏移, 大小, 压缩大小, 存储方式)"""
+    try:
+        tar = tarfile.open(path, mode='r:')
+    except tarfile.ReadError as e:
+        raise ValueError(f"无法按偏移读取 {path}，压缩的tar包需要先解压为未压缩的.tar: {e}") from e
+    with tar:
+        for member in tar:
+            if member.isfile() and not member.issparse():
+                yield member.name, member.offset_data, member.size, member.size, STORED
+            # 不保留已读取的成员，百万级成员时内存保持不变
+            tar.members = []
+
+def _scan_zip(path):
+    """读取zip中央目录，并按偏移顺序读取本地文件头得到数据偏移"""
+    with zipfile.ZipFile(path) as archive:
+        infos = sorted((info for info in archive.infolist() if not info.is_dir()), key=lambda info: info.header_offset)
+    with open(path, 'rb') as f:
+        for info in infos:
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                logger.warning(f"跳过不支持的压缩方式 {info.compress_type}: {info.filename}")
+                continue
+            if info.flag_bits & 0x1:
+                logger.warning(f"跳过加密成员: {info.filename}")
+                continue
+            f.seek(info.header_offset)
+            header = f.read(30)
+            if header[:4] != b'PK\x03\x04':
+                raise ValueError(f"zip本地文件头损坏: {info.filename}")
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            method = STORED if info.compress_type == zipfile.ZIP_STORED else DEFLATED
+            yield (info.filename, info.header_offset + 30 + name_len + extra_len,
+                   info.file_size, info.compress_size, method)
+
+class ArchiveIndex:
+    """
+    归档成员索引
+
+    名称按DatasetIndex相同的方式保存为UTF-8字节串加偏移数组，其余字段为定长数组。
+    索引保存在归档旁的 {archive}.members.npz，按归档大小和修改时间校验，归档不变时不再重新扫描。
+    读取使用os.pread，多个线程可以共享同一个文件描述符。
+    """
+
+    def __init__(self, path, names_blob, name_offsets, data_offsets, sizes, csizes, methods):
+        self.path = path
+        self.names_blob = names_blob
+        self.name_offsets = name_offsets
+        self.data_offsets = data_offsets
+        self.sizes = sizes
+        self.csizes = csizes
+        self.methods = methods
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self._lookup = None
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDONLY)
+
+    @classmethod
+    def build(cls, path):
+        """顺序扫描一遍归档，建立成员索引"""
+        scan = _scan_zip if path.lower().endswith('.zip') else _scan_tar
+        names, data_offsets, sizes, csizes, methods = [], [], [], [], []
+        for name, offset, size, csize, method in scan(path):
+            # 统一为不带前导'./'的相对路径
+            while name.startswith('./'):
+                name = name[2:]
+            names.append(name.encode('utf-8'))
+            data_offsets.append(offset)
+            sizes.append(size)
+            csizes.append(csize)
+            methods.append(method)
+
+        name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in names], out=name_offsets[1:])
+        return cls(path, b''.join(names), name_offsets,
+                   np.asarray(data_offsets, dtype=np.int64), np.asarray(sizes, dtype=np.int64),
+                   np.asarray(csizes, dtype=np.int64), np.asarray(methods, dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path, rebuild=False):
+        """
+        读取成员索引，索引不存在或已过期时重新扫描并保存
+
+        参数:
+        - path: 归档路径
+        - rebuild: 是否强制重建
+        """
+        index_path = path + '.members.npz'
+        stat = os.stat(path)
+        if not rebuild and os.path.exists(index_path):
+            with np.load(index_path) as data:
+                meta = data['meta']
+                if meta.tolist() == [_INDEX_VERSION, stat.st_size, stat.st_mtime_ns]:
+                    return cls(path, data['names'].tobytes(), data['name_offsets'], data['data_offsets'],
+                               data['sizes'], data['csizes'], data['methods'])
+            logger.info(f"归档已变化，重建成员索引: {path}")
+
+        logger.info(f"开始扫描归档: {path}")
+        index = cls.build(path)
+        try:
+            tmp_path = index_path + '.tmp.npz'
+            np.savez(tmp_path, names=np.frombuffer(index.names_blob, dtype=np.uint8),
+                     name_offsets=index.name_offsets, data_offsets=index.data_offsets, sizes=index.sizes,
+                     csizes=index.csizes, methods=index.methods,
+                     meta=np.array([_INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64))
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.warning(f"无法保存成员索引 {index_path}: {e}")
+        logger.info(f"归档扫描完成: {len(index)} 个成员")
+        return index
+
+    def __len__(self):
+        return len(self.data_offsets)
+
+    def close(self):
+        os.close(self._fd)
+
+    def name(self, i):
+        """第i个成员的名称"""
+        return self.names_blob[self.name_offsets[i]:self.name_offsets[i + 1]].decode('utf-8')
+
+    def names(self):
+        """按归档中的顺序迭代成员名称"""
+        for i in range(len(self)):
+            yield self.name(i)
+
+    def _member(self, name):
+        """成员名称 -> 序号，第一次查询时建立字典"""
+        if self._lookup is None:
+            with self._lock:
+                if self._lookup is None:
+                    self._lookup = {member: i for i, member in enumerate(self.names())}
+        i = self._lookup.get(name)
+        if i is None:
+            raise FileNotFoundError(f"归档中没有成员: {self.path}:{name}")
+        return i
+
+    def member_size(self, name):
+        return int(self.sizes[self._member(name)])
+
+    def member_range(self, name):
+        """成员数据在归档中的(偏移, 字节数)"""
+        i = self._member(name)
+        return int(self.data_offsets[i]), int(self.csizes[i])
+
+    def fileno(self):
+        return self._fd
+
+    def read(self, name):
+        """按偏移读取成员内容"""
+        i = self._member(name)
+        data = os.pread(self._fd, int(self.csizes[i]), int(self.data_offsets[i]))
+        if self.methods[i] == DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        return data
+
+_open_archives = {}
+_open_lock = threading.Lock()
+
+def open_archive(path):
+    """
+    打开归档并返回成员索引，同一进程内同一归档只打开一次
+
+    参数:
+    - path: 归档路径
+
+    返回:
+    - ArchiveIndex
+    """
+    key = os.path.abspath(path)
+    with _open_lock:
+        index = _open_archives.get(key)
+        if index is None:
+            index = _open_archives[key] = ArchiveIndex.load(path)
+        return index
+
+def _archive_of(root_dir):
+    """root_dir为归档时返回成员索引，否则返回None"""
+    if root_dir.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(root_dir):
+        return open_archive(root_dir)
+    return None
+
+# 以下函数对目录和归档两种数据源统一读取 -----------------------------------------------------------------
+def read_file(root_dir, rel_path):
+    """读取数据集中一个文件的全部字节"""
+    archive = _archive_of(root_dir)
+    if archive is not None:
+        return archive.read(rel_path)
+    with open(os.path.join(root_dir, rel_path), 'rb') as f:
+        return f.read()
+
+def file_size(root_dir, rel_path):
+    """数据集中一个文件的字节数"""
+    archive = _archive_of(root_dir)
+    if archive is not None:
+        return archive.member_size(rel_path)
+    return os.stat(os.path.join(root_dir, rel_path)).st_size
+
+def file_mtime_ns(root_dir, rel_path):
+    """数据集中一个文件的修改时间，归档成员使用归档本身的修改时间"""
+    archive = _archive_of(root_dir)
+    if archive is not None:
+        archive._member(rel_path)
+        return archive.mtime_ns
+    return os.stat(os.path.join(root_dir, rel_path)).st_mtime_ns
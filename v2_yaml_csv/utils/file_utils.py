@@ -2,52 +2,126 @@
 文件写入模块 - 处理CSV和YAML文件的读写
 """
 import os
+import json
+import heapq
 import shutil
 import yaml
-from collections import defaultdict
+import numpy as np
+from collections import Counter, defaultdict
 from datetime import datetime
 from utils.logger import get_logger
+from utils.archive import is_archive, read_file
+from utils.locking import atomic_write
+
+# 优先使用 libyaml 的 C 实现，不可用时回退到纯 Python 实现
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
 
 # 获取全局日志对象
 logger = get_logger()
 
+# 条目数达到该阈值的逐类别表(names/counts/mapping等)才会被移到旁路文件
+LAZY_SECTION_MIN_ITEMS = 1000
+# YAML中记录旁路文件信息的键
+SIDECAR_KEY = '_sidecar'
+
+# 清单存储后端，为None时使用CSV/YAML文件，否则为 utils.sqlite_store.ManifestStore
+_store = None
+
+def configure_storage(backend='files', db_path=None):
+    """
+    选择清单存储后端，之后的 write_*/read_* 函数都读写该后端
+    
+    参数:
+    - backend: 'files'为CSV/YAML文件，'sqlite'为SQLite数据库
+    - db_path: SQLite数据库路径
+    
+    返回:
+    - 存储对象，files后端为None
+    """
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+    if backend == 'sqlite':
+        from utils.sqlite_store import ManifestStore
+        _store = ManifestStore(db_path)
+    elif backend != 'files':
+        raise ValueError(f"不支持的存储后端: {backend}")
+    return _store
+
+def get_store():
+    """当前的SQLite存储，files后端时为None"""
+    return _store
+
+def manifest_exists(file_path):
+    """清单CSV或YAML是否存在于当前存储后端中"""
+    if _store is not None:
+        return _store.exists(file_path)
+    return os.path.exists(file_path)
+
 def write_csv_file(csv_file_path, data_list, has_header=True):
     """
-    将数据写入CSV文件
+    将数据写入CSV文件（SQLite后端时写入数据库）
     
     参数:
     - csv_file_path: CSV文件路径
-    - data_list: 数据列表，每个元素为(相对路径, 标签)元组
+    - data_list: 数据列表，每个元素为(相对路径, 标签)元组；也可以是已按标签排序的DatasetIndex
     - has_header: 是否写入标题行
     """
-    # 确保目录存在
-    os.makedirs(os.path.dirname(os.path.abspath(csv_file_path)), exist_ok=True)
+    if _store is not None:
+        return _store.write_manifest(csv_file_path, data_list)
+    _write_csv_file(csv_file_path, data_list, has_header)
+
+def _write_csv_file(csv_file_path, data_list, has_header=True, columns=None):
+    """
+    将数据写入CSV文件，写完后原子替换，其他进程不会读到写了一半的文件
+
+    columns为{列名: 数组}，与data_list行对齐；为None时使用DatasetIndex自带的附加列
+    """
+    # DatasetIndex的附加列（如文件头解析得到的width/height）写在label之后
+    if columns is None:
+        columns = getattr(data_list, 'columns', None) or {}
     
-    with open(csv_file_path, 'w', encoding='utf-8') as f:
+    with atomic_write(csv_file_path) as f:
         # 写入标题行
         if has_header:
-            f.write("rel_path,label\n")
+            f.write(",".join(["rel_path", "label", *columns]) + "\n")
         
-        # 按标签排序
-        sorted_data = sorted(data_list, key=lambda x: x[1])
+        # 按标签排序（DatasetIndex本身已按标签排序）
+        sorted_data = data_list if hasattr(data_list, 'class_offsets') else sorted(data_list, key=lambda x: x[1])
         
         # 写入数据行
-        for rel_img_path, label in sorted_data:
-            f.write(f"{rel_img_path},{label}\n")
+        if columns:
+            extra = zip(*(values.tolist() for values in columns.values()))
+            for (rel_img_path, label), values in zip(sorted_data, extra):
+                f.write(f"{rel_img_path},{label},{','.join(map(str, values))}\n")
+        else:
+            for rel_img_path, label in sorted_data:
+                f.write(f"{rel_img_path},{label}\n")
     
     logger.info(f"CSV文件已生成: {csv_file_path}")
 
-def write_yaml_file(yaml_file_path, data_dict):
+def write_yaml_file(yaml_file_path, data_dict, lazy_keys=None):
     """
-    将数据写入YAML文件，根据标签信息排序
+    将数据写入YAML文件，根据标签信息排序（SQLite后端时写入数据库）
     
     参数:
     - yaml_file_path: YAML文件路径
     - data_dict: 数据字典
+    - lazy_keys: 可以移到旁路文件中的大表键名，如('names', 'counts')；
+                 只有条目数不少于 LAZY_SECTION_MIN_ITEMS 的表才会被移出
     """
-    # 确保目录存在
-    os.makedirs(os.path.dirname(os.path.abspath(yaml_file_path)), exist_ok=True)
-    
+    if isinstance(data_dict, LazyYamlDict):
+        data_dict = data_dict.copy()
+    if _store is not None:
+        return _store.write_document(yaml_file_path, data_dict)
+    _write_yaml_file(yaml_file_path, data_dict, lazy_keys)
+
+def _write_yaml_file(yaml_file_path, data_dict, lazy_keys=None):
+    """将数据写入YAML文件，旁路文件先于YAML原子发布"""
     # 如果包含class_info，对其进行排序
     if 'class_info' in data_dict:
         # 按标签排序类别信息
@@ -87,12 +161,120 @@ def write_yaml_file(yaml_file_path, data_dict):
         # 替换原来的label_mapping
         data_dict['label_mapping'] = sorted_mapping
     
+    # 将大表写入旁路文件，YAML中只保留小字段和旁路文件信息
+    sidecar_sections = {}
+    for key in lazy_keys or ():
+        value = data_dict.get(key)
+        if isinstance(value, dict) and len(value) >= LAZY_SECTION_MIN_ITEMS:
+            sidecar_sections[key] = value
+
+    if sidecar_sections:
+        sidecar_path = _sidecar_path(yaml_file_path)
+        _write_sidecar(sidecar_path, sidecar_sections)
+        data_dict = {key: value for key, value in data_dict.items() if key not in sidecar_sections}
+        data_dict[SIDECAR_KEY] = {
+            'file': os.path.basename(sidecar_path),
+            'keys': list(sidecar_sections.keys()),
+        }
+
     # 写入排序后的字典
-    with open(yaml_file_path, 'w', encoding='utf-8') as f:
-        yaml.dump(data_dict, f, default_flow_style=False, sort_keys=False)
+    with atomic_write(yaml_file_path) as f:
+        yaml.dump(data_dict, f, Dumper=YamlDumper, default_flow_style=False, sort_keys=False)
     
     logger.info(f"YAML文件已生成: {yaml_file_path}")
 
+def _sidecar_path(yaml_file_path):
+    """YAML文件对应的旁路文件路径"""
+    return os.path.splitext(yaml_file_path)[0] + '.tables.json'
+
+def _write_sidecar(sidecar_path, sections):
+    """
+    将大表写入JSON旁路文件
+    
+    每个表保存为[键, 值]对的列表，以保留整数键（如names中的标签）
+    """
+    payload = {key: [[k, v] for k, v in table.items()] for key, table in sections.items()}
+    with atomic_write(sidecar_path) as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+
+def _read_sidecar(sidecar_path):
+    """读取JSON旁路文件，还原为字典"""
+    with open(sidecar_path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    return {key: {k: v for k, v in pairs} for key, pairs in payload.items()}
+
+class LazyYamlDict(dict):
+    """
+    YAML数据字典，旁路文件中的大表在首次访问时才读取
+    
+    只访问nc、path、train等小字段时不会解析旁路文件
+    """
+    def __init__(self, data, sidecar_path=None, lazy_keys=()):
+        super().__init__(data)
+        self._sidecar_path = sidecar_path
+        self._lazy_keys = set(lazy_keys)
+
+    def __missing__(self, key):
+        if key in self._lazy_keys:
+            self.load_all()
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._lazy_keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    # 遍历、比较和复制整个字典时先读取旁路文件，dict(x)和copy()得到的是完整数据
+    def __iter__(self):
+        return dict.__iter__(self.load_all())
+
+    def __len__(self):
+        return dict.__len__(self.load_all())
+
+    def __bool__(self):
+        return dict.__len__(self) > 0 or bool(self._lazy_keys)
+
+    def __eq__(self, other):
+        return dict.__eq__(self.load_all(), other)
+
+    def __ne__(self, other):
+        return dict.__ne__(self.load_all(), other)
+
+    def __repr__(self):
+        return dict.__repr__(self.load_all())
+
+    def keys(self):
+        return dict.keys(self.load_all())
+
+    def values(self):
+        return dict.values(self.load_all())
+
+    def items(self):
+        return dict.items(self.load_all())
+
+    def copy(self):
+        """返回包含全部大表的普通字典"""
+        return dict(self.items())
+
+    def pop(self, key, *default):
+        if key in self._lazy_keys:
+            self.load_all()
+        return dict.pop(self, key, *default)
+
+    def setdefault(self, key, default=None):
+        if key in self._lazy_keys:
+            self.load_all()
+        return dict.setdefault(self, key, default)
+
+    def load_all(self):
+        """读取旁路文件中的全部大表"""
+        if self._lazy_keys:
+            self.update(_read_sidecar(self._sidecar_path))
+            self._lazy_keys = set()
+        return self
+
 def read_csv_file(csv_file_path, has_header=True):
     """
     从CSV文件读取数据
@@ -104,6 +286,9 @@ def read_csv_file(csv_file_path, has_header=True):
     返回:
     - 数据列表，每个元素为(相对路径, 标签)元组
     """
+    if _store is not None:
+        return _store.read_manifest(csv_file_path)
+
     data_list = []
     
     with open(csv_file_path, 'r', encoding='utf-8') as f:
@@ -112,10 +297,13 @@ def read_csv_file(csv_file_path, has_header=True):
         # 如果有标题行，跳过第一行
         start_idx = 1 if has_header else 0
         
+        # 路径中可能含逗号，标签取倒数第 (附加列数 + 1) 个字段
+        num_extra = _extra_columns(lines[0]) if has_header and lines else 0
+        
         for line in lines[start_idx:]:
             line = line.strip()
             if line:
-                parts = line.split(',')
+                parts = line.rsplit(',', num_extra + 1)
                 if len(parts) >= 2:
                     rel_path = parts[0]
                     label = int(parts[1])
@@ -124,18 +312,131 @@ def read_csv_file(csv_file_path, has_header=True):
     logger.info(f"从CSV文件读取了 {len(data_list)} 条数据: {csv_file_path}")
     return data_list
 
-def read_yaml_file(yaml_file_path):
+def read_csv_columns(csv_file_path, columns=None):
+    """
+    按列读取CSV文件，用于读取文件头解析等附加列
+    
+    参数:
+    - csv_file_path: CSV文件路径
+    - columns: 要读取的列名列表，为None时读取除rel_path外的全部列
+    
+    返回:
+    - {列名: int64数组}
+    """
+    if _store is not None:
+        return _store.read_columns(csv_file_path, columns)
+
+    with open(csv_file_path, 'r', encoding='utf-8') as f:
+        header = f.readline().rstrip('\r\n').split(',')
+        wanted = [name for name in header if name != 'rel_path'] if columns is None else list(columns)
+        missing = [name for name in wanted if name not in header]
+        if missing:
+            raise KeyError(f"CSV文件 {csv_file_path} 中没有列: {missing}")
+        positions = [header.index(name) for name in wanted]
+        values = [[] for _ in wanted]
+        for line in f:
+            # rel_path在第一列且可能含逗号，从右侧切分
+            parts = line.rstrip('\r\n').rsplit(',', len(header) - 1)
+            if len(parts) < len(header):
+                continue
+            for column, position in zip(values, positions):
+                column.append(int(parts[position]))
+    return {name: np.asarray(column, dtype=np.int64) for name, column in zip(wanted, values)}
+
+def _csv_rows(csv_file_path, has_header=True):
+    """逐行产出CSV数据行（去掉换行符，跳过标题行和空行）"""
+    with open(csv_file_path, 'r', encoding='utf-8') as f:
+        if has_header:
+            next(f, None)
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+def _extra_columns(header):
+    """标题行中label之后的附加列数"""
+    return max(header.rstrip('\r\n').count(',') - 1, 0)
+
+def _read_extra_columns(csv_file_path):
+    with open(csv_file_path, 'r', encoding='utf-8') as f:
+        return _extra_columns(f.readline())
+
+def _split_row(row, num_extra=0):
+    """数据行 -> (相对路径, 标签)。路径中可能含逗号，标签为倒数第 (num_extra + 1) 个字段"""
+    parts = row.rsplit(',', num_extra + 1)
+    return parts[0], int(parts[1])
+
+def read_csv_with_delta(csv_file_path, delta_yaml_paths=(), has_header=True):
+    """
+    读取基准清单并依次叠加增量文件（由 core.manifest_diff.diff_manifests 生成）
+    
+    增量中的路径相对于增量YAML所在目录解析。删除按多重集合抵消（重复的行逐个删除），
+    新增的行按标签归并到清单中，结果与基准清单一样按标签排序。
+    
+    参数:
+    - csv_file_path: 基准清单CSV路径
+    - delta_yaml_paths: 增量YAML路径列表，按生成顺序叠加
+    - has_header: 是否有标题行
+    
+    返回:
+    - 数据列表，每个元素为(相对路径, 标签)元组，按标签排序；同一标签内保留的行在前，新增的行在后
+    """
+    if _store is not None:
+        raise ValueError("增量文件只能叠加到磁盘上的CSV清单，SQLite存储请使用update_manifest")
+    rows = list(_csv_rows(csv_file_path, has_header))
+    num_extra = _read_extra_columns(csv_file_path) if has_header else 0
+
+    def row_label(row):
+        return _split_row(row, num_extra)[1]
+
+    for delta_yaml_path in delta_yaml_paths:
+        delta_info = read_yaml_file(delta_yaml_path)
+        delta_dir = os.path.dirname(os.path.abspath(delta_yaml_path))
+        if len(rows) != delta_info['base_rows']:
+            logger.warning(f"增量 {delta_yaml_path} 的基准行数为 {delta_info['base_rows']}，当前清单为 {len(rows)} 行")
+
+        removed = Counter(_csv_rows(os.path.join(delta_dir, delta_info['removed'])))
+        if removed:
+            kept = []
+            for row in rows:
+                if removed.get(row):
+                    removed[row] -= 1
+                else:
+                    kept.append(row)
+            rows = kept
+
+        added = sorted(_csv_rows(os.path.join(delta_dir, delta_info['added'])), key=row_label)
+        if added:
+            rows = list(heapq.merge(rows, added, key=row_label))
+
+    data_list = [_split_row(row, num_extra) for row in rows]
+    
+    logger.info(f"叠加 {len(delta_yaml_paths)} 个增量后得到 {len(data_list)} 条数据: {csv_file_path}")
+    return data_list
+
+def read_yaml_file(yaml_file_path, lazy=True):
     """
     从YAML文件读取数据
     
     参数:
     - yaml_file_path: YAML文件路径
+    - lazy: 是否延迟读取旁路文件中的大表，为False时立即读取
     
     返回:
     - 数据字典
     """
+    if _store is not None:
+        return _store.read_document(yaml_file_path)
+
     with open(yaml_file_path, 'r', encoding='utf-8') as f:
-        data_dict = yaml.safe_load(f)
+        data_dict = yaml.load(f, Loader=YamlLoader)
+
+    sidecar = data_dict.pop(SIDECAR_KEY, None) if isinstance(data_dict, dict) else None
+    if sidecar:
+        sidecar_path = os.path.join(os.path.dirname(os.path.abspath(yaml_file_path)), sidecar['file'])
+        data_dict = LazyYamlDict(data_dict, sidecar_path, sidecar['keys'])
+        if not lazy:
+            data_dict.load_all()
     
     logger.info(f"从YAML文件读取了数据: {yaml_file_path}")
     return data_dict
@@ -151,7 +452,7 @@ def copy_image_files(split_data, root_dir, output_dir, split_name):
     
     参数:
     - split_data: 划分数据列表，格式为[(相对路径, 标签), ...]
-    - root_dir: 原始数据集根目录
+    - root_dir: 原始数据集根目录或tar/zip归档
     - output_dir: 输出根目录
     - split_name: 划分名称 (train/val/test)
     
@@ -163,6 +464,7 @@ def copy_image_files(split_data, root_dir, output_dir, split_name):
     os.makedirs(target_dir, exist_ok=True)
     
     copied_count = 0
+    archive = is_archive(root_dir)
     
     # 遍历所有图像文件
     for rel_path, label in split_data:
@@ -179,7 +481,12 @@ def copy_image_files(split_data, root_dir, output_dir, split_name):
         
         # 复制文件
         try:
-            shutil.copy2(src_file, dst_file)
+            if archive:
+                # 按偏移读取归档成员，不解压整个归档
+                with open(dst_file, 'wb') as f:
+                    f.write(read_file(root_dir, rel_path))
+            else:
+                shutil.copy2(src_file, dst_file)
             copied_count += 1
             
             # 每复制100个文件记录一次日志
@@ -0,0 +1,198 @@
+"""
+图像头解析模块 - 只读取文件头获取宽、高、通道数和格式，不解码图像
+"""
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 格式编码，写入清单的format列
+FORMATS = {0: 'unknown', 1: 'jpeg', 2: 'png', 3: 'bmp', 4: 'tiff'}
+_FORMAT_CODES = {name: code for code, name in FORMATS.items()}
+
+# 首次读取的字节数，PNG/BMP的尺寸和TIFF的IFD偏移都在这一范围内
+_HEAD_BYTES = 64
+# JPEG逐段跳过时最多读取的段数，避免损坏文件导致长时间扫描
+_JPEG_MAX_SEGMENTS = 256
+
+# PNG颜色类型 -> 通道数
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+# JPEG中包含尺寸的SOF标记（排除DHT、JPG、DAC）
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _exif_orientation(f, length):
+    """
+    解析APP1(EXIF)段IFD0中的Orientation标签，只读取TIFF头和IFD0的条目
+
+    参数:
+    - f: 位于段数据开头（长度字段之后）的文件对象
+    - length: 段数据长度（不含长度字段）
+
+    返回:
+    - Orientation值(1-8)，没有该标签时返回1；返回前把文件位置移到段末尾
+    """
+    start = f.tell()
+    orientation = 1
+    head = f.read(min(length, 14))
+    if len(head) == 14 and head[:6] == b'Exif\x00\x00' and head[6:8] in (b'II', b'MM'):
+        endian = '<' if head[6:8] == b'II' else '>'
+        ifd_offset = struct.unpack(endian + 'I', head[10:14])[0]
+        # IFD偏移相对于TIFF头（段数据第6字节）
+        if 8 <= ifd_offset and 6 + ifd_offset + 2 <= length:
+            f.seek(start + 6 + ifd_offset)
+            count = struct.unpack(endian + 'H', f.read(2))[0]
+            entries = f.read(12 * min(count, (length - 6 - ifd_offset - 2) // 12))
+            for i in range(len(entries) // 12):
+                tag, typ = struct.unpack(endian + 'HH', entries[12 * i:12 * i + 4])
+                if tag == 0x0112 and typ == 3:
+                    orientation = struct.unpack(endian + 'H', entries[12 * i + 8:12 * i + 10])[0]
+                    break
+    f.seek(start + length)
+    return orientation
+
+def _probe_jpeg(f):
+    """
+    逐段跳过JPEG标记直到SOF，每段只读取4字节段头
+
+    EXIF Orientation为5-8（旋转90度）时交换宽高，返回的是解码并按方向旋转后的尺寸
+    """
+    f.seek(2)
+    orientation = 1
+    for _ in range(_JPEG_MAX_SEGMENTS):
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        # 填充字节
+        while code == 0xFF:
+            byte = f.read(1)
+            if not byte:
+                return None
+            code = byte[0]
+        # 无长度字段的标记
+        if code in (0x01, *range(0xD0, 0xD8)):
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if code in _JPEG_SOF:
+            data = f.read(6)
+            if len(data) < 6:
+                return None
+            height, width, channels = struct.unpack('>HHB', data[1:6])
+            if 5 <= orientation <= 8:
+                width, height = height, width
+            return width, height, channels
+        if code == 0xE1 and orientation == 1 and length >= 2:
+            orientation = _exif_orientation(f, length - 2)
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+def _probe_tiff(f, head):
+    """解析TIFF第一个IFD中的ImageWidth/ImageLength/SamplesPerPixel"""
+    endian = '<' if head[:2] == b'II' else '>'
+    f.seek(struct.unpack(endian + 'I', head[4:8])[0])
+    count_bytes = f.read(2)
+    if len(count_bytes) < 2:
+        return None
+    count = struct.unpack(endian + 'H', count_bytes)[0]
+    entries = f.read(12 * min(count, 512))
+    tags = {}
+    for i in range(len(entries) // 12):
+        tag, typ, _ = struct.unpack(endian + 'HHI', entries[12 * i:12 * i + 8])
+        if tag in (256, 257, 277):
+            value = entries[12 * i + 8:12 * i + 12]
+            # SHORT(3)值位于字段开头，LONG(4)占满4字节
+            tags[tag] = struct.unpack(endian + ('H' if typ == 3 else 'I'), value[:2] if typ == 3 else value)[0]
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[256], tags[257], tags.get(277, 1)
+
+def probe_image(path):
+    """
+    读取图像文件头
+
+    参数:
+    - path: 图像路径
+
+    返回:
+    - (width, height, channels, format)，无法识别时返回None
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(_HEAD_BYTES)
+            if head[:2] == b'\xff\xd8':
+                result, fmt = _probe_jpeg(f), 'jpeg'
+            elif head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', head[16:24])
+                result, fmt = (width, height, _PNG_CHANNELS.get(head[25], 0)), 'png'
+            elif head[:2] == b'BM' and len(head) >= 30:
+                header_size = struct.unpack('<I', head[14:18])[0]
+                if header_size == 12:  # BITMAPCOREHEADER
+                    width, height, _, bpp = struct.unpack('<HHHH', head[18:26])
+                else:
+                    width, height, _, bpp = struct.unpack('<iiHH', head[18:30])
+                # 8位及以下为调色板图像，解码后为3通道
+                result, fmt = (abs(width), abs(height), bpp // 8 if bpp > 8 else 3), 'bmp'
+            elif head[:4] in (b'II*\x00', b'MM\x00*'):
+                result, fmt = _probe_tiff(f, head), 'tiff'
+            else:
+                return None
+    except (OSError, struct.error):
+        return None
+    if result is None:
+        return None
+    return result[0], result[1], result[2], _FORMAT_CODES[fmt]
+
+def probe_batch(root_dir, rel_paths):
+    """
+    读取一批图像的文件头
+
+    返回:
+    - 形状为(len(rel_paths), 4)的int32数组，列为width、height、channels、format，
+      无法识别的文件为全0
+    """
+    result = np.zeros((len(rel_paths), 4), dtype=np.int32)
+    for i, rel_path in enumerate(rel_paths):
+        probed = probe_image(os.path.join(root_dir, rel_path))
+        if probed is not None:
+            result[i] = probed
+    return result
+
+class HeaderProber:
+    """
+    扫描时在线程池中并发读取文件头
+
+    按类别提交批次，build_columns按DatasetIndex的行顺序拼接结果
+    """
+
+    def __init__(self, root_dir, num_workers=32):
+        self.root_dir = root_dir
+        self.pool = ThreadPoolExecutor(num_workers, thread_name_prefix='probe')
+        self.futures = {}  # 类别名称 -> [future, ...]
+
+    def submit(self, class_name, rel_paths, batch_size=256):
+        """提交一个目录中属于class_name的文件，大目录拆成多个批次"""
+        futures = self.futures.setdefault(class_name, [])
+        for start in range(0, len(rel_paths), batch_size):
+            futures.append(self.pool.submit(probe_batch, self.root_dir, rel_paths[start:start + batch_size]))
+
+    def build_columns(self, index):
+        """
+        等待全部结果并生成DatasetIndex的附加列
+
+        返回:
+        - {'width': int32, 'height': int32, 'channels': uint8, 'format': uint8}
+        """
+        parts = [future.result() for class_name in index.class_names for future in self.futures.get(class_name, ())]
+        self.pool.shutdown()
+        table = np.concatenate(parts) if parts else np.zeros((0, 4), dtype=np.int32)
+        return {
+            'width': table[:, 0].copy(),
+            'height': table[:, 1].copy(),
+            'channels': table[:, 2].astype(np.uint8),
+            'format': table[:, 3].astype(np.uint8),
+        }
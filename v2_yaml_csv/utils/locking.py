@@ -0,0 +1,121 @@
+"""
+跨进程锁与原子发布 - 多个任务共享输出目录时，保证读者看不到写了一半的文件，昂贵的产物只生成一次
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台，退化为不加锁
+    fcntl = None
+
+logger = get_logger()
+
+# 新文件的权限与直接open()创建时一致（mkstemp创建的临时文件为0600）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def lock_path(path):
+    """产物对应的锁文件路径。锁文件不删除，删除会让等待中的进程锁住已被替换的文件"""
+    return path + '.lock'
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    对产物加锁（阻塞直到获得锁）
+
+    参数:
+    - path: 产物路径，实际锁定的是 {path}.lock
+    - shared: 是否为共享锁，为False时为排他锁
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(lock_path(path), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+@contextmanager
+def elect_writer(path):
+    """
+    写者选举: 多个进程要生成同一产物时，第一个进程负责生成，其余进程等待它完成
+
+    用法:
+        with elect_writer(csv_path) as elected:
+            if not elected and 产物已存在:
+                复用产物
+            else:
+                生成产物
+
+    返回（yield）:
+    - True表示没有其他进程正在生成，由本进程生成；False表示等待了其他进程，产物应已生成。
+      两种情况下退出with之前都持有排他锁
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(lock_path(path), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elected = True
+        except BlockingIOError:
+            logger.info(f"其他进程正在生成 {path}，等待其完成")
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            elected = False
+        yield elected
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def _fsync_dir(directory):
+    """同步目录项，保证重命名在掉电后仍然有效（部分文件系统不支持，忽略错误）"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_write(path, mode='w', encoding='utf-8'):
+    """
+    原子写入: 先写同目录下的临时文件，fsync后用os.replace发布
+
+    读者要么看到旧文件，要么看到完整的新文件；写入出错时目标文件保持不变。
+
+    参数:
+    - path: 目标文件路径
+    - mode: 'w'或'wb'
+    - encoding: 文本模式的编码
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=None if 'b' in mode else encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
@@ -8,7 +8,7 @@ from datetime import datetime
 # 全局日志对象
 logger = None
 
-def setup_logger(log_level=logging.INFO, log_dir='logs', filename=None):
+def setup_logger(log_level=logging.INFO, log_dir='logs', filename=None, reset=False, tag=None):
     """
     配置全局日志系统
     
@@ -16,6 +16,8 @@ def setup_logger(log_level=logging.INFO, log_dir='logs', filename=None):
     - log_level: 日志级别，默认为INFO
     - log_dir: 日志文件目录，默认为'logs'
     - filename: 日志文件名，默认为None（使用当前日期时间）
+    - reset: 是否关闭已有的处理器并重新配置（批量任务在同一进程中依次运行时使用）
+    - tag: 写在每条日志中的标记，如批量任务名称
     
     返回:
     - 配置好的logger对象
@@ -24,7 +26,12 @@ def setup_logger(log_level=logging.INFO, log_dir='logs', filename=None):
     
     # 如果logger已经配置过，直接返回
     if logger is not None:
-        return logger
+        if not reset:
+            return logger
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        logger = None
     
     # 创建日志目录
     if not os.path.exists(log_dir):
@@ -50,7 +57,8 @@ def setup_logger(log_level=logging.INFO, log_dir='logs', filename=None):
     console_handler.setLevel(log_level)
     
     # 设置日志格式
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    name = '%(name)s' if tag is None else f'%(name)s[{tag}]'
+    formatter = logging.Formatter(f'%(asctime)s - {name} - %(levelname)s - %(message)s')
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
     
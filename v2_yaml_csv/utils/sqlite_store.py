@@ -0,0 +1,429 @@
+"""
+SQLite清单存储 - 代替分散的CSV/YAML文件，支持事务内增量更新和按条件读取
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+import yaml
+
+from utils.logger import get_logger
+
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+logger = get_logger()
+
+# 划分清单名称: {划分前缀}_{train|val|test}_{比例}
+_SPLIT_NAME = re.compile(r'^(?P<parent>.+)_(?P<split>train|val|test)_\d+$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id       INTEGER PRIMARY KEY,
+    rel_path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS manifests (
+    id           INTEGER PRIMARY KEY,
+    name         TEXT NOT NULL UNIQUE,
+    kind         TEXT NOT NULL CHECK (kind IN ('full', 'subset', 'split')),
+    parent       TEXT,
+    split        TEXT,
+    updated_time TEXT
+);
+CREATE TABLE IF NOT EXISTS entries (
+    manifest_id INTEGER NOT NULL REFERENCES manifests(id) ON DELETE CASCADE,
+    row_no      INTEGER NOT NULL,
+    file_id     INTEGER NOT NULL REFERENCES files(id),
+    label       INTEGER NOT NULL,
+    PRIMARY KEY (manifest_id, row_no)
+);
+CREATE INDEX IF NOT EXISTS entries_by_label ON entries(manifest_id, label, row_no);
+CREATE INDEX IF NOT EXISTS entries_by_file ON entries(manifest_id, file_id);
+CREATE TABLE IF NOT EXISTS subsets (
+    manifest_id INTEGER NOT NULL REFERENCES manifests(id) ON DELETE CASCADE,
+    row_no      INTEGER NOT NULL,
+    file_id     INTEGER NOT NULL REFERENCES files(id),
+    label       INTEGER NOT NULL,
+    PRIMARY KEY (manifest_id, row_no)
+);
+CREATE INDEX IF NOT EXISTS subsets_by_label ON subsets(manifest_id, label, row_no);
+CREATE INDEX IF NOT EXISTS subsets_by_file ON subsets(manifest_id, file_id);
+CREATE TABLE IF NOT EXISTS split_assignments (
+    manifest_id INTEGER NOT NULL REFERENCES manifests(id) ON DELETE CASCADE,
+    row_no      INTEGER NOT NULL,
+    file_id     INTEGER NOT NULL REFERENCES files(id),
+    label       INTEGER NOT NULL,
+    PRIMARY KEY (manifest_id, row_no)
+);
+CREATE INDEX IF NOT EXISTS split_assignments_by_label ON split_assignments(manifest_id, label, row_no);
+CREATE INDEX IF NOT EXISTS split_assignments_by_file ON split_assignments(manifest_id, file_id);
+CREATE TABLE IF NOT EXISTS file_columns (
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    name    TEXT NOT NULL,
+    value   INTEGER NOT NULL,
+    PRIMARY KEY (file_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifest_columns (
+    manifest_id INTEGER NOT NULL REFERENCES manifests(id) ON DELETE CASCADE,
+    position    INTEGER NOT NULL,
+    name        TEXT NOT NULL,
+    PRIMARY KEY (manifest_id, position)
+);
+CREATE TABLE IF NOT EXISTS classes (
+    document TEXT NOT NULL,
+    label    INTEGER NOT NULL,
+    name     TEXT NOT NULL,
+    PRIMARY KEY (document, label)
+);
+CREATE INDEX IF NOT EXISTS classes_by_name ON classes(document, name);
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+"""
+
+# 表结构版本，保存在PRAGMA user_version中
+_SCHEMA_VERSION = 2
+
+# 清单类型 -> 保存其行的表
+_ROW_TABLES = {'full': 'entries', 'subset': 'subsets', 'split': 'split_assignments'}
+
+def _manifest_kind(name):
+    """根据名称（只看最后一级，目录名不参与）推断清单类型，返回(kind, parent, split)"""
+    base = name.rsplit('/', 1)[-1]
+    match = _SPLIT_NAME.match(name)
+    if match and '_split' in match.group('parent').rsplit('/', 1)[-1]:
+        return 'split', match.group('parent'), match.group('split')
+    if '_select' in base:
+        return 'subset', None, None
+    return 'full', None, None
+
+class ManifestStore:
+    """
+    基于SQLite的清单存储
+
+    - files: 相对路径字典，每个文件只保存一次
+    - manifests: 每个清单（完整数据集、子集、各划分）的名称和类型
+    - entries / subsets / split_assignments: 完整数据集、子集和划分清单的(行号, 文件, 标签)行；
+      以(清单, 行号)为主键，同一清单中重复的路径与CSV一样各占一行
+    - file_columns / manifest_columns: 文件头解析等附加列的值（属于文件，各清单共享）和每个清单带有的列名
+    - classes: 各YAML中的标签-类别名称表
+    - documents: YAML内容
+
+    清单和YAML以路径（去掉扩展名）相对于数据库所在目录的规范化形式命名，
+    不同目录下的同名文件互不覆盖。使用WAL模式，读写可以并发；批量写入使用executemany并在单个事务中完成。
+    """
+
+    def __init__(self, db_path):
+        """
+        参数:
+        - db_path: 数据库文件路径
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.base_dir = os.path.dirname(os.path.abspath(db_path))
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        has_tables = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'manifests'").fetchone()
+        if has_tables and version != _SCHEMA_VERSION:
+            self.conn.close()
+            raise ValueError(f"SQLite清单存储 {db_path} 的表结构版本为 {version}，当前为 {_SCHEMA_VERSION}，"
+                             f"请用旧版本export导出后重新生成")
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        logger.info(f"SQLite清单存储已打开: {db_path}")
+
+    def close(self):
+        self.conn.close()
+
+    def manifest_name(self, path):
+        """CSV/YAML路径 -> 存储中的名称（去掉扩展名，相对于数据库所在目录，以'/'分隔）"""
+        stem = os.path.splitext(os.path.abspath(path))[0]
+        return os.path.relpath(stem, self.base_dir).replace(os.sep, '/')
+
+    # 清单 ----------------------------------------------------------------------------------------
+    def _manifest(self, name, create=False):
+        """
+        清单名称 -> (清单id, 行所在的表)，清单不存在且create为False时返回(None, None)
+        """
+        row = self.conn.execute("SELECT id, kind FROM manifests WHERE name = ?", (name,)).fetchone()
+        if row:
+            if create:
+                self.conn.execute("UPDATE manifests SET updated_time = ? WHERE id = ?",
+                                  (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[0]))
+            return row[0], _ROW_TABLES[row[1]]
+        if not create:
+            return None, None
+        kind, parent, split = _manifest_kind(name)
+        cursor = self.conn.execute(
+            "INSERT INTO manifests(name, kind, parent, split, updated_time) VALUES (?, ?, ?, ?, ?)",
+            (name, kind, parent, split, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        return cursor.lastrowid, _ROW_TABLES[kind]
+
+    def _insert_entries(self, manifest_id, table, data_list, start=0):
+        """
+        插入(相对路径, 标签)行，路径先写入files表
+
+        参数:
+        - start: 第一行的行号，同一标签内按行号排序
+
+        返回:
+        - 插入的行数
+        """
+        rows = [(rel_path, int(label)) for rel_path, label in data_list]
+        self.conn.executemany("INSERT OR IGNORE INTO files(rel_path) VALUES (?)", ((rel_path,) for rel_path, _ in rows))
+        cursor = self.conn.executemany(
+            f"INSERT INTO {table}(manifest_id, row_no, file_id, label) SELECT ?, ?, id, ? FROM files WHERE rel_path = ?",
+            ((manifest_id, start + i, label, rel_path) for i, (rel_path, label) in enumerate(rows)))
+        return cursor.rowcount
+
+    def _column_names(self, manifest_id):
+        return [row[0] for row in self.conn.execute(
+            "SELECT name FROM manifest_columns WHERE manifest_id = ? ORDER BY position", (manifest_id,))]
+
+    def manifest_columns(self, path):
+        """清单带有的附加列名（CSV中label之后的列）"""
+        manifest_id, _ = self._manifest(self.manifest_name(path))
+        if manifest_id is None:
+            raise FileNotFoundError(f"SQLite中没有清单: {path}")
+        return self._column_names(manifest_id)
+
+    def _insert_columns(self, manifest_id, data_list, columns):
+        """保存DatasetIndex的附加列（与CSV中label之后的列相同），并记录清单带有的列名"""
+        self.conn.execute("DELETE FROM manifest_columns WHERE manifest_id = ?", (manifest_id,))
+        self.conn.executemany("INSERT INTO manifest_columns(manifest_id, position, name) VALUES (?, ?, ?)",
+                              ((manifest_id, position, name) for position, name in enumerate(columns)))
+        for name, values in columns.items():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO file_columns(file_id, name, value) SELECT id, ?, ? FROM files WHERE rel_path = ?",
+                ((name, value, rel_path) for (rel_path, _), value in zip(data_list, values.tolist())))
+
+    def write_manifest(self, path, data_list):
+        """
+        整体替换一个清单
+
+        参数:
+        - path: 清单CSV路径
+        - data_list: [(相对路径, 标签), ...]或DatasetIndex，DatasetIndex的附加列一并保存
+        """
+        name = self.manifest_name(path)
+        columns = getattr(data_list, 'columns', None) or {}
+        with self.conn:
+            manifest_id, table = self._manifest(name, create=True)
+            self.conn.execute(f"DELETE FROM {table} WHERE manifest_id = ?", (manifest_id,))
+            # 与CSV一致按标签排序，同标签内保持原顺序（读取时按行号排序）
+            data = data_list if hasattr(data_list, 'class_offsets') else sorted(data_list, key=lambda x: x[1])
+            count = self._insert_entries(manifest_id, table, data)
+            self._insert_columns(manifest_id, data, columns)
+        logger.info(f"清单已写入SQLite: {name}, {count} 行" + (f", 附加列 {list(columns)}" if columns else ''))
+
+    def write_sorted_rows(self, path, rows, columns=(), chunk_size=65536):
+        """
+        整体替换一个清单，行从迭代器中分块读取写入，内存只与块大小有关
+
+        参数:
+        - path: 清单CSV路径
+        - rows: 已按标签排序的(相对路径, 标签, *附加列的值)迭代器
+        - columns: 附加列名，与每行标签之后的值一一对应，保存到file_columns
+        - chunk_size: 每次executemany的行数
+
+        返回:
+        - 写入的行数
+        """
+        name = self.manifest_name(path)
+        columns = list(columns)
+        rows = iter(rows)
+        count = 0
+        with self.conn:
+            manifest_id, table = self._manifest(name, create=True)
+            self.conn.execute(f"DELETE FROM {table} WHERE manifest_id = ?", (manifest_id,))
+            self.conn.execute("DELETE FROM manifest_columns WHERE manifest_id = ?", (manifest_id,))
+            self.conn.executemany("INSERT INTO manifest_columns(manifest_id, position, name) VALUES (?, ?, ?)",
+                                  ((manifest_id, position, column) for position, column in enumerate(columns)))
+            for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+                count += self._insert_entries(manifest_id, table, (row[:2] for row in chunk), start=count)
+                for position, column in enumerate(columns):
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO file_columns(file_id, name, value) "
+                        "SELECT id, ?, ? FROM files WHERE rel_path = ?",
+                        ((column, int(row[2 + position]), row[0]) for row in chunk))
+        logger.info(f"清单已写入SQLite: {name}, {count} 行" + (f", 附加列 {columns}" if columns else ''))
+        return count
+
+    def update_manifest(self, path, added=(), removed=()):
+        """
+        在一个事务中增量更新清单
+
+        参数:
+        - path: 清单CSV路径
+        - added: 新增的[(相对路径, 标签), ...]，排在同一标签已有的行之后
+        - removed: 删除的相对路径列表，按多重集合处理: 每出现一次删除该路径的一行
+
+        返回:
+        - (新增行数, 实际删除的行数)
+        """
+        name = self.manifest_name(path)
+        with self.conn:
+            manifest_id, table = self._manifest(name, create=True)
+            num_removed = self.conn.executemany(
+                f"DELETE FROM {table} WHERE manifest_id = ? AND row_no = ("
+                f"SELECT e.row_no FROM {table} e JOIN files f ON f.id = e.file_id "
+                f"WHERE e.manifest_id = ? AND f.rel_path = ? ORDER BY e.row_no LIMIT 1)",
+                ((manifest_id, manifest_id, rel_path) for rel_path in removed)).rowcount
+            start = self.conn.execute(f"SELECT COALESCE(MAX(row_no) + 1, 0) FROM {table} WHERE manifest_id = ?",
+                                      (manifest_id,)).fetchone()[0]
+            count = self._insert_entries(manifest_id, table, added, start)
+            # 带附加列的清单: 新增的文件必须已有这些列的值，否则读取附加列时行数对不上
+            columns = self._column_names(manifest_id)
+            if columns and added:
+                missing = self.conn.execute(
+                    f"SELECT COUNT(*) FROM {table} e WHERE e.manifest_id = ? AND "
+                    f"(SELECT COUNT(*) FROM file_columns c WHERE c.file_id = e.file_id AND c.name IN "
+                    f"({','.join('?' * len(columns))})) < ?", (manifest_id, *columns, len(columns))).fetchone()[0]
+                if missing:
+                    raise ValueError(f"清单 {name} 带有附加列 {columns}，但有 {missing} 行缺少这些列的值")
+        logger.info(f"清单增量更新: {name}, 新增 {count} 行, 删除 {num_removed} 行")
+        return count, num_removed
+
+    def read_manifest(self, path, labels=None, prefix=None, columns=()):
+        """
+        读取清单，可按标签和路径前缀筛选
+
+        参数:
+        - path: 清单CSV路径
+        - labels: 只读取这些标签
+        - prefix: 只读取以该前缀开头的路径
+        - columns: 同时读取的附加列名，值附在每行标签之后
+
+        返回:
+        - [(相对路径, 标签, *附加列的值), ...]，按标签排序；清单不存在时抛出FileNotFoundError
+        """
+        manifest_id, table = self._manifest(self.manifest_name(path))
+        if manifest_id is None:
+            raise FileNotFoundError(f"SQLite中没有清单: {path}")
+
+        selects = ''.join(f", c{i}.value" for i in range(len(columns)))
+        joins = ''.join(f" LEFT JOIN file_columns c{i} ON c{i}.file_id = e.file_id AND c{i}.name = ?"
+                        for i in range(len(columns)))
+        sql = (f"SELECT f.rel_path, e.label{selects} FROM {table} e JOIN files f ON f.id = e.file_id{joins} "
+               "WHERE e.manifest_id = ?")
+        params = [*columns, manifest_id]
+        if labels is not None:
+            labels = [int(label) for label in labels]
+            sql += f" AND e.label IN ({','.join('?' * len(labels))})"
+            params.extend(labels)
+        if prefix:
+            # 用范围比较代替LIKE，可以利用rel_path上的唯一索引
+            sql += " AND f.rel_path >= ? AND f.rel_path < ?"
+            params.extend([prefix, prefix + '\U0010ffff'])
+        sql += " ORDER BY e.label, e.row_no"
+        return self.conn.execute(sql, params).fetchall()
+
+    def read_columns(self, path, columns=None):
+        """
+        读取清单的附加列，行顺序与read_manifest一致
+
+        参数:
+        - path: 清单CSV路径
+        - columns: 要读取的列名列表，为None时读取label和全部附加列
+
+        返回:
+        - {列名: int64数组}；清单中没有的列抛出KeyError
+        """
+        manifest_id, table = self._manifest(self.manifest_name(path))
+        if manifest_id is None:
+            raise FileNotFoundError(f"SQLite中没有清单: {path}")
+        available = self._column_names(manifest_id)
+        wanted = ['label', *available] if columns is None else list(columns)
+        missing = [name for name in wanted if name != 'label' and name not in available]
+        if missing:
+            raise KeyError(f"SQLite清单 {path} 中没有列: {missing}")
+
+        result = {}
+        for name in wanted:
+            if name == 'label':
+                sql, params = f"SELECT e.label FROM {table} e WHERE e.manifest_id = ?", (manifest_id,)
+            else:
+                sql = (f"SELECT c.value FROM {table} e JOIN file_columns c ON c.file_id = e.file_id AND c.name = ? "
+                       "WHERE e.manifest_id = ?")
+                params = (name, manifest_id)
+            values = [row[0] for row in self.conn.execute(sql + " ORDER BY e.label, e.row_no", params)]
+            result[name] = np.asarray(values, dtype=np.int64)
+        return result
+
+    def manifest_names(self):
+        return [row[0] for row in self.conn.execute("SELECT name FROM manifests ORDER BY id")]
+
+    # YAML ----------------------------------------------------------------------------------------
+    def write_document(self, path, data_dict):
+        """保存YAML内容，同时把names/name表写入classes表"""
+        name = self.manifest_name(path)
+        body = yaml.dump(dict(data_dict), Dumper=YamlDumper, default_flow_style=False, sort_keys=False)
+        names = data_dict.get('names') or data_dict.get('name') or {}
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO documents(name, body) VALUES (?, ?)", (name, body))
+            self.conn.execute("DELETE FROM classes WHERE document = ?", (name,))
+            if isinstance(names, dict):
+                self.conn.executemany("INSERT INTO classes(document, label, name) VALUES (?, ?, ?)",
+                                      ((name, int(label), str(class_name)) for label, class_name in names.items()))
+        logger.info(f"YAML已写入SQLite: {name}")
+
+    def read_document(self, path):
+        row = self.conn.execute("SELECT body FROM documents WHERE name = ?", (self.manifest_name(path),)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"SQLite中没有YAML: {path}")
+        return yaml.load(row[0], Loader=YamlLoader)
+
+    def document_names(self):
+        return [row[0] for row in self.conn.execute("SELECT name FROM documents ORDER BY rowid")]
+
+    def exists(self, path):
+        """清单或YAML是否存在"""
+        name = self.manifest_name(path)
+        if path.endswith(('.yaml', '.yml')):
+            return self.conn.execute("SELECT 1 FROM documents WHERE name = ?", (name,)).fetchone() is not None
+        return self._manifest(name)[0] is not None
+
+    # 导出 ----------------------------------------------------------------------------------------
+    @staticmethod
+    def _export_path(output_dir, name, ext):
+        """导出文件路径: 名称中的子目录保留，'..'换成'__'，导出的文件都在output_dir之下"""
+        parts = ['__' if part == '..' else part for part in name.split('/')]
+        return os.path.join(output_dir, *parts[:-1], parts[-1] + ext)
+
+    def export(self, output_dir):
+        """
+        导出为原有的CSV/YAML文件格式，文件相对于output_dir的位置与原路径相对于数据库目录的位置相同
+
+        参数:
+        - output_dir: 输出目录
+
+        返回:
+        - 生成的文件路径列表
+        """
+        from utils.file_utils import _write_csv_file, _write_yaml_file
+
+        files = []
+        for name in self.manifest_names():
+            # 按名称对应的原路径读取，导出路径可以在其他目录
+            source = os.path.join(self.base_dir, name + '.csv')
+            csv_path = self._export_path(output_dir, name, '.csv')
+            columns = self.read_columns(source)
+            del columns['label']
+            _write_csv_file(csv_path, self.read_manifest(source), columns=columns)
+            files.append(csv_path)
+        for name in self.document_names():
+            yaml_path = self._export_path(output_dir, name, '.yaml')
+            _write_yaml_file(yaml_path, self.read_document(os.path.join(self.base_dir, name + '.yaml')),
+                             lazy_keys=('names', 'counts', 'name'))
+            files.append(yaml_path)
+        logger.info(f"SQLite清单已导出 {len(files)} 个文件到 {output_dir}")
+        return files
@@ -0,0 +1,312 @@
+"""
+v1缓存迁移模块 - 将v1的JSON缓存流式转换为v2的CSV/YAML文件
+"""
+import os
+import re
+import json
+from datetime import datetime
+from utils.logger import get_logger
+from utils.file_utils import write_yaml_file
+from utils.locking import atomic_write
+
+# 获取全局日志对象
+logger = get_logger()
+
+# 定位JSON值结束位置时使用: 完整的字符串、结构字符或被块边界截断的字符串的开头引号；标量的结束字符
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}"]', re.S)
+_SCALAR_END = re.compile(r'[\s,\]}:]')
+
+class JsonStream:
+    """
+    JSON增量解析器
+
+    按块读取文件，只把当前元素保留在内存中，可以逐个取出顶层数组/对象中的元素，
+    内存占用与单个元素（v1中一个类别或一个样本）的大小相关，与文件大小无关。
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """
+        读取下一块数据，返回是否读到了新数据
+
+        块大小不小于缓冲区中未消费的部分，大元素的缓冲区按倍数增长，复制总量与元素大小成正比
+        """
+        if self.eof:
+            return False
+        data = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白并返回下一个字符，文件结束时返回空字符串"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, ch):
+        """读取一个指定的结构字符"""
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"JSON格式错误: 期望 '{ch}'，实际为 '{got}'")
+        self.pos += 1
+
+    def _value_end(self):
+        """
+        找到从当前位置开始的JSON值的结束位置，值不完整时补充数据
+
+        只跟踪嵌套深度，字符串整体跳过；每次补充数据后从上次扫描到的位置继续，
+        每个字符只扫描一次（被截断的字符串除外）。格式错误留给raw_decode报告
+        """
+        scalar = self.peek() not in '[{"'
+        depth = 0
+        i = self.pos
+        while True:
+            if scalar:
+                # 数字或true/false/null，可能被块边界截断
+                m = _SCALAR_END.search(self.buf, i)
+                if m:
+                    return m.start()
+                i = len(self.buf)
+            else:
+                while True:
+                    m = _TOKEN.search(self.buf, i)
+                    if m is None:
+                        i = len(self.buf)
+                        break
+                    token = m.group()
+                    if token == '"':
+                        # 字符串被块边界截断，补充数据后从开头引号重新扫描
+                        i = m.start()
+                        break
+                    i = m.end()
+                    if token[0] == '"':
+                        if depth == 0:
+                            return i
+                    elif token in '[{':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            return i
+
+            offset = i - self.pos
+            if not self._fill():
+                return len(self.buf)
+            i = self.pos + offset
+
+    def value(self):
+        """
+        解析下一个完整的JSON值
+
+        数组、对象或字符串完整地位于缓冲区内时直接解析；否则先确定值的范围、补充数据，再只解析一次，
+        避免大元素在每次补充数据后都从头重新解析
+        """
+        # 数字可能被块边界截断（如"0.1"只读到"0."），标量总是先确认范围
+        if self.peek() in '[{"':
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                self.pos = end
+                return obj
+            except json.JSONDecodeError:
+                pass
+        self._value_end()
+        obj, end = self.decoder.raw_decode(self.buf, self.pos)
+        self.pos = end
+        return obj
+
+    def iter_array(self):
+        """逐个产出数组元素"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def iter_object_keys(self):
+        """
+        逐个产出对象的键，调用方在每次产出后负责读取对应的值
+        （调用value()或完整迭代iter_array()）
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+def _ratio_tag(ratio):
+    """与DatasetSplitter一致的比例标记，如0.8 -> 08"""
+    return ''.join(str(ratio).split('.'))
+
+def migrate_v1_cache(json_path, output_dir, root_dir=None, dataset_name=None):
+    """
+    将v1 JSON缓存流式转换为v2文件，不重新扫描数据集
+
+    - v1完整缓存(类别列表) -> {dataset_name}.csv + {dataset_name}.yaml
+    - v1划分缓存({'train': [...], 'val': [...], 'test': [...]})
+      -> {dataset_name}_split_a_a_{split}_{ratio}.csv + {dataset_name}_split_a_a_split.yaml
+
+    v1中的绝对路径转换为相对于root_dir的路径，v1的标签保持不变。
+
+    参数:
+    - json_path: v1 JSON缓存路径
+    - output_dir: 输出目录
+    - root_dir: 数据集根目录，为None时从第一个文件路径推断
+    - dataset_name: 数据集名称，为None时使用JSON文件名
+
+    返回:
+    - 生成的文件路径列表
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    dataset_name = dataset_name or os.path.splitext(os.path.basename(json_path))[0]
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        stream = JsonStream(f)
+        if stream.peek() == '[':
+            files = _migrate_full(stream, output_dir, root_dir, dataset_name)
+        else:
+            files = _migrate_split(stream, output_dir, root_dir, dataset_name)
+
+    logger.info(f"v1缓存迁移完成: {json_path} -> {files}")
+    return files
+
+def _relative(path, root_dir):
+    """转换为相对路径，位于根目录下时直接截取前缀，避免逐个调用relpath"""
+    prefix = root_dir.rstrip(os.sep) + os.sep
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return os.path.relpath(path, root_dir)
+
+def _infer_root(path, dataset_name):
+    """
+    推断数据集根目录
+
+    v1的数据集目录为 os.path.join(dir, dataName)，缓存文件名为 {dataName}.json，
+    因此优先取路径中名为dataset_name的祖先目录，找不到时取类别目录的上一级
+    """
+    parent = os.path.dirname(path)
+    while parent and parent != os.path.dirname(parent):
+        if os.path.basename(parent) == dataset_name:
+            return parent
+        parent = os.path.dirname(parent)
+    return os.path.dirname(os.path.dirname(path))
+
+def _migrate_full(stream, output_dir, root_dir, dataset_name):
+    """迁移v1完整缓存，每次只在内存中保留一个类别"""
+    csv_path = os.path.join(output_dir, f'{dataset_name}.csv')
+    yaml_path = os.path.join(output_dir, f'{dataset_name}.yaml')
+    names, counts = {}, {}
+    total_images = 0
+    class_depth = None
+
+    with atomic_write(csv_path) as out:
+        out.write("rel_path,label\n")
+        for item in stream.iter_array():
+            paths = item['path']
+            if not paths:
+                continue
+            label = int(item['class'])
+            class_name = item['classname']
+            if root_dir is None:
+                root_dir = _infer_root(paths[0], dataset_name)
+            if class_depth is None:
+                class_depth = len(_relative(paths[0], root_dir).split(os.sep)) - 2
+
+            names[label] = class_name
+            counts[class_name] = counts.get(class_name, 0) + len(paths)
+            total_images += len(paths)
+            out.writelines(f"{_relative(path, root_dir)},{label}\n" for path in paths)
+
+    dataset_info = {
+        'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'class_depth': class_depth,
+        'class_pattern': None,
+        'data': dataset_name,
+        'path': root_dir,
+        'total_images': total_images,
+        'num_classes': len(names),
+        'names': dict(sorted(names.items())),
+        'counts': counts,
+    }
+    write_yaml_file(yaml_path, dataset_info, lazy_keys=('names', 'counts'))
+    logger.info(f"CSV文件已生成: {csv_path}")
+    return [csv_path, yaml_path]
+
+def _migrate_split(stream, output_dir, root_dir, dataset_name):
+    """迁移v1划分缓存，逐个样本写出；比例在写完后才能确定，因此先写临时文件再重命名"""
+    base_path = os.path.join(output_dir, f'{dataset_name}_split_a_a')
+    names = {}
+    split_counts = {}
+    tmp_paths = {}
+
+    for split_name in stream.iter_object_keys():
+        tmp_path = f'{base_path}_{split_name}.csv.tmp'
+        count = 0
+        with atomic_write(tmp_path) as out:
+            out.write("rel_path,label\n")
+            for path, label, class_name in stream.iter_array():
+                if root_dir is None:
+                    root_dir = _infer_root(path, dataset_name)
+                label = int(label)
+                names[label] = class_name
+                out.write(f"{_relative(path, root_dir)},{label}\n")
+                count += 1
+        if count:
+            split_counts[split_name] = count
+            tmp_paths[split_name] = tmp_path
+        else:
+            os.remove(tmp_path)
+
+    total = sum(split_counts.values())
+    split_ratio = {split_name: round(count / total, 2) for split_name, count in split_counts.items()}
+    split_info = {
+        'created_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'path': root_dir if root_dir else "",
+        'split_ratio': split_ratio,
+        'nc': len(names),
+        'train': None,
+        'val': None,
+        'test': None,
+        'name': dict(sorted(names.items())),
+    }
+
+    files = []
+    for split_name, tmp_path in tmp_paths.items():
+        csv_path = f"{base_path}_{split_name}_{_ratio_tag(split_ratio[split_name])}.csv"
+        # 临时文件已由atomic_write完整写入并落盘，重命名即原子发布
+        os.replace(tmp_path, csv_path)
+        split_info[split_name] = csv_path
+        files.append(csv_path)
+
+    yaml_path = f"{base_path}_split.yaml"
+    write_yaml_file(yaml_path, split_info, lazy_keys=('name',))
+    files.append(yaml_path)
+    return files